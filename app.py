@@ -7,10 +7,18 @@ Author: Final Project - Recommendation System
 import streamlit as st
 import pandas as pd
 import numpy as np
-import pickle
-import requests  # Thêm để lấy ảnh poster từ TMDB API
+import uuid
+from contextlib import nullcontext
 from datetime import datetime
 
+from ann_index import DEFAULT_N_PROBE, default_n_probe
+from embedding import BACKENDS, DEFAULT_BACKEND
+from history_store import HistoryStore, warm_result_cache
+from poster_service import PosterService
+from result_cache import ResultCache
+from model_reload import ModelReloader
+from instrumentation import Metrics, RequestTrace, setup_trace_log
+
 # Cấu hình trang
 st.set_page_config(
     page_title="🎬 Movie Recommender System",
@@ -63,175 +71,188 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_metrics():
+    """Bộ đếm / histogram latency dùng chung cho mọi session; bản ghi từng truy vấn ghi ra file JSON lines"""
+    setup_trace_log()
+    return Metrics()
+
 # Hàm load model
 @st.cache_resource
-def load_model():
+def get_model_reloader():
+    """
+    Model (memory-map) + các thành phần dựng từ model, dùng chung cho mọi session
+    Version mới trên đĩa được load ở thread nền rồi mới chuyển sang, không cần khởi động lại app
+    """
+    metrics = get_metrics()
+    history_store = get_history_store()
+
+    def on_reload(service):
+        # Làm nóng cache kết quả bằng các truy vấn hay gặp nhất trong lịch sử
+        metrics.incr('result_cache.warmed', warm_result_cache(service, history_store))
+
     try:
-        with open('movie_recommender_model.pkl', 'rb') as f:
-            data = pickle.load(f)
-        return data
+        reloader = ModelReloader(on_reload=on_reload, metrics=metrics)
     except FileNotFoundError:
-        st.error("❌ Không tìm thấy file model! Vui lòng chạy notebook trước để tạo model.")
+        st.error("❌ Không tìm thấy file model! Vui lòng chạy train_model.py trước để tạo model.")
         st.stop()
+    return reloader.start()
+
+@st.cache_resource
+def get_history_store():
+    """Lịch sử tìm kiếm dùng chung cho mọi session, lưu bền trong SQLite (ghi theo lô)"""
+    return HistoryStore()
 
 # ===== HÀM LẤY ẢNH POSTER TỪ TMDB API =====
-@st.cache_data
+@st.cache_resource
+def get_poster_service():
+    """PosterService dùng chung cho mọi session (connection pool + cache SQLite trên đĩa)"""
+    return PosterService()
+
 def fetch_poster(movie_id):
     """
     Lấy ảnh poster phim từ TMDB API
     Args:
         movie_id: ID phim trên TMDB
     Returns:
-        str: URL của ảnh poster
+        str: URL của ảnh poster (ảnh mặc định nếu không tìm thấy hoặc lỗi)
     """
-    try:
-        # API Key miễn phí của TMDB
-        api_key = "c7ec19ffdd3279641fb606d19ceb9bb1"
-        url = f"https://api.themoviedb.org/3/movie/{movie_id}?api_key={api_key}&language=vi-VN"
-        response = requests.get(url, timeout=5)
-        data = response.json()
-        
-        if 'poster_path' in data and data['poster_path']:
-            poster_path = data['poster_path']
-            full_path = f"https://image.tmdb.org/t/p/w500{poster_path}"
-            return full_path
-        else:
-            # Ảnh mặc định nếu không tìm thấy
-            return "https://via.placeholder.com/500x750?text=No+Poster"
-    except:
-        # Ảnh mặc định nếu lỗi (mất mạng, timeout...)
-        return "https://via.placeholder.com/500x750?text=No+Poster"
+    return get_poster_service().fetch(movie_id)
 
-# ===== HÀM GỢI Ý PHIM =====
+TITLE_SEARCH_LIMIT = 50
+# Số phim gợi ý hiển thị mỗi lần ("Xem thêm" mở tiếp trang sau)
+RESULTS_PAGE_SIZE = 10
+# Số truy vấn gần nhất mỗi session giữ lại nội dung hiển thị đã dựng
+RESULT_VIEW_CACHE_SIZE = 8
 
-# 1. Content-Based (1 phim)
-def get_recommendations(title, cosine_sim, indices, movies_data, top_n=10):
-    """Content-Based Filtering: Gợi ý dựa trên 1 phim"""
-    try:
-        idx = indices[title]
-        sim_scores = list(enumerate(cosine_sim[idx]))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[1:top_n+1]
-        movie_indices = [i[0] for i in sim_scores]
-        
-        result = movies_data.iloc[movie_indices].copy()
-        result['similarity_score'] = [score[1] for score in sim_scores]
-        return result
-    except KeyError:
-        return None
-
-# 2. Personalized (nhiều phim - User Profile)
-def get_personalized_recommendations(selected_titles, cosine_sim, indices, movies_data, top_n=10):
-    """Personalized: Tạo User Profile từ nhiều phim yêu thích"""
-    try:
-        movie_indices = []
-        for title in selected_titles:
-            if title in indices.index:
-                movie_indices.append(indices[title])
-        
-        if len(movie_indices) == 0:
-            return None
-        
-        # Tạo User Profile bằng cách cộng dồn similarity
-        total_scores = np.zeros(cosine_sim.shape[0])
-        for idx in movie_indices:
-            total_scores += cosine_sim[idx]
-        total_scores = total_scores / len(movie_indices)
-        
-        # Sắp xếp và lọc
-        sim_scores = list(enumerate(total_scores))
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-        sim_scores = [x for x in sim_scores if x[0] not in movie_indices]
-        
-        top_scores = sim_scores[:top_n]
-        top_indices = [i[0] for i in top_scores]
-        
-        result = movies_data.iloc[top_indices].copy()
-        result['personalization_score'] = [score[1] for score in top_scores]
-        
-        return result
-        
-    except Exception as e:
-        st.error(f"Lỗi: {str(e)}")
-        return None
-
-# 3. HYBRID (Content + Personalized + Popularity)
-def get_hybrid_recommendations(selected_titles, cosine_sim, indices, movies_data, top_n=10,
-                                content_weight=0.4, personalized_weight=0.4, popularity_weight=0.2):
-    """HYBRID System: Kết hợp Content + Personalized + Popularity như Netflix"""
-    try:
-        movie_indices = []
-        for title in selected_titles:
-            if title in indices.index:
-                movie_indices.append(indices[title])
-        
-        if len(movie_indices) == 0:
-            return None
-        
-        # Chuẩn hóa trọng số
-        total_weight = content_weight + personalized_weight + popularity_weight
-        if not np.isclose(total_weight, 1.0):
-            content_weight /= total_weight
-            personalized_weight /= total_weight
-            popularity_weight /= total_weight
-        
-        # Personalized scores
-        personalized_scores = np.zeros(cosine_sim.shape[0])
-        for idx in movie_indices:
-            personalized_scores += cosine_sim[idx]
-        personalized_scores = personalized_scores / len(movie_indices)
-        
-        # Content scores (tương tự)
-        content_scores = personalized_scores.copy()
-        
-        # Popularity scores (từ dữ liệu đã chuẩn hóa)
-        popularity_scores = movies_data['vote_avg_scaled'].values * 0.7 + \
-                           movies_data['popularity_scaled'].values * 0.3
-        
-        # Chuẩn hóa về [0, 1]
-        content_scores_norm = (content_scores - content_scores.min()) / (content_scores.max() - content_scores.min() + 1e-8)
-        personalized_scores_norm = (personalized_scores - personalized_scores.min()) / (personalized_scores.max() - personalized_scores.min() + 1e-8)
-        
-        # HYBRID SCORE
-        hybrid_scores = (
-            content_weight * content_scores_norm +
-            personalized_weight * personalized_scores_norm +
-            popularity_weight * popularity_scores
+# Cột điểm chính và cách định dạng theo mode
+SCORE_FORMATS = {
+    'Content-Based': ('similarity_score', '.2%'),
+    'Personalized': ('personalization_score', '.2%'),
+    'HYBRID (Netflix-style)': ('hybrid_score', '.3f'),
+}
+# Tên hiển thị của mode lưu trong lịch sử tìm kiếm
+MODE_LABELS = {'content': 'Content-Based', 'personalized': 'Personalized', 'hybrid': 'HYBRID (Netflix-style)'}
+
+def build_result_view(recommendations, recommendation_mode, num_recommendations, selected_movies):
+    """
+    Dựng sẵn nội dung hiển thị của danh sách gợi ý một lần cho mỗi truy vấn (từ các cột, không iterrows)
+    Returns:
+        dict: heading, ids, cards (markdown mỗi phim), overviews, components (Hybrid), csv, filename,
+        posters (lấy dần theo trang), shown (số phim đang hiển thị)
+    """
+    score_column, score_format = SCORE_FORMATS[recommendation_mode]
+    titles = recommendations['title'].tolist()
+    cards = [
+        f"### {title}\n\n"
+        f"⭐ **{rating:.1f}**/10 &nbsp;·&nbsp; 👥 **{int(votes):,}** votes &nbsp;·&nbsp; "
+        f"🎯 **Match:** {score:{score_format}} &nbsp;·&nbsp; 📈 **Pop:** {popularity:.1f}\n\n"
+        f"**Thể loại:** {genres}"
+        for title, rating, votes, score, popularity, genres in zip(
+            titles, recommendations['vote_average'].to_numpy(), recommendations['vote_count'].to_numpy(),
+            recommendations[score_column].to_numpy(), recommendations['popularity'].to_numpy(),
+            recommendations['genres_clean'].tolist())
+    ]
+    overviews = [text if isinstance(text, str) and text else None for text in recommendations['overview'].tolist()]
+
+    # Chọn cột phù hợp để export
+    export_cols = ['title', 'vote_average', 'vote_count', score_column, 'genres_clean']
+    components = None
+    if "HYBRID" in recommendation_mode:
+        export_cols.extend(['content_component', 'personalized_component', 'popularity_component'])
+        components = [
+            f"Content **{content:.2%}** &nbsp;·&nbsp; Personalized **{personalized:.2%}** "
+            f"&nbsp;·&nbsp; Popularity **{popularity:.2%}**"
+            for content, personalized, popularity in zip(
+                recommendations['content_component'].to_numpy(),
+                recommendations['personalized_component'].to_numpy(),
+                recommendations['popularity_component'].to_numpy())
+        ]
+
+    # Header tùy theo mode
+    if "HYBRID" in recommendation_mode:
+        heading = f"Top {num_recommendations} phim dành riêng cho bạn (HYBRID):"
+    elif "Personalized" in recommendation_mode:
+        heading = f"Top {num_recommendations} phim phù hợp với GU của bạn:"
+    else:
+        heading = f"Top {num_recommendations} phim tương tự:"
+
+    return {
+        'heading': heading,
+        'ids': recommendations['id'].tolist(),
+        'cards': cards,
+        'overviews': overviews,
+        'components': components,
+        'csv': recommendations[export_cols].to_csv(index=False),
+        'filename': f"recommendations_{'_'.join(selected_movies[:2]).replace(' ', '_')}.csv",
+        'posters': {},
+        'shown': RESULTS_PAGE_SIZE,
+    }
+
+def show_more_results():
+    st.session_state.result_view['shown'] += RESULTS_PAGE_SIZE
+
+def render_result_view(view, trace=None):
+    """Hiển thị các phim đã mở của danh sách gợi ý; poster chỉ được lấy cho các phim được hiển thị"""
+    shown = min(view['shown'], len(view['ids']))
+    missing = [movie_id for movie_id in view['ids'][:shown] if movie_id not in view['posters']]
+    if missing:
+        # Lấy poster cho cả trang cùng lúc (song song, có cache)
+        with trace.span('poster_fetch') if trace is not None else nullcontext():
+            view['posters'].update(get_poster_service().fetch_many(missing))
+
+    with trace.span('render') if trace is not None else nullcontext():
+        st.subheader(view['heading'])
+        for rank in range(shown):
+            col_rank, col_poster, col_content = st.columns([0.7, 1.5, 7.8])
+            col_rank.markdown(f"<div style='color: #FF6B6B; font-size: 1.8rem; font-weight: bold; white-space: nowrap;'>#{rank + 1}</div>", unsafe_allow_html=True)
+            col_poster.image(view['posters'][view['ids'][rank]], width="stretch")
+            with col_content:
+                st.markdown(view['cards'][rank])
+                if view['components'] is not None:
+                    with st.expander("🔍 Xem chi tiết điểm số"):
+                        st.markdown(view['components'][rank])
+                if view['overviews'][rank]:
+                    with st.expander("📖 Đọc tóm tắt"):
+                        st.write(view['overviews'][rank])
+
+        if shown < len(view['ids']):
+            st.button(f"Xem thêm {min(RESULTS_PAGE_SIZE, len(view['ids']) - shown)} phim",
+                      on_click=show_more_results, width="stretch")
+
+        # Download recommendations
+        st.divider()
+        st.download_button(
+            label="Tải xuống danh sách gợi ý (CSV)",
+            data=view['csv'],
+            file_name=view['filename'],
+            mime="text/csv",
+            width="stretch"
         )
-        
-        # Sắp xếp
-        scored_items = list(enumerate(hybrid_scores))
-        scored_items = sorted(scored_items, key=lambda x: x[1], reverse=True)
-        scored_items = [x for x in scored_items if x[0] not in movie_indices]
-        
-        top_items = scored_items[:top_n]
-        top_indices = [i[0] for i in top_items]
-        
-        result = movies_data.iloc[top_indices].copy()
-        result['hybrid_score'] = [item[1] for item in top_items]
-        result['content_component'] = [content_scores_norm[item[0]] for item in top_items]
-        result['personalized_component'] = [personalized_scores_norm[item[0]] for item in top_items]
-        result['popularity_component'] = [popularity_scores[item[0]] for item in top_items]
-        
-        return result
-        
-    except Exception as e:
-        st.error(f"Lỗi: {str(e)}")
-        return None
 
 # Load model và dữ liệu
-data = load_model()
-movies_data = data['movies_data']
-cosine_sim = data['cosine_sim']
-indices = data['indices']
+# Lấy service một lần cho cả lần chạy: model được reload ở nền thì lần chạy sau mới dùng version mới
+model_reloader = get_model_reloader()
+service = model_reloader.current()
+result_cache = service.result_cache
+movies_data = service.movies_data
+title_index = service.title_index
+has_ann_index = service.has_ann_index
+# neighbors / cosine_sim / tfidf_matrix chỉ được load khi mode tương ứng được dùng
 
-# Khởi tạo session state cho lịch sử tìm kiếm
-if 'search_history' not in st.session_state:
-    st.session_state.search_history = []
+# Lịch sử tìm kiếm lưu trên đĩa (giữ qua các session / khi khởi động lại), mỗi session có một ID
+history_store = get_history_store()
+if 'history_session' not in st.session_state:
+    st.session_state.history_session = uuid.uuid4().hex
 
 # Khởi tạo state cho việc hiển thị lịch sử
 if 'show_history' not in st.session_state:
     st.session_state.show_history = False
 
+# Nội dung hiển thị đã dựng của các truy vấn gần nhất trong session
+if 'result_views' not in st.session_state:
+    st.session_state.result_views = ResultCache(max_entries=RESULT_VIEW_CACHE_SIZE)
+
 # Header
 st.markdown('<h1 class="main-header">Movie Recommender System</h1>', unsafe_allow_html=True)
 st.markdown('<p class="sub-header">Tìm kiếm phim yêu thích và nhận gợi ý phim tương tự dựa trên nội dung</p>', unsafe_allow_html=True)
@@ -241,12 +262,13 @@ if st.session_state.show_history:
     st.divider()
     
     # Header với nút quay lại
+    history_count = history_store.count()
     col_title, col_back = st.columns([8, 2])
     with col_title:
-        if len(st.session_state.search_history) == 0:
+        if history_count == 0:
             st.subheader("📜 Lịch sử tìm kiếm")
         else:
-            st.subheader(f"📜 Lịch sử tìm kiếm ({len(st.session_state.search_history)} lần)")
+            st.subheader(f"📜 Lịch sử tìm kiếm ({history_count} lần)")
     with col_back:
         if st.button("← Quay lại", width="stretch"):
             st.session_state.show_history = False
@@ -254,32 +276,40 @@ if st.session_state.show_history:
     
     st.divider()
     
-    if len(st.session_state.search_history) == 0:
+    if history_count == 0:
         st.info("Chưa có lịch sử tìm kiếm. Hãy tìm kiếm phim để tạo lịch sử!")
     else:
+        # Lọc theo phim seed (các phim được tìm nhiều nhất)
+        top_titles = [title for title, _ in history_store.top_titles(50)]
+        history_filter = st.selectbox("Lọc theo phim:", ["Tất cả"] + top_titles)
         
         st.divider()
         
-        # Hiển thị lịch sử (đảo ngược để mới nhất ở trên)
-        for i, history in enumerate(reversed(st.session_state.search_history[-10:])):  # Chỉ hiển thị 10 lần gần nhất
+        # Hiển thị lịch sử (mới nhất ở trên), chỉ hiển thị 10 lần gần nhất
+        if history_filter == "Tất cả":
+            history_entries, history_total = history_store.recent(10), history_count
+        else:
+            history_entries = history_store.query(title=history_filter, limit=10)
+            history_total = len(history_entries)
+        for i, history in enumerate(history_entries):
             with st.container():
                 col_num, col_info = st.columns([1, 9])
                 with col_num:
-                    st.markdown(f"### #{len(st.session_state.search_history) - i}")
+                    st.markdown(f"### #{history_total - i}")
                 with col_info:
                     st.markdown(f"""
-                    **🕐 Thời gian:** {history['time']}  
-                    **🎯 Mode:** {history['mode']}  
-                    **🎬 Phim đã chọn:** {', '.join(history['movies'][:3])}{'...' if len(history['movies']) > 3 else ''}  
+                    **🕐 Thời gian:** {datetime.fromtimestamp(history['time']).strftime("%d/%m/%Y %H:%M")}  
+                    **🎯 Mode:** {MODE_LABELS.get(history['mode'], history['mode'])}  
+                    **🎬 Phim đã chọn:** {', '.join(history['titles'][:3])}{'...' if len(history['titles']) > 3 else ''}  
                     **📊 Số kết quả:** {history['num_results']} phim
                     """)
                 st.divider()
         
-        # Nút xóa lịch sử
+        # Nút xóa lịch sử: chỉ xóa các lần tìm kiếm của phiên hiện tại, lịch sử của phiên khác giữ nguyên
         col_delete, col_spacer = st.columns([2, 8])
         with col_delete:
-            if st.button("🗑️ Xóa toàn bộ lịch sử", width="stretch"):
-                st.session_state.search_history = []
+            if st.button("🗑️ Xóa lịch sử của phiên này", width="stretch"):
+                history_store.clear(session_id=st.session_state.history_session)
                 st.session_state.show_history = False
                 st.rerun()
 
@@ -289,10 +319,10 @@ with st.sidebar:
     st.metric("Tổng số phim", f"{len(movies_data):,}")
     
     # Button lịch sử tìm kiếm (toggle)
-    history_count = len(st.session_state.search_history)
+    history_count = history_store.count()
     button_label = f"📜 Lịch sử ({history_count})" if history_count > 0 else "📜 Lịch sử"
     
-    if st.button(button_label, width="stretch"):
+    if st.button(button_label, key="history_toggle", width="stretch"):
         st.session_state.show_history = not st.session_state.show_history
         st.rerun()  # Reload ngay lập tức
     
@@ -322,7 +352,7 @@ with st.sidebar:
             "T16 (16+)",
             "T18 (18+)",
         ],
-        help="Hệ thống sẽ lọc kết quả dựa trên phân loại độ tuổi (Post-filtering theo thể loại phim)",
+        help="Hệ thống chỉ xếp hạng các phim có thể loại phù hợp với phân loại độ tuổi",
         index=0,
     )
 
@@ -349,8 +379,50 @@ with st.sidebar:
         total = content_w + personalized_w + popularity_w
         if not np.isclose(total, 1.0):
             st.warning(f"⚠️ Tổng = {total*100:.0f}% (sẽ tự động chuẩn hóa về 100%)")
+
+        two_stage = st.checkbox(
+            "Chấm điểm 2 bước (nhanh)", value=False,
+            help="Chỉ chấm điểm Hybrid trên hàng xóm của các phim đã chọn và các phim phổ biến nhất. "
+                 "Kết quả xấp xỉ: có thể bỏ sót phim so với chấm điểm toàn catalog, và điểm được chuẩn hóa "
+                 "theo min / max ước lượng (trừ khi vừa chấm điểm đầy đủ cùng các phim này)"
+        )
     else:
         content_w, personalized_w, popularity_w = 0.4, 0.4, 0.2
+        two_stage = False
+
+    # Backend chấm điểm hồ sơ (chỉ có khi model được train với --embedding-dim)
+    score_backend = DEFAULT_BACKEND
+    if service.has_embedding and "Content-Based" not in recommendation_mode:
+        st.divider()
+        score_backend = st.selectbox(
+            "Backend chấm điểm", BACKENDS, index=BACKENDS.index(DEFAULT_BACKEND),
+            format_func=lambda name: {'tfidf': 'TF-IDF (chính xác)', 'embedding': 'Embedding SVD (nhanh)'}[name],
+            help="Embedding: vector hồ sơ vài trăm chiều, chấm điểm cả catalog bằng một phép nhân nhỏ"
+        )
+        # Hybrid 2 bước chỉ dùng với điểm TF-IDF (RecommenderService.recommend)
+        two_stage = two_stage and score_backend == DEFAULT_BACKEND
+
+    # Núm điều chỉnh recall / tốc độ của ANN index (chỉ có khi model được train với --ann)
+    ann_n_probe = DEFAULT_N_PROBE
+    if has_ann_index and "Content-Based" not in recommendation_mode and score_backend == 'tfidf':
+        st.divider()
+        n_lists = service.ann_index[1].shape[0]
+        ann_n_probe = st.slider(
+            "ANN n_probe", 1, n_lists, default_n_probe(n_lists), 1,
+            help=f"Số cụm được dò khi tìm phim (trên {n_lists} cụm): càng lớn càng chính xác nhưng chậm hơn, "
+                 "dò hết các cụm thì giống chấm điểm chính xác; phim ngoài các cụm được dò không được gợi ý"
+        )
+
+    cache_stats = result_cache.stats()
+    st.caption(f"⚡ Cache kết quả: {cache_stats['hit_rate']*100:.0f}% hit "
+               f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']} lượt, "
+               f"{cache_stats['size']} kết quả)")
+
+    show_debug = st.checkbox("🛠️ Debug / đo thời gian", value=False)
+    profile_queries = show_debug and st.checkbox(
+        "Profile truy vấn (cProfile)", value=False,
+        help="Chạy cProfile trong suốt truy vấn tiếp theo (chậm hơn)"
+    )
 
 # Chỉ hiển thị main content khi KHÔNG xem lịch sử
 if not st.session_state.show_history:
@@ -358,21 +430,32 @@ if not st.session_state.show_history:
     col1, col2 = st.columns([3, 1])
 
     with col1:
+        # Tìm nhanh tên phim (chịu được gõ sai), rút gọn danh sách lựa chọn bên dưới
+        title_query = st.text_input(
+            "🔎 Tìm nhanh tên phim:",
+            placeholder="Gõ tên phim, không cần chính xác (vd: drak knight)"
+        ).strip()
+        # Danh sách tên đã sắp xếp sẵn trong title index, không sort lại catalog mỗi lần rerun
+        title_options = title_index.search(title_query, limit=TITLE_SEARCH_LIMIT) if title_query else title_index.sorted_titles
+
         # Tìm kiếm phim - thay đổi theo mode
         if "Content-Based" in recommendation_mode:
             # Single select cho Content-Based
             search_option = st.selectbox(
                 "Chọn phim yêu thích của bạn:",
-                options=[""] + sorted(movies_data['title'].tolist()),
-                index=0
+                options=[""] + title_options,
+                index=1 if title_query and title_options else 0
             )
             selected_movies = [search_option] if search_option != "" else []
         else:
             # Multi-select cho Personalized và Hybrid
+            # Giữ các phim đã chọn trong danh sách khi đổi từ khóa tìm kiếm
+            chosen = st.session_state.get('selected_movies', [])
             selected_movies = st.multiselect(
                 "Chọn 3-5 phim bạn yêu thích:",
-                options=sorted(movies_data['title'].tolist()),
+                options=list(dict.fromkeys([*chosen, *title_options])) if title_query else title_options,
                 default=[],
+                key='selected_movies',
                 help="Chọn nhiều phim để hệ thống hiểu rõ GU của bạn hơn"
             )
 
@@ -387,6 +470,7 @@ if not st.session_state.show_history:
         )
 
     # Nút tìm kiếm
+    result_rendered = False
     button_label = "Tìm phim tương tự" if "Content-Based" in recommendation_mode else "Tìm phim phù hợp với tôi"
     if st.button(button_label, width="stretch"):
         if len(selected_movies) == 0:
@@ -443,175 +527,100 @@ if not st.session_state.show_history:
                 
                 st.divider()
                 
-                # Gọi hàm tương ứng với mode
-                if "Content-Based" in recommendation_mode:
-                    recommendations = get_recommendations(
-                        selected_movies[0], 
-                        cosine_sim, 
-                        indices, 
-                        movies_data, 
-                        top_n=num_recommendations
-                    )
-                    score_column = 'similarity_score'
-                    score_label = "🎯 Match"
-                elif "Personalized" in recommendation_mode:
-                    recommendations = get_personalized_recommendations(
-                        selected_movies,
-                        cosine_sim,
-                        indices,
-                        movies_data,
-                        top_n=num_recommendations
-                    )
-                    score_column = 'personalization_score'
-                    score_label = "👤 Personal Match"
-                else:  # HYBRID
-                    recommendations = get_hybrid_recommendations(
-                        selected_movies,
-                        cosine_sim,
-                        indices,
-                        movies_data,
-                        top_n=num_recommendations,
-                        content_weight=content_w,
-                        personalized_weight=personalized_w,
-                        popularity_weight=popularity_w
-                    )
-                    score_column = 'hybrid_score'
-                    score_label = "⭐ Hybrid Score"
-
-                # [THAY THẾ] Context-Aware Logic: Lọc theo phân loại độ tuổi (Post-filtering)
-                # Lưu ý: Dataset TMDB không có nhãn kiểm duyệt chính thức, nên dùng genre làm proxy để lọc an toàn nội dung.
-                if recommendations is not None and not age_context.startswith("P"):
-                    recommendations_before_filter = recommendations
-
-                    # Logic: Map Độ tuổi -> Thể loại phim cho phép
-                    if age_context.startswith("K"):
-                        # CHẶT CHẼ: Chỉ cho phép phim Hoạt hình và Gia đình
-                        recommendations = recommendations[
-                            recommendations["genres_clean"].str.contains(
-                                r"Animation|Family", case=False, na=False
-                            )
-                        ]
-                    elif age_context.startswith("T13"):
-                        # Ưu tiên: Hành động, Phiêu lưu, Hài, Khoa học viễn tưởng
-                        recommendations = recommendations[
-                            recommendations["genres_clean"].str.contains(
-                                r"Action|Adventure|Comedy|Science Fiction|Fantasy|Romance",
-                                case=False,
-                                na=False,
-                            )
-                        ]
-                    elif age_context.startswith("T16"):
-                        # Nội dung trưởng thành hơn: thêm Drama/Crime/Thriller/War/History
-                        recommendations = recommendations[
-                            recommendations["genres_clean"].str.contains(
-                                r"Action|Adventure|Comedy|Science Fiction|Fantasy|Romance|Drama|Crime|Thriller|War|History",
-                                case=False,
-                                na=False,
-                            )
-                        ]
-                    elif age_context.startswith("T18"):
-                        # Người lớn: cho phép thêm Horror và các thể loại nặng đô
-                        recommendations = recommendations[
-                            recommendations["genres_clean"].str.contains(
-                                r"Drama|Crime|Thriller|Romance|War|Horror|History",
-                                case=False,
-                                na=False,
-                            )
-                        ]
-
-                    # Fallback: Nếu lọc xong mà hết phim
-                    if recommendations.empty:
-                        st.warning(
-                            f"⚠️ Không tìm thấy phim phù hợp phân loại '{age_context}' trong danh sách này. Đang hiển thị lại tất cả..."
+                # Đo thời gian từng bước của truy vấn (ghi ra debug panel + trace log)
+                metrics = get_metrics()
+                mode_key = {'Content-Based': 'content', 'Personalized': 'personalized'}.get(
+                    recommendation_mode, 'hybrid')
+                trace = RequestTrace(mode_key, profile=profile_queries, n_seeds=len(selected_movies),
+                                     top_n=num_recommendations, age=age_context.split()[0])
+                weights = (content_w, personalized_w, popularity_w) if mode_key == 'hybrid' else None
+
+                # Nội dung hiển thị đã dựng của truy vấn giống hệt (trong session) được dùng lại nguyên vẹn
+                view_key = (service.version, mode_key, tuple(sorted(selected_movies)), num_recommendations,
+                            weights, age_context, ann_n_probe, two_stage, score_backend)
+                with trace.span('cache_lookup'):
+                    view = st.session_state.result_views.get(view_key)
+                recommendations, cache_hit = None, view is not None
+                if view is None:
+                    # Cache kết quả, mask độ tuổi và chấm điểm nằm trong RecommenderService (service.py)
+                    try:
+                        recommendations, cache_hit = service.recommend(
+                            mode_key,
+                            selected_movies,
+                            top_n=num_recommendations,
+                            weights=weights,
+                            age=age_context,
+                            n_probe=ann_n_probe,
+                            two_stage=two_stage,
+                            trace=trace,
+                            backend=score_backend
                         )
-                        recommendations = recommendations_before_filter
+                        metrics.incr('result_cache.hit' if cache_hit else 'result_cache.miss')
+                    except Exception as e:
+                        st.error(f"Lỗi: {str(e)}")
+                        metrics.incr('errors')
 
-                if recommendations is None:
-                    st.error("❌ Không thể tìm thấy phim trong cơ sở dữ liệu.")
-                else:
-                    # Lưu vào lịch sử tìm kiếm
-                    from datetime import datetime
-                    history_entry = {
-                        'time': datetime.now().strftime("%d/%m/%Y %H:%M"),
-                        'mode': recommendation_mode,
-                        'movies': selected_movies,
-                        'num_results': num_recommendations
-                    }
-                    st.session_state.search_history.append(history_entry)
-                    
-                    # Header tùy theo mode
-                    if "HYBRID" in recommendation_mode:
-                        st.subheader(f"Top {num_recommendations} phim dành riêng cho bạn (HYBRID):")
-                    elif "Personalized" in recommendation_mode:
-                        st.subheader(f"Top {num_recommendations} phim phù hợp với GU của bạn:")
+                    if recommendations is None:
+                        st.error("❌ Không thể tìm thấy phim trong cơ sở dữ liệu.")
+                    elif recommendations.empty:
+                        st.warning(f"⚠️ Không tìm thấy phim phù hợp phân loại '{age_context}'.")
                     else:
-                        st.subheader(f"Top {num_recommendations} phim tương tự:")
-                    
-                    # Hiển thị từng phim gợi ý
-                    for rank, (idx, row) in enumerate(recommendations.iterrows(), start=1):
-                        with st.container():
-                            st.markdown('<div class="movie-card">', unsafe_allow_html=True)
-                            
-                            col_rank, col_poster, col_content = st.columns([0.7, 1.5, 7.8])
-                            
-                            with col_rank:
-                                st.markdown(f"<div style='color: #FF6B6B; font-size: 1.8rem; font-weight: bold; white-space: nowrap;'>#{rank}</div>", unsafe_allow_html=True)
-                            
-                            with col_poster:
-                                # Hiển thị ảnh poster
-                                poster_url = fetch_poster(row['id'])
-                                st.image(poster_url, width="stretch")
-                            
-                            with col_content:
-                                st.markdown(f"### {row['title']}")
-                                
-                                # Hiển thị metrics tùy theo mode
-                                if "HYBRID" in recommendation_mode:
-                                    col_a, col_b, col_c, col_d = st.columns(4)
-                                    col_a.write(f"⭐ **{row['vote_average']:.1f}**/10")
-                                    col_b.write(f"👥 **{int(row['vote_count']):,}** votes")
-                                    col_c.write(f"🎯 **Match:** {row[score_column]:.3f}")
-                                    col_d.write(f"📈 **Pop:** {row['popularity']:.1f}")
-                                    
-                                    # Thêm chi tiết các components
-                                    with st.expander("🔍 Xem chi tiết điểm số"):
-                                        comp_cols = st.columns(3)
-                                        comp_cols[0].metric("Content", f"{row['content_component']:.2%}")
-                                        comp_cols[1].metric("Personalized", f"{row['personalized_component']:.2%}")
-                                        comp_cols[2].metric("Popularity", f"{row['popularity_component']:.2%}")
-                                else:
-                                    col_a, col_b, col_c, col_d = st.columns(4)
-                                    col_a.write(f"⭐ **{row['vote_average']:.1f}**/10")
-                                    col_b.write(f"👥 **{int(row['vote_count']):,}** votes")
-                                    col_c.write(f"🎯 **Match:** {row[score_column]:.2%}")
-                                    col_d.write(f"📈 **Pop:** {row['popularity']:.1f}")
-                                
-                                st.write(f"**Thể loại:** {row['genres_clean']}")
-                                
-                                if pd.notna(row['overview']) and row['overview']:
-                                    with st.expander("📖 Đọc tóm tắt"):
-                                        st.write(row['overview'])
-                            
-                            st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    # Download recommendations
-                    st.divider()
-                    
-                    # Chọn cột phù hợp để export
-                    export_cols = ['title', 'vote_average', 'vote_count', score_column, 'genres_clean']
-                    if "HYBRID" in recommendation_mode:
-                        export_cols.extend(['content_component', 'personalized_component', 'popularity_component'])
-                    
-                    csv = recommendations[export_cols].to_csv(index=False)
-                    filename = f"recommendations_{'_'.join(selected_movies[:2]).replace(' ', '_')}.csv"
-                    st.download_button(
-                        label="Tải xuống danh sách gợi ý (CSV)",
-                        data=csv,
-                        file_name=filename,
-                        mime="text/csv",
-                        width="stretch"
+                        view = build_result_view(recommendations, recommendation_mode, num_recommendations,
+                                                 selected_movies)
+                        st.session_state.result_views.put(view_key, view)
+                else:
+                    metrics.incr('result_view.hit')
+
+                st.session_state.result_view = view
+                if view is not None:
+                    # Lưu vào lịch sử tìm kiếm (cùng tham số truy vấn để làm nóng cache lần sau)
+                    history_store.record(
+                        mode_key, selected_movies, top_n=num_recommendations, age=age_context.split()[0],
+                        weights=weights, backend=score_backend, n_probe=ann_n_probe, two_stage=two_stage,
+                        num_results=len(view['ids']), session_id=st.session_state.history_session
                     )
 
+                    # Trang đầu tiên, hiển thị lại từ session state ở các lần rerun sau
+                    view['shown'] = RESULTS_PAGE_SIZE
+                    render_result_view(view, trace)
+                    result_rendered = True
+
+                record = trace.finish(metrics, cache_hit=cache_hit, n_results=0 if view is None else len(view['ids']))
+                st.session_state.last_trace = (record, trace.profile_text)
+
+    # Kết quả của truy vấn gần nhất vẫn hiển thị khi đổi sidebar / rerun, không dựng lại danh sách
+    if not result_rendered and st.session_state.get('result_view') is not None:
+        render_result_view(st.session_state.result_view)
+
+# Debug panel: span thời gian của truy vấn gần nhất, bộ đếm và histogram latency của process
+if show_debug:
+    with st.sidebar:
+        with st.expander("🛠️ Debug", expanded=True):
+            if 'last_trace' in st.session_state:
+                record, profile_text = st.session_state.last_trace
+                st.caption(f"Truy vấn gần nhất ({record['request']}, {record['total_ms']:.1f} ms, "
+                           f"{'cache hit' if record['cache_hit'] else 'cache miss'})")
+                st.dataframe(pd.DataFrame({'ms': record['spans_ms']}), width="stretch")
+                if profile_text:
+                    st.code(profile_text, language=None)
+            snapshot = get_metrics().snapshot()
+            poster_service = get_poster_service()
+            counters = {**snapshot['counters'],
+                        'poster_cache.hit': poster_service.cache_hits,
+                        'poster_cache.miss': poster_service.cache_misses}
+            st.caption("Bộ đếm")
+            st.dataframe(pd.DataFrame({'value': counters}), width="stretch")
+            if snapshot['latency']:
+                st.caption("Latency (ms)")
+                st.dataframe(pd.DataFrame(snapshot['latency']).T[['count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms']],
+                             width="stretch")
+            reload_stats = model_reloader.stats()
+            st.caption(f"Model {service.version} (đã reload {reload_stats['reloads']} lần)")
+            if reload_stats['last_reload']:
+                st.dataframe(pd.DataFrame({'value': reload_stats['last_reload']}).astype(str), width="stretch")
+            if reload_stats['last_error']:
+                st.warning(f"Reload lỗi: {reload_stats['last_error']}")
+
 # Footer
 st.divider()
 st.markdown("""
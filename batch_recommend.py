@@ -0,0 +1,358 @@
+"""
+Gợi ý phim theo lô (offline): tính sẵn "phim tương tự" cho toàn bộ catalog
+hoặc chấm điểm hàng nghìn danh sách phim seed của người dùng
+- Dùng chung logic với get_recommendations / get_personalized_recommendations / get_hybrid_recommendations
+- Personalized / Hybrid: chấm điểm cả một block truy vấn bằng một tích ma trận; model có ANN index
+  (train với --ann) thì mặc định chấm điểm từng truy vấn qua profile_components + IVF index như
+  app / HTTP service (cùng kết quả), --exact để chấm điểm chính xác toàn catalog
+- Đọc truy vấn và ghi kết quả ra Parquet / CSV theo từng chunk, không giữ toàn bộ trong bộ nhớ
+
+File truy vấn (CSV hoặc JSONL), mỗi dòng một truy vấn:
+    query_id   : mã truy vấn (mặc định: số thứ tự dòng)
+    mode       : content | personalized | hybrid (mặc định: --mode)
+    titles     : các title seed ngăn cách bởi '|' (JSONL có thể dùng list), không phân biệt hoa thường / dấu;
+                 --fuzzy: title gõ sai được khớp với phim gần đúng nhất
+    top_n, content_weight, personalized_weight, popularity_weight, age (P/K/T13/T16/T18): tùy chọn
+    seed_weights : trọng số từng title seed ngăn cách bởi '|' (ví dụ theo độ mới / điểm đánh giá), tùy chọn
+
+Ví dụ:
+    python batch_recommend.py queries.csv --output results.parquet
+    python batch_recommend.py --all-titles --top-n 20 --output similar_titles.csv
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ann_index import DEFAULT_N_PROBE
+from embedding import BACKENDS, DEFAULT_BACKEND, model_vectors
+from recommender import (MAX_BLOCK_ELEMENTS, age_context_mask, build_genre_bits, build_seed_weights,
+                         get_neighbors, hybrid_scores, model_popularity_prior, normalize_weights,
+                         normalized, profile_components, profile_scores_block, rank_top_n, title_positions)
+from model_store import MODEL_DIR, open_model
+from title_index import TitleIndex
+
+MODES = ['content', 'personalized', 'hybrid']
+QUERY_CHUNK_ROWS = 10000
+DEFAULT_WEIGHTS = {'content_weight': 0.4, 'personalized_weight': 0.4, 'popularity_weight': 0.2}
+
+# Schema cố định để mọi chunk ghi vào cùng một file Parquet / CSV
+RESULT_COLUMNS = {
+    'query_id': object,
+    'mode': object,
+    'rank': np.int32,
+    'movie_id': np.int64,
+    'title': object,
+    'score': np.float64,
+    'content_component': np.float64,
+    'personalized_component': np.float64,
+    'popularity_component': np.float64,
+}
+
+
+def read_queries(path, chunk_rows=QUERY_CHUNK_ROWS):
+    """Đọc file truy vấn (CSV hoặc JSONL) theo từng chunk DataFrame"""
+    if path.endswith(('.jsonl', '.json')):
+        reader = pd.read_json(path, lines=True, chunksize=chunk_rows, dtype=False)
+    else:
+        reader = pd.read_csv(path, chunksize=chunk_rows, dtype={'query_id': str, 'titles': str})
+    start = 0
+    for chunk in reader:
+        if 'query_id' not in chunk.columns:
+            chunk['query_id'] = np.arange(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk.reset_index(drop=True)
+
+
+def all_title_queries(movies_data, chunk_rows=QUERY_CHUNK_ROWS):
+    """Truy vấn Content-Based cho mọi phim trong catalog (tính sẵn "phim tương tự")"""
+    titles = movies_data['title'].values
+    for start in range(0, len(titles), chunk_rows):
+        chunk_titles = titles[start:start + chunk_rows]
+        yield pd.DataFrame({'query_id': chunk_titles, 'mode': 'content', 'titles': chunk_titles})
+
+
+def _seed_titles(value):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [str(title) for title in value]
+    if not isinstance(value, str):
+        return []
+    return [title.strip() for title in value.split('|') if title.strip()]
+
+
+def _seed_weights(value, n_titles):
+    """Trọng số seed của một truy vấn (list hoặc chuỗi ngăn cách bởi '|'), None nếu không có"""
+    if isinstance(value, str):
+        value = [weight for weight in value.split('|') if weight.strip()]
+    elif not isinstance(value, (list, tuple, np.ndarray)):
+        return None
+    values = np.asarray(value, dtype=np.float64)
+    if values.shape != (n_titles,):
+        raise ValueError(f"seed_weights có {values.shape[0]} giá trị nhưng truy vấn có {n_titles} title")
+    return values
+
+
+class EligibleMasks:
+    """Mask phân loại độ tuổi theo từng age key, chỉ tính một lần cho mỗi key"""
+
+    def __init__(self, data):
+        if 'genre_bits' in data:
+            self.genre_bits, self.genre_names = data['genre_bits'], data['genre_names']
+        else:
+            self.genre_bits, self.genre_names = build_genre_bits(data['movies_data']['genres_clean'].str.split())
+        self._masks = {}
+
+    def get(self, age_key):
+        age_key = str(age_key).split()[0] if isinstance(age_key, str) and age_key.strip() else None
+        if age_key not in self._masks:
+            self._masks[age_key] = age_context_mask(self.genre_bits, self.genre_names, age_key)
+        return self._masks[age_key]
+
+
+def recommend_batch(queries, data, masks, mode='hybrid', top_n=10, block_size=None, title_index=None,
+                    fuzzy=False, backend=DEFAULT_BACKEND, n_probe=DEFAULT_N_PROBE, exact=False):
+    """
+    Gợi ý cho một chunk truy vấn
+    Args:
+        queries: DataFrame các truy vấn (xem định dạng ở đầu file)
+        data: model từ open_model()
+        masks: EligibleMasks của model
+        mode, top_n: giá trị mặc định khi truy vấn không ghi rõ
+        block_size: số truy vấn Personalized / Hybrid chấm điểm trong một tích ma trận
+            (mặc định: sao cho block B × N không vượt MAX_BLOCK_ELEMENTS)
+        title_index: TitleIndex của model để khớp title đã chuẩn hóa (None: chỉ khớp chính xác qua indices)
+        fuzzy: khớp gần đúng các title không tìm thấy (cần title_index)
+        backend: 'tfidf' | 'embedding' - ma trận dùng để chấm điểm Personalized / Hybrid
+        n_probe: số cụm ANN được dò (None = một nửa số cụm), như RecommenderService.recommend
+        exact: bỏ qua ANN index của model, chấm điểm chính xác toàn catalog (kết quả có thể khác app /
+            HTTP service, vốn dùng ANN index khi model có)
+    Returns:
+        (results, n_missing): DataFrame kết quả dạng dài (mỗi phim gợi ý một dòng)
+        và số truy vấn không có title nào trong model
+    Raises:
+        ValueError: mode không hợp lệ
+    """
+    movies_data = data['movies_data']
+    indices = data['indices']
+    n = len(movies_data)
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // max(n, 1))
+
+    query_ids = queries['query_id'].astype(str).values
+    modes = (queries['mode'].fillna(mode) if 'mode' in queries.columns
+             else pd.Series(mode, index=queries.index)).str.lower().values
+    unknown = sorted(set(modes) - set(MODES))
+    if unknown:
+        raise ValueError(f"Mode không hợp lệ: {unknown} (chọn trong {MODES})")
+    top_ns = (queries['top_n'].fillna(top_n) if 'top_n' in queries.columns
+              else pd.Series(top_n, index=queries.index)).astype(int).values
+    ages = queries['age'].values if 'age' in queries.columns else [None] * len(queries)
+    weights = {name: (queries[name].fillna(default) if name in queries.columns
+                      else pd.Series(default, index=queries.index)).astype(float).values
+               for name, default in DEFAULT_WEIGHTS.items()}
+    # Tra title của cả chunk trong một lần (mảng vị trí, -1 = không có trong model)
+    titles = [_seed_titles(value) for value in queries['titles'].values]
+    flat_titles = [title for query_titles in titles for title in query_titles]
+    located = title_index.locate(flat_titles, fuzzy) if title_index is not None \
+        else title_positions(flat_titles, indices)
+    located = np.split(located, np.cumsum([len(query_titles) for query_titles in titles])[:-1])
+    seeds = [query_located[query_located >= 0].tolist() for query_located in located]
+    # Trọng số riêng từng phim seed (tùy chọn), bỏ trọng số của title không tìm thấy
+    raw_weights = queries['seed_weights'].values if 'seed_weights' in queries.columns else [None] * len(queries)
+    seed_weights = []
+    for query_titles, query_located, value in zip(titles, located, raw_weights):
+        values = _seed_weights(value, len(query_titles))
+        seed_weights.append(None if values is None else values[query_located >= 0])
+
+    parts = []
+
+    def add(row, positions, scores, components=None):
+        part = {
+            'row': np.full(len(positions), row),
+            'rank': np.arange(1, len(positions) + 1, dtype=np.int32),
+            'position': np.asarray(positions, dtype=np.int64),
+            'score': np.asarray(scores, dtype=np.float64),
+        }
+        for name, values in zip(['content_component', 'personalized_component', 'popularity_component'],
+                                components or [None] * 3):
+            part[name] = np.full(len(positions), np.nan) if values is None else values
+        parts.append(part)
+
+    # 1. Content-Based: đọc thẳng từ neighbor index (phim đầu tiên của truy vấn)
+    content_rows = [row for row in range(len(queries)) if modes[row] == 'content' and seeds[row]]
+    if content_rows:
+        neighbors = data['neighbors']
+        tfidf_matrix = data.get('tfidf_matrix')
+        for row in content_rows:
+            positions, scores = get_neighbors(neighbors, seeds[row][0], top_ns[row],
+                                              masks.get(ages[row]), tfidf_matrix)
+            add(row, positions, scores)
+
+    # 2. Personalized / Hybrid: chấm điểm từng block truy vấn bằng tích ma trận
+    profile_rows = [row for row in range(len(queries)) if modes[row] != 'content' and seeds[row]]
+    if profile_rows:
+        cosine_sim, tfidf_matrix, use_ann = model_vectors(data, backend)
+        if cosine_sim is not None:
+            tfidf_matrix = None
+        # Cùng điều kiện với RecommenderService.recommend: IVF index chỉ dùng cho TF-IDF của model top-K
+        ann_index = (data['ann_centroids'], data['ann_lists']) \
+            if use_ann and not exact and cosine_sim is None and 'ann_centroids' in data else None
+        popularity = model_popularity_prior(data)
+        for start in range(0, len(profile_rows), block_size):
+            rows = profile_rows[start:start + block_size]
+            if ann_index is None:
+                block = profile_scores_block(
+                    build_seed_weights([seeds[row] for row in rows], n, [seed_weights[row] for row in rows]),
+                    cosine_sim, tfidf_matrix)
+            else:
+                # ANN: mỗi truy vấn chỉ chấm điểm các cụm gần vector hồ sơ của nó (phim khác nhận -inf)
+                block = np.vstack([profile_components(seeds[row], None, tfidf_matrix, ann_index, n_probe,
+                                                      seed_weights=seed_weights[row])[0] for row in rows])
+            hybrid_rows = [i for i, row in enumerate(rows) if modes[row] == 'hybrid']
+            hybrid_of = {i: j for j, i in enumerate(hybrid_rows)}
+            if hybrid_rows:
+                block_weights = np.array([normalize_weights(*(weights[name][rows[i]] for name in DEFAULT_WEIGHTS))
+                                          for i in hybrid_rows])
+                hybrid, low, high = hybrid_scores(
+                    block[hybrid_rows], popularity, *(block_weights[:, [j]] for j in range(3))
+                )
+                if ann_index is not None:
+                    hybrid[np.isneginf(block[hybrid_rows])] = -np.inf
+            for i, row in enumerate(rows):
+                eligible = masks.get(ages[row])
+                if modes[row] == 'hybrid':
+                    j = hybrid_of[i]
+                    positions, scores = rank_top_n(hybrid[j], top_ns[row], exclude=seeds[row], eligible=eligible)
+                    component = normalized(block[i][positions], low[j], high[j])
+                    add(row, positions, scores, [component, component, popularity[positions]])
+                else:
+                    positions, scores = rank_top_n(block[i], top_ns[row], exclude=seeds[row], eligible=eligible)
+                    add(row, positions, scores)
+
+    n_missing = sum(1 for row in range(len(queries)) if not seeds[row])
+    if not parts:
+        return pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in RESULT_COLUMNS.items()}), n_missing
+
+    merged = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+    positions = merged.pop('position')
+    rows = merged.pop('row')
+    results = pd.DataFrame({
+        'query_id': query_ids[rows],
+        'mode': modes[rows],
+        'rank': merged['rank'],
+        'movie_id': movies_data['id'].values[positions].astype(np.int64),
+        'title': movies_data['title'].values[positions],
+        'score': merged['score'],
+        'content_component': merged['content_component'],
+        'personalized_component': merged['personalized_component'],
+        'popularity_component': merged['popularity_component'],
+    })
+    # Giữ thứ tự truy vấn như trong file đầu vào
+    order = np.lexsort((results['rank'].values, rows))
+    return results.iloc[order].reset_index(drop=True), n_missing
+
+
+class ResultWriter:
+    """Ghi kết quả theo từng chunk ra Parquet (pyarrow) hoặc CSV"""
+
+    def __init__(self, path):
+        self.path = path
+        self.parquet = path.endswith('.parquet')
+        self.rows = 0
+        self._writer = None
+        self._started = False
+
+    def write(self, results):
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = pa.schema([(name, pa.string() if dtype is object else pa.from_numpy_dtype(dtype))
+                                for name, dtype in RESULT_COLUMNS.items()])
+            table = pa.Table.from_pandas(results.astype(RESULT_COLUMNS), schema=schema, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, schema)
+            self._writer.write_table(table)
+        else:
+            results.to_csv(self.path, mode='a' if self._started else 'w', header=not self._started, index=False)
+        self._started = True
+        self.rows += len(results)
+
+    def close(self):
+        if not self._started:
+            # Không có kết quả nào: vẫn tạo file rỗng có đủ cột
+            self.write(pd.DataFrame({name: pd.Series(dtype=dtype) for name, dtype in RESULT_COLUMNS.items()}))
+        if self._writer is not None:
+            self._writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gợi ý phim theo lô cho nhiều truy vấn (offline)")
+    parser.add_argument('queries', nargs='?', help="File truy vấn CSV hoặc JSONL")
+    parser.add_argument('--all-titles', action='store_true',
+                        help="Tính sẵn phim tương tự (Content-Based) cho mọi phim trong catalog")
+    parser.add_argument('--output', required=True, help="File kết quả (.parquet hoặc .csv)")
+    parser.add_argument('--mode', choices=MODES, default='hybrid',
+                        help="Mode mặc định cho các truy vấn không có cột mode")
+    parser.add_argument('--top-n', type=int, default=10, help="Số phim gợi ý mặc định mỗi truy vấn")
+    parser.add_argument('--block-size', type=int, default=None,
+                        help="Số truy vấn chấm điểm trong một tích ma trận (mặc định: tự chọn theo N)")
+    parser.add_argument('--chunk-rows', type=int, default=QUERY_CHUNK_ROWS,
+                        help="Số truy vấn đọc / ghi mỗi lần")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help="Title không khớp thì lấy phim có tên gần đúng nhất (gõ sai chính tả)")
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                        help="Chấm điểm Personalized / Hybrid trên TF-IDF hay embedding (model train với --embedding-dim)")
+    parser.add_argument('--n-probe', type=int, default=DEFAULT_N_PROBE,
+                        help="Số cụm ANN được dò khi model có IVF index (mặc định: một nửa số cụm, như app / server)")
+    parser.add_argument('--exact', action='store_true',
+                        help="Bỏ qua IVF index, chấm điểm chính xác toàn catalog (có thể khác kết quả của app / server)")
+    parser.add_argument('--model-dir', default=MODEL_DIR, help="Thư mục model")
+    args = parser.parse_args()
+    if not args.all_titles and not args.queries:
+        parser.error("cần file truy vấn hoặc --all-titles")
+
+    start_time = time.perf_counter()
+    print("=" * 60)
+    print("🎬 TMDB MOVIE RECOMMENDER - BATCH")
+    print("=" * 60)
+
+    data = open_model(args.model_dir)
+    masks = EligibleMasks(data)
+    title_index = TitleIndex.from_model(data)
+    print(f"✓ Model: {len(data['movies_data'])} phim")
+
+    chunks = (all_title_queries(data['movies_data'], args.chunk_rows) if args.all_titles
+              else read_queries(args.queries, args.chunk_rows))
+    writer = ResultWriter(args.output)
+    n_queries = n_missing = 0
+    score_start = time.perf_counter()
+    try:
+        for queries in chunks:
+            results, missing = recommend_batch(queries, data, masks, mode=args.mode, top_n=args.top_n,
+                                               block_size=args.block_size, title_index=title_index,
+                                               fuzzy=args.fuzzy, backend=args.backend, n_probe=args.n_probe,
+                                               exact=args.exact)
+            writer.write(results)
+            n_queries += len(queries)
+            n_missing += missing
+            elapsed = time.perf_counter() - score_start
+            print(f"  {n_queries:,} truy vấn, {writer.rows:,} dòng kết quả ({n_queries / elapsed:,.0f} truy vấn/s)")
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - score_start
+    if n_missing:
+        print(f"⚠️ {n_missing} truy vấn không có title nào trong model")
+    print(f"✓ Đã ghi {writer.rows:,} dòng vào '{args.output}'")
+    print(f"✓ Throughput: {n_queries / max(elapsed, 1e-9):,.0f} truy vấn/s")
+
+    print("\n" + "=" * 60)
+    print(f"✅ HOÀN THÀNH trong {time.perf_counter() - start_time:.2f}s")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""
+Benchmark các bước train và độ trễ của từng mode gợi ý trên catalog tổng hợp
+- Sinh catalog giả lập cùng định dạng TMDB với kích thước tùy chọn (5k, 50k, 500k...)
+- Đo thời gian từng bước như train_model.py: đọc CSV theo chunk (ingest.py), TF-IDF hai lượt,
+  similarity / index, lưu và load model; kèm bản features / TF-IDF trong bộ nhớ để so sánh
+- Đo p50 / p99 độ trễ của Content-Based, Personalized, Hybrid (và qua ANN nếu có)
+- Ghi lại peak RSS của process sau mỗi bước
+- So sánh với baseline đã lưu, báo các chỉ số chậm hơn ngưỡng cho phép
+
+Ví dụ:
+    python benchmark.py --sizes 5k 50k --save-baseline bench_baseline.json
+    python benchmark.py --sizes 5k 50k --baseline bench_baseline.json
+    python benchmark.py --sizes 500k --similarity ann
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from features import add_features, fill_missing, make_vectorizer, read_credit_features, scale_numeric
+from ingest import fit_tfidf_chunks, ingest_movies, iter_text_chunks
+from recommender import (build_genre_bits, get_hybrid_recommendations, get_personalized_recommendations,
+                         get_recommendations, popularity_head, popularity_prior)
+from ann_index import DEFAULT_N_PROBE, build_ann_neighbors, build_ivf_index
+from embedding import build_embedding
+from model_store import open_model, save_model
+from precision import DEFAULT_PRECISION, PRECISIONS, with_precision
+from similarity import build_similarity
+from title_index import TitleIndex, build_title_index
+
+GENRES = ['Action', 'Adventure', 'Animation', 'Comedy', 'Crime', 'Documentary', 'Drama', 'Family',
+          'Fantasy', 'History', 'Horror', 'Music', 'Mystery', 'Romance', 'Science Fiction',
+          'TV Movie', 'Thriller', 'War', 'Western']
+VOCABULARY_SIZE = 20000
+OVERVIEW_WORDS = 30
+DENSE_MAX_MOVIES = 20000  # Ma trận N×N lớn hơn thế này không còn vừa bộ nhớ
+DEFAULT_TOLERANCE = 0.25
+
+
+def parse_size(value):
+    """'5k' -> 5000, '1m' -> 1000000"""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def synthetic_catalog(n, seed=0):
+    """
+    Sinh catalog phim giả lập (đã gộp credits) cùng định dạng cột JSON như dữ liệu TMDB
+    Từ vựng theo phân phối Zipf để ma trận TF-IDF có độ thưa gần với dữ liệu thật
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array([f'w{i}' for i in range(VOCABULARY_SIZE)])
+    word_p = 1.0 / np.arange(1, VOCABULARY_SIZE + 1)
+    word_p /= word_p.sum()
+    overview_words = words[rng.choice(VOCABULARY_SIZE, size=(n, OVERVIEW_WORDS), p=word_p)]
+    keyword_words = words[rng.choice(VOCABULARY_SIZE, size=(n, 4), p=word_p)]
+    genre_sets = [rng.choice(len(GENRES), size=k, replace=False) for k in rng.integers(1, 4, size=n)]
+    actors = rng.integers(0, max(n // 2, 10), size=(n, 8))
+    directors = rng.integers(0, max(n // 10, 10), size=n)
+
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1),
+        'title': [f'Movie {i}' for i in range(n)],
+        'overview': [' '.join(row) for row in overview_words],
+        'tagline': '',
+        'genres': [json.dumps([{'id': int(g), 'name': GENRES[g]} for g in genres]) for genres in genre_sets],
+        'keywords': [json.dumps([{'id': j, 'name': str(w)} for j, w in enumerate(row)]) for row in keyword_words],
+        'cast': [json.dumps([{'cast_id': j, 'name': f'Actor {a}', 'order': j} for j, a in enumerate(row)])
+                 for row in actors],
+        'crew': [json.dumps([{'job': 'Producer', 'name': f'Producer {d}'}, {'job': 'Director', 'name': f'Director {d}'}])
+                 for d in directors],
+        'vote_average': np.round(rng.uniform(1, 10, size=n), 1),
+        'vote_count': rng.zipf(1.5, size=n).clip(max=30000),
+        'popularity': rng.exponential(10, size=n),
+        'runtime': rng.normal(105, 20, size=n).round(),
+        'release_date': '2001-01-01',
+    })
+
+
+def write_catalog_csv(movies, directory):
+    """
+    Ghi catalog giả lập thành hai file CSV như bản dump TMDB (movies + credits) để đo đường đọc của train_model.py
+    Returns:
+        (movies_path, credits_path)
+    """
+    movies_path = os.path.join(directory, 'movies.csv')
+    credits_path = os.path.join(directory, 'credits.csv')
+    movies.drop(columns=['cast', 'crew']).to_csv(movies_path, index=False)
+    movies[['id', 'title', 'cast', 'crew']].rename(columns={'id': 'movie_id'}).to_csv(credits_path, index=False)
+    return movies_path, credits_path
+
+
+def peak_rss_mb():
+    """Peak RSS của process tới thời điểm hiện tại (MB)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StageTimer:
+    """Đo thời gian và peak RSS sau từng bước"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        self.stages[name] = {'seconds': elapsed, 'peak_rss_mb': peak_rss_mb()}
+        print(f"  {name:<18} {elapsed:9.3f}s   peak RSS {self.stages[name]['peak_rss_mb']:8.0f} MB")
+        return result
+
+
+def measure_latency(func, queries):
+    """Gọi func cho từng truy vấn, trả về p50 / p99 / mean (ms)"""
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        func(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return {'p50_ms': float(np.percentile(timings, 50)), 'p99_ms': float(np.percentile(timings, 99)),
+            'mean_ms': float(timings.mean())}
+
+
+def benchmark_size(n, similarity='topk', ann=False, top_k=50, n_queries=200, seeds_per_query=4, seed=0,
+                   precision=DEFAULT_PRECISION, n_jobs=None, embedding_dim=0):
+    """Chạy toàn bộ benchmark cho một kích thước catalog"""
+    print(f"\n📦 Catalog {n:,} phim (similarity={similarity}, {precision}{', ann' if ann else ''})")
+    work_dir = tempfile.TemporaryDirectory(prefix='bench_similarity_')
+    timer = StageTimer()
+    movies = timer.run('generate', synthetic_catalog, n, seed)
+    movies_path, credits_path = write_catalog_csv(movies, work_dir.name)
+
+    # Các bước train giống train_model.py: credits rút gọn, movies đọc theo chunk với combined_features
+    # ghi ra file tạm, rồi TF-IDF fit hai lượt trên file đó
+    credit_features = timer.run('credits', read_credit_features, credits_path, n_jobs=n_jobs)
+    spill_path = os.path.join(work_dir.name, 'combined_features.parquet')
+
+    def ingest():
+        frame = ingest_movies(movies_path, credit_features, spill_path, n_jobs=n_jobs)
+        return scale_numeric(fill_missing(frame))
+    movies_merged = timer.run('ingest', ingest)
+    genre_bits, genre_names = build_genre_bits(movies_merged['genres_list'])
+
+    tfidf_matrix = timer.run('tfidf', lambda: with_precision(
+        fit_tfidf_chunks(lambda: iter_text_chunks(spill_path))[0], precision))
+
+    ann_index = None
+    if ann or similarity == 'ann':
+        ann_index = timer.run('ann_index', build_ivf_index, tfidf_matrix)
+    if similarity == 'ann':
+        cosine_sim = None
+        neighbors = timer.run('similarity', build_ann_neighbors, tfidf_matrix, *ann_index, top_k=top_k)
+    else:
+        neighbors, cosine_sim = timer.run(
+            'similarity', build_similarity, tfidf_matrix, top_k=top_k, n_jobs=n_jobs, work_dir=work_dir.name,
+            dense_precision=precision if similarity == 'dense' else None)
+    embedding = None
+    if embedding_dim > 0:
+        embedding, _ = timer.run('embedding', build_embedding, tfidf_matrix, embedding_dim)
+
+    data = {
+        'movies_data': movies_merged[['id', 'title', 'genres_clean', 'vote_average', 'vote_count', 'popularity',
+                                      'vote_avg_scaled', 'popularity_scaled', 'vote_count_scaled']],
+        'neighbors': neighbors,
+        'tfidf_matrix': tfidf_matrix,
+        'genre_bits': genre_bits,
+        'genre_names': genre_names,
+        'popularity_prior': popularity_prior(movies_merged),
+        'popularity_head': popularity_head(popularity_prior(movies_merged)),
+    }
+    data.update(timer.run('title_index', build_title_index, movies_merged['title']))
+    if cosine_sim is not None:
+        data['cosine_sim'] = cosine_sim
+    if ann_index is not None:
+        data['ann_centroids'], data['ann_lists'] = ann_index
+    if embedding is not None:
+        data['embedding'] = embedding
+
+    with tempfile.TemporaryDirectory(prefix='bench_model_') as model_dir:
+        timer.run('save', save_model, data, model_dir=model_dir)
+        del data, cosine_sim, neighbors, tfidf_matrix
+
+        def load():
+            model = open_model(model_dir, legacy_file=os.path.join(model_dir, 'missing.pkl'))
+            for name in ('movies_data', 'indices', 'neighbors', 'tfidf_matrix', 'cosine_sim', 'embedding'):
+                if name in model:
+                    model[name]
+            return model
+        model = timer.run('load', load)
+
+        latency = benchmark_queries(model, n_queries, seeds_per_query, seed)
+        size_mb = model.size_mb
+
+    # Bản trong bộ nhớ (features.add_features + TfidfVectorizer trên cả catalog) để so với ingest.py;
+    # chạy sau cùng để không làm tăng peak RSS của các bước train
+    frame = timer.run('features_in_memory', lambda: add_features(scale_numeric(fill_missing(movies))))
+    timer.run('tfidf_in_memory', lambda: make_vectorizer().fit_transform(frame['combined_features']))
+    del frame, movies
+    work_dir.cleanup()
+
+    return {
+        'n_movies': n,
+        'similarity': similarity,
+        'precision': precision,
+        'ann': ann_index is not None,
+        'model_size_mb': size_mb,
+        'stages': timer.stages,
+        'latency': latency,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def benchmark_queries(model, n_queries, seeds_per_query, seed=0):
+    """p50 / p99 của từng mode gợi ý với các truy vấn ngẫu nhiên (cố định theo seed)"""
+    rng = np.random.default_rng(seed + 1)
+    movies_data, indices = model['movies_data'], model['indices']
+    titles = movies_data['title'].values
+    single = titles[rng.integers(0, len(titles), size=n_queries)]
+    multi = [list(titles[rng.choice(len(titles), size=seeds_per_query, replace=False)]) for _ in range(n_queries)]
+    cosine_sim = model.get('cosine_sim')
+    tfidf_matrix = model['tfidf_matrix']
+    popularity = model['popularity_prior']
+    title_index = TitleIndex.from_model(model)
+    # Tên gõ sai: bỏ một ký tự ngẫu nhiên
+    cuts = rng.integers(0, 1 << 30, size=n_queries)
+    typos = [title[:cut % len(title)] + title[cut % len(title) + 1:] for title, cut in zip(single, cuts)]
+
+    modes = {
+        'content': (single, lambda title: get_recommendations(
+            title, model['neighbors'], indices, movies_data, tfidf_matrix=tfidf_matrix)),
+        'personalized': (multi, lambda seeds: get_personalized_recommendations(
+            seeds, cosine_sim, indices, movies_data, tfidf_matrix=tfidf_matrix)),
+        'hybrid': (multi, lambda seeds: get_hybrid_recommendations(
+            seeds, cosine_sim, indices, movies_data, tfidf_matrix=tfidf_matrix, popularity=popularity)),
+        'hybrid_two_stage': (multi, lambda seeds: get_hybrid_recommendations(
+            seeds, cosine_sim, indices, movies_data, tfidf_matrix=tfidf_matrix, popularity=popularity,
+            neighbors=model['neighbors'], head=model['popularity_head'])),
+        'title_lookup': (single, title_index.lookup),
+        'title_fuzzy': (typos, lambda query: title_index.search(query, limit=10)),
+    }
+    if 'ann_centroids' in model:
+        ann_index = (model['ann_centroids'], model['ann_lists'])
+        modes['personalized_ann'] = (multi, lambda seeds: get_personalized_recommendations(
+            seeds, None, indices, movies_data, tfidf_matrix=tfidf_matrix, ann_index=ann_index,
+            n_probe=DEFAULT_N_PROBE))
+        modes['hybrid_ann'] = (multi, lambda seeds: get_hybrid_recommendations(
+            seeds, None, indices, movies_data, tfidf_matrix=tfidf_matrix, ann_index=ann_index,
+            n_probe=DEFAULT_N_PROBE, popularity=popularity))
+    if 'embedding' in model:
+        embedding = model['embedding']
+        modes['personalized_embedding'] = (multi, lambda seeds: get_personalized_recommendations(
+            seeds, None, indices, movies_data, tfidf_matrix=embedding))
+        modes['hybrid_embedding'] = (multi, lambda seeds: get_hybrid_recommendations(
+            seeds, None, indices, movies_data, tfidf_matrix=embedding, popularity=popularity))
+
+    latency = {}
+    for mode, (queries, func) in modes.items():
+        func(queries[0])  # Làm nóng (page cache, lazy load)
+        latency[mode] = measure_latency(func, queries)
+        print(f"  {mode:<22} p50 {latency[mode]['p50_ms']:8.2f} ms   p99 {latency[mode]['p99_ms']:8.2f} ms")
+
+    # Hybrid 2 bước chỉ nên bật khi top 10 gần như trùng với chấm điểm toàn catalog
+    full, two_stage = modes['hybrid'][1], modes['hybrid_two_stage'][1]
+    recall = float(np.mean([np.isin(two_stage(seeds).index, full(seeds).index).mean() for seeds in multi]))
+    latency['hybrid_two_stage']['recall_at_10'] = recall
+    print(f"  {'hybrid_two_stage':<22} recall@10 so với hybrid: {recall:.3f}")
+    return latency
+
+
+def _metrics(result):
+    """Các chỉ số so sánh được: tên -> giá trị (càng nhỏ càng tốt)"""
+    metrics = {f"stage.{name}": stage['seconds'] for name, stage in result['stages'].items()
+               if name != 'generate'}
+    for mode, values in result['latency'].items():
+        metrics[f"latency.{mode}.p50_ms"] = values['p50_ms']
+        metrics[f"latency.{mode}.p99_ms"] = values['p99_ms']
+    metrics['peak_rss_mb'] = result['peak_rss_mb']
+    return metrics
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    So sánh kết quả với baseline theo từng kích thước catalog
+    Returns:
+        danh sách (size, metric, baseline, current, ratio) của các chỉ số chậm hơn ngưỡng
+    """
+    regressions = []
+    for size, result in results['runs'].items():
+        if size not in baseline.get('runs', {}):
+            print(f"\n⚠️ Baseline không có catalog {size} phim, bỏ qua so sánh")
+            continue
+        print(f"\n📊 So sánh với baseline - catalog {size} phim")
+        base_metrics = _metrics(baseline['runs'][size])
+        for name, current in _metrics(result).items():
+            if name not in base_metrics:
+                continue
+            base = base_metrics[name]
+            ratio = current / base if base > 0 else 1.0
+            flag = ''
+            if ratio > 1 + tolerance:
+                flag = '  ❌ chậm hơn'
+                regressions.append((size, name, base, current, ratio))
+            elif ratio < 1 - tolerance:
+                flag = '  ✓ nhanh hơn'
+            print(f"  {name:<32} {base:10.3f} -> {current:10.3f}  ({ratio:5.2f}x){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark train và gợi ý trên catalog tổng hợp")
+    parser.add_argument('--sizes', nargs='+', default=['5k'],
+                        help="Kích thước catalog, ví dụ: 5k 50k 500k")
+    parser.add_argument('--similarity', choices=['topk', 'dense', 'ann'], default='topk',
+                        help="Cách dựng neighbor index như train_model.py")
+    parser.add_argument('--ann', action='store_true', help="Dựng IVF index và đo thêm mode qua ANN")
+    parser.add_argument('--precision', choices=PRECISIONS, default=DEFAULT_PRECISION,
+                        help="Độ chính xác lưu cosine_sim / TF-IDF như train_model.py")
+    parser.add_argument('--top-k', type=int, default=50)
+    parser.add_argument('--jobs', type=int, default=None,
+                        help="Số process tính similarity song song như train_model.py")
+    parser.add_argument('--embedding-dim', type=int, default=0,
+                        help="Dựng embedding SVD d chiều và đo thêm Personalized / Hybrid qua embedding")
+    parser.add_argument('--queries', type=int, default=200, help="Số truy vấn đo độ trễ mỗi mode")
+    parser.add_argument('--seeds-per-query', type=int, default=4,
+                        help="Số phim seed mỗi truy vấn Personalized / Hybrid")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed của catalog và truy vấn")
+    parser.add_argument('--output', default=None, help="Ghi kết quả ra file JSON")
+    parser.add_argument('--baseline', default=None, help="File JSON baseline để so sánh")
+    parser.add_argument('--save-baseline', default=None, help="Lưu kết quả làm baseline mới")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Ngưỡng chậm hơn cho phép so với baseline (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("🎬 TMDB MOVIE RECOMMENDER - BENCHMARK")
+    print("=" * 60)
+
+    results = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(),
+                    'cpu_count': os.cpu_count(), 'numpy': np.__version__},
+        'runs': {},
+    }
+    for size in args.sizes:
+        n = parse_size(size)
+        similarity = args.similarity
+        if similarity == 'dense' and n > DENSE_MAX_MOVIES:
+            print(f"\n⚠️ Catalog {n:,} phim quá lớn cho ma trận dense, dùng topk")
+            similarity = 'topk'
+        results['runs'][str(n)] = benchmark_size(n, similarity, args.ann, args.top_k,
+                                                 args.queries, args.seeds_per_query, args.seed, args.precision,
+                                                 args.jobs, args.embedding_dim)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+            print(f"\n✓ Đã ghi kết quả vào '{path}'")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+
+    print("\n" + "=" * 60)
+    if regressions:
+        print(f"❌ {len(regressions)} chỉ số chậm hơn baseline quá {args.tolerance:.0%}")
+    else:
+        print("✅ HOÀN THÀNH")
+    print("=" * 60)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""
+Embedding dày (TruncatedSVD / LSA) của ma trận TF-IDF, dùng thay TF-IDF khi chấm điểm hồ sơ
+- Chiếu TF-IDF (N × V, V ~ 5000) xuống N × d (d = 64-256), chuẩn hóa L2, float32
+- Điểm hồ sơ Personalized / Hybrid = một phép nhân ma trận-vector N × d, chi phí như nhau
+  dù hồ sơ có 1 hay nhiều phim seed (vector hồ sơ chỉ có d chiều)
+- Lưu kèm ma trận chiếu (d × V) để update_model.py chiếu các phim mới mà không fit lại
+
+Chọn backend khi phục vụ (app / server / batch): 'tfidf' (mặc định, chính xác như trước)
+hoặc 'embedding' (nếu model được train với --embedding-dim)
+"""
+
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+BACKENDS = ['tfidf', 'embedding']
+DEFAULT_BACKEND = 'tfidf'
+DEFAULT_EMBEDDING_DIM = 128
+
+
+def build_embedding(tfidf_matrix, dim=DEFAULT_EMBEDDING_DIM, random_state=42):
+    """
+    Fit TruncatedSVD trên ma trận TF-IDF
+    Returns:
+        (embedding, components): embedding (N × d) float32 đã chuẩn hóa L2 và ma trận chiếu (d × V) float32
+    """
+    dim = max(1, min(dim, tfidf_matrix.shape[1] - 1, tfidf_matrix.shape[0] - 1))
+    svd = TruncatedSVD(n_components=dim, algorithm='randomized', random_state=random_state)
+    embedding = svd.fit_transform(tfidf_matrix.astype(np.float32))
+    return normalize(embedding).astype(np.float32), svd.components_.astype(np.float32)
+
+
+def project(tfidf_rows, components):
+    """Embedding của các dòng TF-IDF mới với ma trận chiếu đã fit (update_model.py)"""
+    return normalize(np.asarray(tfidf_rows.astype(np.float32) @ components.T)).astype(np.float32)
+
+
+def model_vectors(data, backend=DEFAULT_BACKEND):
+    """
+    Ma trận dùng để chấm điểm hồ sơ theo backend
+    Returns:
+        (cosine_sim, vectors, use_ann): cosine_sim chỉ dùng với backend 'tfidf' của model dense;
+        vectors là tfidf_matrix hoặc embedding; IVF index (dựng trên TF-IDF) chỉ dùng được với 'tfidf'
+    Raises:
+        ValueError: backend không hợp lệ hoặc model chưa có embedding
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn trong {BACKENDS})")
+    if backend == 'embedding':
+        if 'embedding' not in data:
+            raise ValueError("Model chưa có embedding, hãy train lại với --embedding-dim")
+        return None, data['embedding'], False
+    return data.get('cosine_sim'), data.get('tfidf_matrix'), True
@@ -0,0 +1,293 @@
+"""
+Các bước tiền xử lý dữ liệu TMDB dùng chung cho train_model.py và update_model.py
+"""
+
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.preprocessing import MinMaxScaler
+
+TEXT_COLS = ['overview', 'tagline', 'cast', 'crew', 'keywords', 'genres']
+NUM_COLS = ['vote_average', 'vote_count', 'popularity', 'runtime']
+
+# Các cột của movies_data được lưu trong model
+MODEL_COLUMNS = ['id', 'title', 'vote_average', 'vote_count', 'popularity',
+                 'genres_clean', 'overview', 'release_date', 'runtime',
+                 'vote_avg_scaled', 'popularity_scaled', 'vote_count_scaled']
+
+CREDIT_FEATURE_COLS = ['cast_clean', 'director_clean']
+
+# Các cột cần đọc từ movies.csv (kiểu dữ liệu cố định để mọi chunk giống nhau)
+MOVIE_DTYPES = {
+    'id': np.int64,
+    'title': str,
+    'overview': str,
+    'genres': str,
+    'keywords': str,
+    'release_date': str,
+    'vote_average': np.float64,
+    'vote_count': np.float64,
+    'popularity': np.float64,
+    'runtime': np.float64,
+}
+
+# Trích xuất JSON theo chunk; chỉ dùng process pool khi đủ nhiều dòng để bù chi phí khởi tạo
+CHUNK_ROWS = 2000
+PARALLEL_MIN_ROWS = 20000
+PARALLEL_MIN_BYTES = 200 * 1024 * 1024
+
+TFIDF_PARAMS = {
+    'max_features': 5000,
+    'stop_words': 'english',
+    'ngram_range': (1, 2),
+}
+
+
+def read_credit_features(credits_path, ids=None, chunk_rows=CHUNK_ROWS, n_jobs=None):
+    """
+    Đọc file credits theo từng chunk và chỉ giữ lại cast_clean / director_clean,
+    không bao giờ giữ toàn bộ chuỗi JSON cast/crew trong bộ nhớ
+    Args:
+        credits_path: đường dẫn tmdb_5000_credits.csv
+        ids: chỉ lấy các phim có id trong danh sách này (None = tất cả)
+        n_jobs: số process trích xuất song song (None = tự chọn theo kích thước file)
+    Returns:
+        DataFrame [id, cast_clean, director_clean]
+    """
+    ids = None if ids is None else set(ids)
+    n_jobs = _resolve_jobs(n_jobs, os.path.getsize(credits_path) >= PARALLEL_MIN_BYTES)
+    frames = []
+    with _extraction_pool(n_jobs) as pool:
+        pending = []
+        for chunk in pd.read_csv(credits_path, usecols=['movie_id', 'cast', 'crew'],
+                                 dtype={'movie_id': np.int64, 'cast': str, 'crew': str}, chunksize=chunk_rows):
+            if ids is not None:
+                chunk = chunk[chunk['movie_id'].isin(ids)]
+            columns = {'cast': chunk['cast'].fillna('').tolist(), 'crew': chunk['crew'].fillna('').tolist()}
+            pending.append((chunk['movie_id'].values, _submit(pool, columns)))
+            # Giới hạn số chunk đang xử lý để bộ nhớ không tăng theo kích thước file
+            if len(pending) > 2 * n_jobs:
+                frames.append(_credit_frame(*pending.pop(0)))
+        frames.extend(_credit_frame(movie_ids, result) for movie_ids, result in pending)
+
+    if not frames:
+        return pd.DataFrame(columns=['id'] + CREDIT_FEATURE_COLS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def _credit_frame(movie_ids, result):
+    return pd.DataFrame({'id': movie_ids, **_result(result)})
+
+
+def merge_credit_features(movies, credit_features):
+    """Gộp cast_clean / director_clean vào movies theo id"""
+    movies_merged = movies.merge(credit_features, on='id', how='left')
+    movies_merged[CREDIT_FEATURE_COLS] = movies_merged[CREDIT_FEATURE_COLS].fillna('')
+    return movies_merged
+
+
+def fill_missing_text(movies_merged):
+    """Missing values của các cột text -> chuỗi rỗng (không cần thống kê toàn bộ dữ liệu, làm được theo chunk)"""
+    for col in TEXT_COLS:
+        if col in movies_merged.columns:
+            movies_merged[col] = movies_merged[col].fillna('')
+    return movies_merged
+
+
+def fill_missing(movies_merged, medians=None):
+    """
+    Xử lý missing values: text -> chuỗi rỗng, số -> median
+    Args:
+        medians: dict median theo cột (mặc định tính trên chính movies_merged)
+    """
+    fill_missing_text(movies_merged)
+    for col in NUM_COLS:
+        if col in movies_merged.columns:
+            median = medians[col] if medians is not None else movies_merged[col].median()
+            movies_merged[col] = movies_merged[col].fillna(median)
+    return movies_merged
+
+
+def scale_numeric(movies_merged):
+    """Cắt outliers của vote_count rồi chuẩn hóa MinMax các cột dùng cho Hybrid"""
+    low, high = movies_merged['vote_count'].quantile([0.01, 0.99])
+    movies_merged['vote_count_clipped'] = movies_merged['vote_count'].clip(lower=low, upper=high)
+
+    scaler = MinMaxScaler()
+    movies_merged[['vote_avg_scaled', 'popularity_scaled', 'vote_count_scaled']] = scaler.fit_transform(
+        movies_merged[['vote_average', 'popularity', 'vote_count_clipped']]
+    )
+    return movies_merged
+
+
+_decoder = json.JSONDecoder()
+_SEPARATORS = re.compile(r'[\s,]*')
+_DIRECTOR_JOB = re.compile(r'"job"\s*:\s*"Director"')
+
+
+def extract_genres(genres_str):
+    try:
+        genres_list = json.loads(genres_str)
+        return [g['name'] for g in genres_list]
+    except:
+        return []
+
+def extract_keywords(keywords_str):
+    try:
+        keywords_list = json.loads(keywords_str)
+        return ' '.join([k['name'] for k in keywords_list])
+    except:
+        return ''
+
+def extract_cast(cast_str, limit=5):
+    """Lấy 5 diễn viên đầu tiên: chỉ decode 5 object đầu của mảng JSON rồi dừng"""
+    try:
+        names = []
+        pos = cast_str.index('[') + 1
+        while len(names) < limit:
+            pos = _SEPARATORS.match(cast_str, pos).end()
+            if cast_str[pos] == ']':
+                break
+            person, pos = _decoder.raw_decode(cast_str, pos)
+            names.append(person['name'].replace(' ', ''))
+        return ' '.join(names)
+    except:
+        return ''
+
+def _extract_director_full(crew_str):
+    try:
+        crew_list = json.loads(crew_str)
+        for person in crew_list:
+            if person.get('job') == 'Director':
+                return person['name'].replace(' ', '')
+        return ''
+    except:
+        return ''
+
+def extract_director(crew_str):
+    """
+    Tìm thẳng chuỗi "job": "Director" đầu tiên rồi chỉ decode object chứa nó,
+    không parse toàn bộ crew; nếu không chắc chắn thì quay về parse đầy đủ
+    """
+    try:
+        match = _DIRECTOR_JOB.search(crew_str)
+        if match is None:
+            return ''
+        person, _ = _decoder.raw_decode(crew_str, crew_str.rindex('{', 0, match.start()))
+        if person.get('job') == 'Director':
+            return person['name'].replace(' ', '')
+    except:
+        pass
+    return _extract_director_full(crew_str)
+
+
+def _extract_chunk(columns):
+    """Trích xuất một chunk (chạy trong worker process): dict tên cột JSON -> list chuỗi"""
+    result = {}
+    if 'genres' in columns:
+        result['genres_list'] = [extract_genres(x) for x in columns['genres']]
+    if 'keywords' in columns:
+        result['keywords_clean'] = [extract_keywords(x) for x in columns['keywords']]
+    if 'cast' in columns:
+        result['cast_clean'] = [extract_cast(x) for x in columns['cast']]
+    if 'crew' in columns:
+        result['director_clean'] = [extract_director(x) for x in columns['crew']]
+    return result
+
+
+def _resolve_jobs(n_jobs, large):
+    """Số process trích xuất: mặc định dùng mọi CPU cho dữ liệu lớn, chạy tuần tự cho dữ liệu nhỏ"""
+    if n_jobs is None:
+        n_jobs = (os.cpu_count() or 1) if large else 1
+    return max(1, n_jobs)
+
+
+@contextmanager
+def _extraction_pool(n_jobs):
+    """Process pool cho trích xuất JSON, hoặc None nếu chạy tuần tự"""
+    if n_jobs <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        yield pool
+
+
+def _submit(pool, columns):
+    return _extract_chunk(columns) if pool is None else pool.submit(_extract_chunk, columns)
+
+
+def _result(submitted):
+    return submitted if isinstance(submitted, dict) else submitted.result()
+
+
+def extract_json_columns(movies_merged, n_jobs=None, chunk_rows=CHUNK_ROWS):
+    """
+    Parse mỗi cột JSON đúng một lần, chia theo chunk và chạy song song trên process pool
+    Returns:
+        dict tên cột kết quả -> list giá trị (cùng thứ tự dòng với movies_merged)
+    """
+    columns = {col: movies_merged[col].tolist()
+               for col in ('genres', 'keywords', 'cast', 'crew') if col in movies_merged.columns}
+    n = len(movies_merged)
+    with _extraction_pool(_resolve_jobs(n_jobs, n >= PARALLEL_MIN_ROWS)) as pool:
+        submitted = [_submit(pool, {col: values[start:start + chunk_rows] for col, values in columns.items()})
+                     for start in range(0, n, chunk_rows)]
+        chunks = [_result(x) for x in submitted]
+
+    return {name: [x for chunk in chunks for x in chunk[name]] for name in (chunks[0] if chunks else {})}
+
+
+def add_features(movies_merged, n_jobs=None):
+    """
+    Tạo các cột đã làm sạch và combined_features từ overview, genres, keywords, cast, director
+    cast_clean / director_clean có thể đã được tính sẵn khi đọc credits theo chunk
+    """
+    for name, values in extract_json_columns(movies_merged, n_jobs=n_jobs).items():
+        movies_merged[name] = values
+    return combine_features(movies_merged)
+
+
+def combine_features(movies_merged):
+    """genres_clean và combined_features từ các cột đã trích xuất (genres_list, keywords_clean, cast/director)"""
+    movies_merged['genres_clean'] = movies_merged['genres_list'].apply(lambda x: ' '.join([g.replace(' ', '') for g in x]))
+
+    movies_merged['combined_features'] = (
+        movies_merged['overview'].fillna('') + ' ' +
+        movies_merged['genres_clean'] + ' ' +
+        movies_merged['keywords_clean'] + ' ' +
+        movies_merged['cast_clean'] + ' ' +
+        movies_merged['director_clean']
+    )
+    return movies_merged
+
+
+def make_vectorizer(params=None):
+    """TfidfVectorizer với tham số mặc định của project"""
+    return TfidfVectorizer(**(params or TFIDF_PARAMS))
+
+
+def vectorizer_state(tfidf):
+    """Các thành phần cần lưu để dùng lại vocabulary đã fit (không pickle vectorizer)"""
+    vocabulary = np.array(tfidf.get_feature_names_out(), dtype=str)
+    params = {
+        'max_features': tfidf.max_features,
+        'stop_words': tfidf.stop_words,
+        'ngram_range': list(tfidf.ngram_range),
+    }
+    return vocabulary, tfidf.idf_.astype(np.float64), params
+
+
+def restore_vectorizer(vocabulary, idf, params):
+    """Dựng lại TfidfVectorizer đã fit từ vocabulary + idf đã lưu"""
+    params = dict(params)
+    params['ngram_range'] = tuple(params['ngram_range'])
+    params.pop('max_features', None)  # vocabulary đã cố định
+    tfidf = TfidfVectorizer(vocabulary=list(vocabulary), **params)
+    tfidf.idf_ = np.asarray(idf, dtype=np.float64)
+    return tfidf
@@ -0,0 +1,252 @@
+"""
+Lịch sử tìm kiếm lưu bền trên đĩa (SQLite, chỉ ghi thêm), dùng chung giữa các session và process
+- Các lần tìm kiếm mới nằm trong ring buffer giới hạn trong bộ nhớ, ghi xuống đĩa theo lô
+  (đủ HISTORY_FLUSH_ROWS bản ghi, sau HISTORY_FLUSH_SECONDS giây, hoặc khi đóng / trước khi đọc đĩa)
+- Index theo thời gian, theo phim seed và theo truy vấn đã chuẩn hóa
+- top_queries() / warm_result_cache(): các truy vấn hay gặp nhất dùng để làm nóng cache kết quả
+  khi service vừa load model
+
+Ví dụ:
+    history = HistoryStore()
+    history.record('hybrid', ['Avatar', 'Titanic'], top_n=10, age='T13', num_results=10)
+    history.recent(10)
+    history.query(title='Avatar', since=time.time() - 7 * 86400)
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+DEFAULT_HISTORY_PATH = "search_history.sqlite3"
+HISTORY_BUFFER_SIZE = 200  # Số lần tìm kiếm gần nhất giữ trong bộ nhớ (cho mọi session)
+HISTORY_FLUSH_ROWS = 20
+HISTORY_FLUSH_SECONDS = 5.0
+WARM_UP_QUERIES = 20
+
+# Các tham số làm đổi kết quả, ghép thành khóa truy vấn đã chuẩn hóa
+QUERY_FIELDS = ['mode', 'titles', 'top_n', 'age', 'weights', 'backend', 'n_probe', 'two_stage']
+
+
+def query_key(entry):
+    """Khóa của truy vấn: cùng tập phim (không kể thứ tự) và cùng tham số thì trùng khóa"""
+    fields = {name: entry.get(name) for name in QUERY_FIELDS}
+    fields['titles'] = sorted(set(fields['titles']))
+    return json.dumps(fields, sort_keys=True, ensure_ascii=False)
+
+
+class HistoryStore:
+    """Ring buffer trong bộ nhớ + bảng SQLite chỉ ghi thêm, an toàn khi nhiều thread / process dùng chung"""
+
+    def __init__(self, path=None, buffer_size=HISTORY_BUFFER_SIZE, flush_rows=HISTORY_FLUSH_ROWS,
+                 flush_seconds=HISTORY_FLUSH_SECONDS, clock=time.time):
+        self.path = path or os.environ.get('SEARCH_HISTORY_PATH', DEFAULT_HISTORY_PATH)
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self._clock = clock
+        self._recent = deque(maxlen=buffer_size)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS searches ("
+                "id INTEGER PRIMARY KEY, ts REAL NOT NULL, session_id TEXT, mode TEXT NOT NULL, "
+                "titles TEXT NOT NULL, top_n INTEGER, age TEXT, weights TEXT, backend TEXT, "
+                "n_probe INTEGER, two_stage INTEGER, num_results INTEGER, query_key TEXT NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS search_seeds ("
+                "search_id INTEGER NOT NULL REFERENCES searches(id), title TEXT NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS searches_ts ON searches (ts)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS searches_session ON searches (session_id, ts)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS searches_query ON searches (query_key, ts)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS search_seeds_title ON search_seeds (title, search_id)")
+        # Bản ghi còn trong bộ nhớ khi process dừng vẫn được ghi xuống đĩa
+        atexit.register(self.close)
+
+    def record(self, mode, titles, top_n=10, age=None, weights=None, backend=None, n_probe=None,
+               two_stage=None, num_results=0, session_id=None):
+        """
+        Ghi nhận một lần tìm kiếm (vào ring buffer, ghi xuống đĩa theo lô)
+        Args:
+            mode: 'content' | 'personalized' | 'hybrid'
+            titles: tên các phim seed
+            age, weights, backend, n_probe, two_stage: tham số của truy vấn (như RecommenderService.recommend)
+        Returns:
+            dict bản ghi
+        """
+        entry = {
+            'time': self._clock(),
+            'session_id': session_id,
+            'mode': mode,
+            'titles': [str(title) for title in titles],
+            'top_n': int(top_n),
+            'age': age,
+            'weights': None if weights is None else [float(weight) for weight in weights],
+            'backend': backend,
+            'n_probe': None if n_probe is None else int(n_probe),
+            'two_stage': None if two_stage is None else bool(two_stage),
+            'num_results': int(num_results),
+        }
+        with self._lock:
+            self._recent.append(entry)
+            self._pending.append(entry)
+            due = (len(self._pending) >= self.flush_rows
+                   or entry['time'] - self._pending[0]['time'] >= self.flush_seconds)
+        if due:
+            self.flush()
+        return entry
+
+    def flush(self):
+        """Ghi các bản ghi đang chờ xuống đĩa trong một transaction"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            with self._db:
+                for entry in pending:
+                    cursor = self._db.execute(
+                        "INSERT INTO searches (ts, session_id, mode, titles, top_n, age, weights, backend, "
+                        "n_probe, two_stage, num_results, query_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        [entry['time'], entry['session_id'], entry['mode'],
+                         json.dumps(entry['titles'], ensure_ascii=False), entry['top_n'], entry['age'],
+                         None if entry['weights'] is None else json.dumps(entry['weights']), entry['backend'],
+                         entry['n_probe'], entry['two_stage'], entry['num_results'], query_key(entry)]
+                    )
+                    self._db.executemany("INSERT INTO search_seeds (search_id, title) VALUES (?, ?)",
+                                         [(cursor.lastrowid, title) for title in dict.fromkeys(entry['titles'])])
+        return len(pending)
+
+    def count(self, session_id=None):
+        """Số lần tìm kiếm đã ghi nhận (trên đĩa + đang chờ ghi)"""
+        where, args = ("WHERE session_id = ?", [session_id]) if session_id is not None else ("", [])
+        with self._lock:
+            stored = self._db.execute(f"SELECT COUNT(*) FROM searches {where}", args).fetchone()[0]
+            pending = sum(1 for entry in self._pending if session_id is None or entry['session_id'] == session_id)
+        return stored + pending
+
+    def recent(self, limit=10, session_id=None):
+        """Các lần tìm kiếm gần nhất (mới nhất trước); đọc từ ring buffer nếu đủ, không thì từ đĩa"""
+        with self._lock:
+            matches = [entry for entry in reversed(self._recent)
+                       if session_id is None or entry['session_id'] == session_id]
+        if len(matches) >= limit:
+            return matches[:limit]
+        return self.query(session_id=session_id, limit=limit)
+
+    def query(self, title=None, since=None, until=None, session_id=None, limit=100):
+        """
+        Tìm trong lịch sử theo phim seed và / hoặc khoảng thời gian (dùng index, mới nhất trước)
+        Args:
+            title: tên phim seed
+            since, until: khoảng thời gian (epoch giây)
+        """
+        self.flush()
+        conditions, args = [], []
+        if title is not None:
+            conditions.append("id IN (SELECT search_id FROM search_seeds WHERE title = ?)")
+            args.append(title)
+        if since is not None:
+            conditions.append("ts >= ?")
+            args.append(since)
+        if until is not None:
+            conditions.append("ts < ?")
+            args.append(until)
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            args.append(session_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ts, session_id, mode, titles, top_n, age, weights, backend, n_probe, two_stage, num_results "
+                f"FROM searches {where} ORDER BY ts DESC, id DESC LIMIT ?", [*args, limit]
+            ).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def top_queries(self, limit=WARM_UP_QUERIES, since=None):
+        """
+        Các truy vấn gặp nhiều nhất (theo khóa đã chuẩn hóa)
+        Returns:
+            list (entry, count), nhiều nhất trước
+        """
+        self.flush()
+        where, args = ("WHERE ts >= ?", [since]) if since is not None else ("", [])
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT query_key, COUNT(*) AS n, MAX(ts) FROM searches {where} "
+                "GROUP BY query_key ORDER BY n DESC, MAX(ts) DESC LIMIT ?", [*args, limit]
+            ).fetchall()
+        return [(json.loads(key), count) for key, count, _ in rows]
+
+    def top_titles(self, limit=10, since=None):
+        """Các phim seed được tìm nhiều nhất: list (title, count)"""
+        self.flush()
+        where, args = ("WHERE s.ts >= ?", [since]) if since is not None else ("", [])
+        with self._lock:
+            return self._db.execute(
+                "SELECT seeds.title, COUNT(*) AS n FROM search_seeds seeds "
+                f"JOIN searches s ON s.id = seeds.search_id {where} "
+                "GROUP BY seeds.title ORDER BY n DESC, seeds.title LIMIT ?", [*args, limit]
+            ).fetchall()
+
+    def clear(self, session_id=None):
+        """Xóa lịch sử (của một session, hoặc toàn bộ)"""
+        with self._lock:
+            self._pending = [entry for entry in self._pending
+                             if session_id is not None and entry['session_id'] != session_id]
+            kept = [entry for entry in self._recent if session_id is not None and entry['session_id'] != session_id]
+            self._recent.clear()
+            self._recent.extend(kept)
+            where, args = ("WHERE session_id = ?", [session_id]) if session_id is not None else ("", [])
+            with self._db:
+                self._db.execute(f"DELETE FROM search_seeds WHERE search_id IN (SELECT id FROM searches {where})",
+                                 args)
+                self._db.execute(f"DELETE FROM searches {where}", args)
+
+    def close(self):
+        """Ghi nốt các bản ghi đang chờ"""
+        try:
+            self.flush()
+        except sqlite3.ProgrammingError:
+            pass  # Kết nối đã đóng
+
+    @staticmethod
+    def _entry(row):
+        ts, session_id, mode, titles, top_n, age, weights, backend, n_probe, two_stage, num_results = row
+        return {
+            'time': ts,
+            'session_id': session_id,
+            'mode': mode,
+            'titles': json.loads(titles),
+            'top_n': top_n,
+            'age': age,
+            'weights': None if weights is None else json.loads(weights),
+            'backend': backend,
+            'n_probe': n_probe,
+            'two_stage': None if two_stage is None else bool(two_stage),
+            'num_results': num_results,
+        }
+
+
+def warm_result_cache(service, history, limit=WARM_UP_QUERIES):
+    """
+    Chạy trước các truy vấn hay gặp nhất trong lịch sử để cache kết quả của service đã có sẵn
+    Returns:
+        số truy vấn đã làm nóng
+    """
+    warmed = 0
+    for entry, _ in history.top_queries(limit):
+        options = {name: entry[name] for name in ('weights', 'age', 'backend', 'n_probe', 'two_stage')
+                   if entry.get(name) is not None}
+        try:
+            result, _ = service.recommend(entry['mode'], entry['titles'], top_n=entry['top_n'], **options)
+        except ValueError:
+            continue  # Truy vấn không còn hợp lệ với model hiện tại (mode / backend)
+        warmed += result is not None
+    return warmed
@@ -0,0 +1,149 @@
+"""
+Đọc dữ liệu TMDB theo luồng (streaming) cho các bản dump lớn
+
+- movies.csv được đọc theo chunk, chỉ các cột cần thiết với kiểu dữ liệu cố định (MOVIE_DTYPES)
+- credits.csv đã được rút gọn thành cast_clean / director_clean (read_credit_features),
+  mỗi chunk movies được join với bảng này theo id
+- Trích xuất feature theo từng chunk; combined_features được ghi tạm ra Parquet thay vì giữ trong bộ nhớ
+- TF-IDF fit hai lượt trên file tạm: lượt 1 đếm tần suất term để chọn vocabulary + idf,
+  lượt 2 transform từng chunk. Kết quả giống TfidfVectorizer.fit_transform trên toàn bộ dữ liệu
+
+Bộ nhớ đỉnh phụ thuộc kích thước chunk và kích thước model (metadata + ma trận TF-IDF),
+không phụ thuộc kích thước các chuỗi JSON / văn bản đầu vào.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer
+
+from features import (MODEL_COLUMNS, MOVIE_DTYPES, PARALLEL_MIN_BYTES, TFIDF_PARAMS, _extraction_pool,
+                      _resolve_jobs, _result, _submit, combine_features, fill_missing_text,
+                      merge_credit_features, restore_vectorizer)
+
+INGEST_CHUNK_ROWS = 5000
+# Số term tối đa được đếm ở lượt 1; vượt quá thì bỏ bớt các term hiếm nhất (chỉ xảy ra với corpus rất lớn)
+MAX_TRACKED_TERMS = 2_000_000
+
+# Cột giữ lại trong bộ nhớ cho mỗi phim (combined_features nằm trong file tạm)
+META_COLUMNS = [col for col in MODEL_COLUMNS if not col.endswith('_scaled')] + ['genres_list']
+
+
+def stream_movie_features(movies_path, credit_features, chunk_rows=INGEST_CHUNK_ROWS, n_jobs=None):
+    """
+    Đọc movies.csv theo chunk, join credit features theo id và trích xuất feature cho từng chunk
+    Phim trùng title bị bỏ (giữ lần xuất hiện đầu tiên trong file, như drop_duplicates)
+    Yields:
+        DataFrame của từng chunk, có META_COLUMNS và combined_features
+    """
+    n_jobs = _resolve_jobs(n_jobs, os.path.getsize(movies_path) >= PARALLEL_MIN_BYTES)
+    seen_titles = set()
+    with _extraction_pool(n_jobs) as pool:
+        pending = []
+        for chunk in pd.read_csv(movies_path, usecols=list(MOVIE_DTYPES), dtype=MOVIE_DTYPES,
+                                 chunksize=chunk_rows):
+            chunk = merge_credit_features(chunk, credit_features).drop_duplicates(subset=['title'])
+            chunk = chunk[~chunk['title'].isin(seen_titles)].reset_index(drop=True)
+            seen_titles.update(chunk['title'])
+            chunk = fill_missing_text(chunk)
+            columns = {col: chunk[col].tolist() for col in ('genres', 'keywords')}
+            pending.append((chunk.drop(columns=['genres', 'keywords']), _submit(pool, columns)))
+            # Giới hạn số chunk đang xử lý để bộ nhớ không tăng theo kích thước file
+            if len(pending) > 2 * n_jobs:
+                yield _finish_chunk(*pending.pop(0))
+        for frame, result in pending:
+            yield _finish_chunk(frame, result)
+
+
+def _finish_chunk(frame, result):
+    for name, values in _result(result).items():
+        frame[name] = values
+    return combine_features(frame)
+
+
+def ingest_movies(movies_path, credit_features, spill_path, chunk_rows=INGEST_CHUNK_ROWS, n_jobs=None):
+    """
+    Chạy stream_movie_features, giữ metadata trong bộ nhớ và ghi combined_features ra Parquet tạm
+    Returns:
+        DataFrame META_COLUMNS, cùng thứ tự dòng với file tạm
+    """
+    frames = []
+    schema = pa.schema([('combined_features', pa.string())])
+    with pq.ParquetWriter(spill_path, schema) as writer:
+        for chunk in stream_movie_features(movies_path, credit_features, chunk_rows, n_jobs):
+            writer.write_table(pa.table({'combined_features': chunk['combined_features'].tolist()}, schema=schema))
+            frames.append(chunk[META_COLUMNS])
+    if not frames:
+        return pd.DataFrame(columns=META_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def iter_text_chunks(spill_path, chunk_rows=INGEST_CHUNK_ROWS):
+    """Đọc lại combined_features từ file tạm theo từng chunk"""
+    for batch in pq.ParquetFile(spill_path).iter_batches(batch_size=chunk_rows, columns=['combined_features']):
+        yield batch.column(0).to_pylist()
+
+
+def _count_terms(texts, params):
+    """Tần suất (tổng số lần xuất hiện, số văn bản chứa term) của từng term trong một chunk"""
+    counter = CountVectorizer(stop_words=params['stop_words'], ngram_range=tuple(params['ngram_range']),
+                              dtype=np.int64)
+    try:
+        X = counter.fit_transform(texts)
+    except ValueError:
+        # Chunk không có term nào (toàn văn bản rỗng / stop words)
+        return None
+    terms = counter.get_feature_names_out()
+    tf = np.asarray(X.sum(axis=0)).ravel()
+    df = np.bincount(X.indices, minlength=len(terms))
+    return pd.DataFrame({'tf': tf, 'df': df}, index=pd.Index(terms, dtype=object))
+
+
+def fit_tfidf_chunks(text_chunks, params=None):
+    """
+    TF-IDF hai lượt trên dữ liệu đọc theo chunk
+    Args:
+        text_chunks: hàm không tham số trả về iterator các list văn bản (được gọi hai lần)
+        params: tham số TF-IDF (mặc định TFIDF_PARAMS)
+    Returns:
+        (tfidf_matrix, vocabulary, idf, params): ma trận CSR và trạng thái vectorizer như vectorizer_state
+    """
+    params = dict(params or TFIDF_PARAMS)
+    params['ngram_range'] = list(params['ngram_range'])
+
+    # Lượt 1: đếm tf / df của mọi term
+    counts = pd.DataFrame({'tf': pd.Series(dtype=np.int64), 'df': pd.Series(dtype=np.int64)})
+    n_docs = 0
+    for texts in text_chunks():
+        n_docs += len(texts)
+        chunk_counts = _count_terms(texts, params)
+        if chunk_counts is None:
+            continue
+        counts = counts.add(chunk_counts, fill_value=0).astype(np.int64)
+        if len(counts) > MAX_TRACKED_TERMS:
+            counts = counts.nlargest(MAX_TRACKED_TERMS // 2, 'tf', keep='all')
+    if len(counts) == 0:
+        raise ValueError("Không có term nào trong dữ liệu để fit TF-IDF")
+
+    # Chọn vocabulary giống CountVectorizer: term sắp theo alphabet, giữ max_features term có tf lớn nhất
+    counts = counts.sort_index()
+    keep = np.ones(len(counts), dtype=bool)
+    limit = params.get('max_features')
+    if limit is not None and len(counts) > limit:
+        keep[:] = False
+        keep[(-counts['tf'].values.astype(np.float64)).argsort()[:limit]] = True
+    selected = counts[keep]
+    vocabulary = np.array(selected.index, dtype=str)
+    # idf làm mượt như TfidfTransformer(smooth_idf=True)
+    idf = np.log((n_docs + 1) / (selected['df'].values.astype(np.float64) + 1)) + 1
+
+    # Lượt 2: transform từng chunk với vocabulary + idf đã chọn
+    tfidf = restore_vectorizer(vocabulary, idf, params)
+    blocks = [tfidf.transform(texts) for texts in text_chunks() if len(texts)]
+    tfidf_matrix = (sparse.vstack(blocks, format='csr') if blocks
+                    else sparse.csr_matrix((0, len(vocabulary)), dtype=np.float64))
+    return tfidf_matrix, vocabulary, idf, params
@@ -0,0 +1,169 @@
+"""
+Đo thời gian và profiling cho từng truy vấn gợi ý
+- RequestTrace: các span thời gian (model load, scoring, filtering, poster, render...) của một truy vấn,
+  tùy chọn chạy cProfile trong suốt truy vấn
+- Metrics: bộ đếm (cache hit / miss...) và histogram latency dùng chung trong process
+- Mỗi truy vấn được ghi thành một dòng JSON (logger 'recommender.trace') để gom / phân tích sau
+
+File log mặc định: recommender_trace.jsonl (đổi qua biến môi trường RECOMMENDER_TRACE_LOG, để rỗng để tắt)
+"""
+
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# Biên trên (ms) của các bucket histogram latency
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf'))
+DEFAULT_TRACE_LOG = 'recommender_trace.jsonl'
+PROFILE_TOP_N = 25
+
+trace_logger = logging.getLogger('recommender.trace')
+
+
+class Metrics:
+    """Bộ đếm và histogram latency, an toàn khi nhiều session (thread) dùng chung"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, ms):
+        """Ghi một giá trị latency (ms) vào histogram name"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {'counts': [0] * len(self.buckets), 'sum': 0.0,
+                                                      'max': 0.0}
+            index = next(i for i, bound in enumerate(self.buckets) if ms <= bound)
+            histogram['counts'][index] += 1
+            histogram['sum'] += ms
+            histogram['max'] = max(histogram['max'], ms)
+
+    def _quantile(self, counts, q):
+        """Quantile ước lượng theo biên trên của bucket"""
+        target = q * sum(counts)
+        seen = 0
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+    def snapshot(self):
+        """
+        Returns:
+            dict counters (tên -> giá trị) và latency (tên -> count, mean_ms, p50_ms, p95_ms, max_ms, buckets)
+        """
+        with self._lock:
+            latency = {}
+            for name, histogram in self._histograms.items():
+                count = sum(histogram['counts'])
+                latency[name] = {
+                    'count': count,
+                    'mean_ms': histogram['sum'] / count,
+                    'p50_ms': self._quantile(histogram['counts'], 0.5),
+                    'p95_ms': self._quantile(histogram['counts'], 0.95),
+                    'max_ms': histogram['max'],
+                    'buckets': {('+inf' if bound == float('inf') else f"le_{bound:g}"): value
+                                for bound, value in zip(self.buckets, histogram['counts'])},
+                }
+            return {'counters': dict(self._counters), 'latency': latency}
+
+
+class RequestTrace:
+    """
+    Các span thời gian của một truy vấn
+    Ví dụ:
+        trace = RequestTrace('hybrid', profile=True)
+        with trace.span('scoring'):
+            ...
+        trace.finish(metrics)
+    """
+
+    def __init__(self, name, profile=False, **fields):
+        self.name = name
+        self.fields = fields
+        self.spans = {}
+        self.started_at = datetime.now().isoformat(timespec='milliseconds')
+        self._start = time.perf_counter()
+        self.total_ms = None
+        self.profile_text = None
+        self._profiler = None
+        if profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def span(self, name):
+        """Cộng dồn thời gian (ms) của khối lệnh vào span name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans[name] = self.spans.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    def finish(self, metrics=None, **fields):
+        """
+        Kết thúc truy vấn: dừng cProfile, ghi latency vào metrics và một dòng JSON vào trace log
+        Returns:
+            dict bản ghi của truy vấn
+        """
+        if self.total_ms is not None:
+            return self.record()
+        self.total_ms = (time.perf_counter() - self._start) * 1000
+        self.fields.update(fields)
+        if self._profiler is not None:
+            self._profiler.disable()
+            output = io.StringIO()
+            pstats.Stats(self._profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+            self.profile_text = output.getvalue()
+            self._profiler = None
+        if metrics is not None:
+            metrics.observe(f"{self.name}.total", self.total_ms)
+            for span, ms in self.spans.items():
+                metrics.observe(f"{self.name}.{span}", ms)
+        record = self.record()
+        if trace_logger.handlers:
+            trace_logger.info(json.dumps(record, ensure_ascii=False, default=str))
+        return record
+
+    def record(self):
+        return {
+            'time': self.started_at,
+            'request': self.name,
+            'total_ms': None if self.total_ms is None else round(self.total_ms, 3),
+            'spans_ms': {span: round(ms, 3) for span, ms in self.spans.items()},
+            'profiled': self.profile_text is not None,
+            **self.fields,
+        }
+
+
+def setup_trace_log(path=None):
+    """
+    Ghi các bản ghi truy vấn ra file JSON lines (mỗi dòng một truy vấn), chỉ cấu hình một lần mỗi process
+    Args:
+        path: đường dẫn file (mặc định RECOMMENDER_TRACE_LOG hoặc DEFAULT_TRACE_LOG; rỗng = tắt)
+    """
+    if path is None:
+        path = os.environ.get('RECOMMENDER_TRACE_LOG', DEFAULT_TRACE_LOG)
+    if not path or trace_logger.handlers:
+        return trace_logger
+    handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+    trace_logger.propagate = False
+    return trace_logger
@@ -0,0 +1,170 @@
+"""
+Hot-reload model khi đang chạy, không cần khởi động lại app / service
+- ModelReloader giữ RecommenderService đang phục vụ; một thread nền đọc version trên đĩa
+  (CURRENT, hoặc mtime của file pickle cũ) mỗi RELOAD_CHECK_SECONDS giây
+- Version mới được load và làm nóng ngay trong thread nền (mảng memory-map, title index, mask độ tuổi,
+  cache kết quả), xong mới thay tham chiếu service bằng một phép gán
+- Request đang chạy đã giữ service cũ nên chạy xong trên model cũ; service cũ được giải phóng khi
+  không còn request nào giữ nó
+- Mỗi lần reload ghi lại thời gian load / làm nóng và RSS của process trước khi load, khi cả hai
+  version cùng nằm trong bộ nhớ và sau khi chuyển (bộ nhớ chồng lấn)
+
+Ví dụ:
+    reloader = ModelReloader(on_reload=lambda service: warm_result_cache(service, history)).start()
+    service = reloader.current()  # lấy một lần cho mỗi request
+"""
+
+import gc
+import os
+import resource
+import sys
+import threading
+import time
+
+from model_store import LEGACY_MODEL_FILE, MODEL_DIR, stored_model_version
+from service import RecommenderService
+
+RELOAD_CHECK_SECONDS = 5.0
+
+
+def current_rss_mb():
+    """RSS hiện tại của process (MB); nếu không đọc được /proc thì trả về peak RSS"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _model_size_mb(service):
+    return getattr(service.model, 'size_mb', None)
+
+
+class ModelReloader:
+    """Service đang phục vụ + thread nền tải version model mới và chuyển sang nó khi đã sẵn sàng"""
+
+    def __init__(self, model_dir=MODEL_DIR, legacy_file=LEGACY_MODEL_FILE, interval=RELOAD_CHECK_SECONDS,
+                 on_reload=None, metrics=None):
+        """
+        Args:
+            interval: số giây giữa hai lần kiểm tra version trên đĩa
+            on_reload: hàm gọi với service mới trước khi chuyển (ví dụ làm nóng cache kết quả); lỗi của hàm
+                này chỉ được ghi lại (metrics 'model.reload_errors'), không chặn việc load model
+            metrics: instrumentation.Metrics để ghi latency 'model.load' / 'model.reload'
+        Raises:
+            FileNotFoundError: nếu chưa có model nào
+        """
+        self.model_dir = model_dir
+        self.legacy_file = legacy_file
+        self.interval = interval
+        self.on_reload = on_reload
+        self.metrics = metrics
+        self.service = self._load()
+        self.reloads = 0
+        self.last_reload = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        """Service đang phục vụ; mỗi request lấy một lần và dùng suốt request"""
+        return self.service
+
+    def _load(self):
+        start = time.perf_counter()
+        service = RecommenderService(self.model_dir, self.legacy_file)
+        service.warm()
+        if self.on_reload is not None:
+            try:
+                self.on_reload(service)
+            except Exception as e:
+                # Làm nóng là tùy chọn (ví dụ DB lịch sử đang lỗi): vẫn phục vụ model, kể cả lần load đầu tiên
+                if self.metrics is not None:
+                    self.metrics.incr('model.reload_errors')
+                print(f"⚠️ Không làm nóng được model {service.version}: {type(e).__name__}: {e}")
+        if self.metrics is not None:
+            self.metrics.observe('model.load', service.load_ms)
+            self.metrics.observe('model.warm', (time.perf_counter() - start) * 1000 - service.load_ms)
+        return service
+
+    def check(self):
+        """
+        Kiểm tra version trên đĩa, nếu khác version đang phục vụ thì load version mới rồi chuyển sang
+        Returns:
+            dict thống kê lần reload, hoặc None nếu không có version mới / đang có lần reload khác
+        """
+        stored = stored_model_version(self.model_dir, self.legacy_file)
+        if stored in (None, self.service.version) or not self._lock.acquire(blocking=False):
+            return None
+        try:
+            old = self.service
+            rss_before = current_rss_mb()
+            start = time.perf_counter()
+            try:
+                new = self._load()
+            except Exception as e:
+                # Version trên đĩa đang lỗi / vừa bị xóa: tiếp tục phục vụ version cũ, thử lại lần kiểm tra sau
+                error = f"{type(e).__name__}: {e}"
+                if self.metrics is not None:
+                    self.metrics.incr('model.reload_errors')
+                if error != self.last_error:
+                    print(f"⚠️ Không load được model {stored}: {error}")
+                self.last_error = error
+                return None
+            reload_ms = (time.perf_counter() - start) * 1000
+            rss_overlap = current_rss_mb()
+
+            # Chuyển service: request mới dùng version mới, request đang chạy giữ version cũ tới khi xong
+            self.service = new
+            old_version, old_size_mb = old.version, _model_size_mb(old)
+            del old
+            gc.collect()
+            stats = {
+                'time': time.time(),
+                'from_version': old_version,
+                'to_version': new.version,
+                'load_ms': new.load_ms,
+                'reload_ms': reload_ms,
+                'rss_before_mb': rss_before,
+                'rss_overlap_mb': rss_overlap,
+                'overlap_mb': rss_overlap - rss_before,
+                'rss_after_mb': current_rss_mb(),
+                'old_model_mb': old_size_mb,
+                'new_model_mb': _model_size_mb(new),
+            }
+            self.reloads += 1
+            self.last_reload = stats
+            self.last_error = None
+            if self.metrics is not None:
+                self.metrics.observe('model.reload', reload_ms)
+                self.metrics.incr('model.reloads')
+            print(f"✓ Đã chuyển model {old_version} → {new.version}: {reload_ms:.0f} ms, "
+                  f"bộ nhớ chồng lấn +{stats['overlap_mb']:.1f} MB (RSS {rss_before:.0f} → "
+                  f"{rss_overlap:.0f} → {stats['rss_after_mb']:.0f} MB)")
+            return stats
+        finally:
+            self._lock.release()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def start(self):
+        """Chạy thread nền kiểm tra version (không làm gì nếu interval <= 0 hoặc đã chạy)"""
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name='model-reload', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """Version đang phục vụ và thống kê lần reload gần nhất (cho /health, /metrics, debug panel)"""
+        return {'version': self.service.version, 'reloads': self.reloads, 'interval_s': self.interval,
+                'last_reload': self.last_reload, 'last_error': self.last_error}
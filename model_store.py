@@ -0,0 +1,259 @@
+"""
+Lưu / load model theo định dạng thư mục có version (không dùng pickle)
+
+movie_recommender_model/
+    CURRENT                     -> tên thư mục version đang được dùng
+    v20261018-120000-123456/
+        manifest.json           -> format_version, version, thuộc tính và danh sách thành phần
+        movies_data.parquet     -> metadata phim dạng cột
+        neighbors.data.npy      -> các mảng của ma trận CSR (data / indices / indptr)
+        neighbors.indices.npy
+        neighbors.indptr.npy
+        tfidf_matrix.*.npy
+        cosine_sim.npy          -> chỉ có ở chế độ dense (int8: cosine_sim.values.npy + cosine_sim.scales.npy)
+
+Các mảng .npy được mở bằng memory-map nên nhiều worker dùng chung page cache,
+và mỗi thành phần chỉ được đọc khi lần đầu có mode cần đến.
+"""
+
+import json
+import os
+import pickle
+import shutil
+import threading
+from collections.abc import Mapping
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from recommender import neighbors_from_dense
+from precision import QuantizedRows
+
+FORMAT_VERSION = 1
+MODEL_DIR = 'movie_recommender_model'
+LEGACY_MODEL_FILE = 'movie_recommender_model.pkl'
+CURRENT_FILE = 'CURRENT'
+
+
+def _save_csr(version_dir, name, matrix):
+    """Lưu ma trận CSR thành 3 file .npy (indices và indptr cùng dtype để mmap không bị copy)"""
+    matrix = sparse.csr_matrix(matrix)
+    index_dtype = np.int32 if max(matrix.nnz, matrix.shape[1]) < np.iinfo(np.int32).max else np.int64
+    np.save(os.path.join(version_dir, f'{name}.data.npy'), matrix.data)
+    np.save(os.path.join(version_dir, f'{name}.indices.npy'), matrix.indices.astype(index_dtype, copy=False))
+    np.save(os.path.join(version_dir, f'{name}.indptr.npy'), matrix.indptr.astype(index_dtype, copy=False))
+    return {'kind': 'csr', 'shape': list(matrix.shape), 'dtype': str(matrix.data.dtype)}
+
+
+def _load_csr(version_dir, name, info, mmap_mode):
+    """Dựng lại ma trận CSR từ các mảng memory-mapped (không sắp xếp lại thứ tự trong dòng)"""
+    arrays = [np.load(os.path.join(version_dir, f'{name}.{part}.npy'), mmap_mode=mmap_mode)
+              for part in ('data', 'indices', 'indptr')]
+    return sparse.csr_matrix(tuple(arrays), shape=tuple(info['shape']), copy=False)
+
+
+def _save_quantized(version_dir, name, matrix):
+    """Lưu ma trận int8 lượng tử hóa theo dòng thành 2 file .npy (values / scales)"""
+    np.save(os.path.join(version_dir, f'{name}.values.npy'), matrix.values)
+    np.save(os.path.join(version_dir, f'{name}.scales.npy'), matrix.scales)
+    return {'kind': 'quantized', 'shape': list(matrix.shape), 'dtype': 'int8'}
+
+
+def _load_quantized(version_dir, name, mmap_mode):
+    return QuantizedRows(*(np.load(os.path.join(version_dir, f'{name}.{part}.npy'), mmap_mode=mmap_mode)
+                           for part in ('values', 'scales')))
+
+
+def _directory_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+def write_components(target_dir, data, version, **extra):
+    """
+    Ghi các thành phần (DataFrame, ma trận sparse, ndarray, str/số) + manifest.json vào một thư mục có sẵn,
+    đọc lại được bằng LazyModel
+    Args:
+        version: định danh ghi vào manifest (LazyModel.version)
+        extra: các trường thêm vào manifest
+    """
+    components, attrs = {}, {}
+    for name, value in data.items():
+        if value is None or name == 'indices':
+            # indices được dựng lại từ cột title khi load
+            continue
+        if isinstance(value, pd.DataFrame):
+            value.reset_index(drop=True).to_parquet(os.path.join(target_dir, f'{name}.parquet'), index=False)
+            components[name] = {'kind': 'frame', 'rows': len(value)}
+        elif sparse.issparse(value):
+            components[name] = _save_csr(target_dir, name, value)
+        elif isinstance(value, QuantizedRows):
+            components[name] = _save_quantized(target_dir, name, value)
+        elif isinstance(value, np.ndarray):
+            np.save(os.path.join(target_dir, f'{name}.npy'), value)
+            components[name] = {'kind': 'array', 'shape': list(value.shape), 'dtype': str(value.dtype)}
+        else:
+            attrs[name] = value
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        **extra,
+        'attrs': attrs,
+        'components': components,
+    }
+    with open(os.path.join(target_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def save_model(data, model_dir=MODEL_DIR, keep=2):
+    """
+    Ghi model ra một thư mục version mới rồi chuyển CURRENT sang version đó
+    Args:
+        data: dict các thành phần model (DataFrame, ma trận sparse, ndarray, str/số)
+        model_dir: thư mục gốc chứa các version
+        keep: số version gần nhất được giữ lại; process đang phục vụ version cũ hơn vẫn chạy được
+            vì đã mở (memory-map) mọi thành phần lúc load (RecommenderService.warm)
+    Returns:
+        str: đường dẫn thư mục version vừa ghi
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    version = datetime.now().strftime('v%Y%m%d-%H%M%S-%f')
+    version_dir = os.path.join(model_dir, version)
+    os.makedirs(version_dir)
+    write_components(version_dir, data, version)
+
+    # Chuyển CURRENT một cách nguyên tử: process đang đọc version cũ vẫn chạy bình thường
+    tmp_current = os.path.join(model_dir, CURRENT_FILE + '.tmp')
+    with open(tmp_current, 'w') as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(model_dir, CURRENT_FILE))
+
+    old_versions = sorted(d for d in os.listdir(model_dir)
+                          if d.startswith('v') and os.path.isdir(os.path.join(model_dir, d)))
+    for old in old_versions[:-keep]:
+        shutil.rmtree(os.path.join(model_dir, old), ignore_errors=True)
+
+    return version_dir
+
+
+class LazyModel(Mapping):
+    """
+    Model đọc từ thư mục version, dùng như dict: data['movies_data'], data.get('cosine_sim')...
+    Mỗi thành phần chỉ được load ở lần truy cập đầu tiên rồi giữ lại trong object
+    """
+
+    def __init__(self, version_dir, mmap_mode='r'):
+        self.version_dir = version_dir
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(version_dir, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Không hỗ trợ định dạng model version {self.manifest.get('format_version')}")
+        self.version = self.manifest['version']
+        self._loaded = {}
+        # RLock: load indices cần load movies_data trước (gọi lồng __getitem__)
+        self._lock = threading.RLock()
+
+    def _keys(self):
+        keys = list(self.manifest['attrs']) + list(self.manifest['components'])
+        if 'movies_data' in self.manifest['components']:
+            keys.append('indices')
+        return keys
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __contains__(self, name):
+        return name in self._keys()
+
+    def __getitem__(self, name):
+        if name in self.manifest['attrs']:
+            return self.manifest['attrs'][name]
+        if name in self._loaded:
+            return self._loaded[name]
+        if name not in self:
+            raise KeyError(name)
+        with self._lock:
+            if name not in self._loaded:
+                self._loaded[name] = self._load(name)
+        return self._loaded[name]
+
+    def _load(self, name):
+        if name == 'indices':
+            titles = self['movies_data']['title']
+            return pd.Series(np.arange(len(titles)), index=titles.values)
+        info = self.manifest['components'][name]
+        if info['kind'] == 'frame':
+            return pd.read_parquet(os.path.join(self.version_dir, f'{name}.parquet'))
+        if info['kind'] == 'csr':
+            return _load_csr(self.version_dir, name, info, self.mmap_mode)
+        if info['kind'] == 'quantized':
+            return _load_quantized(self.version_dir, name, self.mmap_mode)
+        return np.load(os.path.join(self.version_dir, f'{name}.npy'), mmap_mode=self.mmap_mode)
+
+    @property
+    def loaded_components(self):
+        """Danh sách thành phần đã được load (để theo dõi lazy loading)"""
+        return list(self._loaded)
+
+    @property
+    def size_mb(self):
+        return _directory_size(self.version_dir) / (1024 * 1024)
+
+
+def current_version_dir(model_dir=MODEL_DIR):
+    """Đường dẫn thư mục version mà CURRENT đang trỏ tới"""
+    with open(os.path.join(model_dir, CURRENT_FILE)) as f:
+        return os.path.join(model_dir, f.read().strip())
+
+
+def _legacy_version(legacy_file):
+    return f"legacy-{os.stat(legacy_file).st_mtime_ns}"
+
+
+def stored_model_version(model_dir=MODEL_DIR, legacy_file=LEGACY_MODEL_FILE):
+    """
+    Version của model đang nằm trên đĩa (đọc CURRENT, hoặc mtime của file pickle cũ), không load model
+    Returns:
+        str, hoặc None nếu chưa có model
+    """
+    try:
+        with open(os.path.join(model_dir, CURRENT_FILE)) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+    try:
+        return _legacy_version(legacy_file)
+    except FileNotFoundError:
+        return None
+
+
+def model_version(data):
+    """Version của model đã load (so sánh được với stored_model_version)"""
+    return data.version if isinstance(data, LazyModel) else data.get('version')
+
+
+def open_model(model_dir=MODEL_DIR, legacy_file=LEGACY_MODEL_FILE, mmap_mode='r'):
+    """
+    Mở model: ưu tiên thư mục version mới, nếu không có thì đọc file pickle cũ
+    Raises:
+        FileNotFoundError: nếu không tìm thấy model nào
+    """
+    if os.path.exists(os.path.join(model_dir, CURRENT_FILE)):
+        return LazyModel(current_version_dir(model_dir), mmap_mode=mmap_mode)
+
+    version = _legacy_version(legacy_file)
+    with open(legacy_file, 'rb') as f:
+        data = pickle.load(f)
+    data['version'] = version
+    # Model cũ (chỉ có cosine_sim dày): dựng neighbor index một lần khi load
+    if data.get('neighbors') is None:
+        data['neighbors'] = neighbors_from_dense(data['cosine_sim'])
+    return data
@@ -0,0 +1,127 @@
+"""
+Dịch vụ lấy ảnh poster phim từ TMDB API
+- Lấy poster cho cả trang kết quả cùng lúc (thread pool + requests.Session có connection pool)
+- Cache trên đĩa (SQLite, dùng chung giữa các process) có TTL,
+  cache cả kết quả "không có poster" (negative caching) để không hỏi lại liên tục
+- Địa chỉ API / ảnh đổi được qua biến môi trường (TMDB_API_BASE, TMDB_IMAGE_BASE)
+  để trỏ tới stub server khi test
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# API Key miễn phí của TMDB
+DEFAULT_API_KEY = "c7ec19ffdd3279641fb606d19ceb9bb1"
+DEFAULT_API_BASE = "https://api.themoviedb.org/3"
+DEFAULT_IMAGE_BASE = "https://image.tmdb.org/t/p/w500"
+DEFAULT_CACHE_PATH = "poster_cache.sqlite3"
+PLACEHOLDER_POSTER = "https://via.placeholder.com/500x750?text=No+Poster"
+
+POSTER_TTL = 7 * 24 * 3600  # Có poster: giữ 7 ngày
+NEGATIVE_TTL = 24 * 3600  # Phim không có poster / không tồn tại: hỏi lại sau 1 ngày
+ERROR_TTL = 60  # Lỗi mạng, timeout: thử lại sau 1 phút
+
+
+class PosterService:
+    """Lấy URL poster theo lô, có connection pool và cache trên đĩa"""
+
+    def __init__(self, api_base=None, image_base=None, api_key=None, cache_path=None,
+                 max_workers=16, timeout=5, language='vi-VN'):
+        self.api_base = (api_base or os.environ.get('TMDB_API_BASE', DEFAULT_API_BASE)).rstrip('/')
+        self.image_base = (image_base or os.environ.get('TMDB_IMAGE_BASE', DEFAULT_IMAGE_BASE)).rstrip('/')
+        self.api_key = api_key or os.environ.get('TMDB_API_KEY', DEFAULT_API_KEY)
+        self.timeout = timeout
+        self.language = language
+        # Số poster lấy từ cache trên đĩa / phải gọi API (cho debug panel)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='poster')
+
+        cache_path = cache_path or os.environ.get('POSTER_CACHE_PATH', DEFAULT_CACHE_PATH)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(cache_path, check_same_thread=False, timeout=10)
+        with self._db_lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS posters ("
+                "movie_id INTEGER PRIMARY KEY, url TEXT, expires_at REAL NOT NULL)"
+            )
+
+    def _cache_get(self, movie_ids):
+        """Đọc các poster còn hạn trong cache; url None nghĩa là đã biết phim không có poster"""
+        placeholders = ','.join('?' * len(movie_ids))
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT movie_id, url FROM posters WHERE expires_at > ? AND movie_id IN ({placeholders})",
+                [time.time(), *movie_ids]
+            ).fetchall()
+        return dict(rows)
+
+    def _cache_put(self, results):
+        """Ghi một lô kết quả (movie_id, url, ttl) vào cache trong một transaction"""
+        now = time.time()
+        with self._db_lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO posters (movie_id, url, expires_at) VALUES (?, ?, ?)",
+                [(movie_id, url, now + ttl) for movie_id, url, ttl in results]
+            )
+
+    def _fetch_one(self, movie_id):
+        """Gọi TMDB API cho một phim, trả về (movie_id, url hoặc None, ttl)"""
+        try:
+            response = self.session.get(
+                f"{self.api_base}/movie/{movie_id}",
+                params={'api_key': self.api_key, 'language': self.language},
+                timeout=self.timeout
+            )
+            if response.status_code == 404:
+                return movie_id, None, NEGATIVE_TTL
+            response.raise_for_status()
+            poster_path = response.json().get('poster_path')
+            if poster_path:
+                return movie_id, f"{self.image_base}{poster_path}", POSTER_TTL
+            return movie_id, None, NEGATIVE_TTL
+        except (requests.RequestException, ValueError):
+            # Lỗi mạng, timeout, JSON hỏng...: cache ngắn hạn để không chặn các trang sau
+            return movie_id, None, ERROR_TTL
+
+    def fetch_many(self, movie_ids):
+        """
+        Lấy poster cho nhiều phim cùng lúc
+        Args:
+            movie_ids: danh sách ID phim trên TMDB
+        Returns:
+            dict: movie_id -> URL poster (ảnh mặc định nếu không có)
+        """
+        movie_ids = list(dict.fromkeys(int(movie_id) for movie_id in movie_ids))
+        if not movie_ids:
+            return {}
+        posters = self._cache_get(movie_ids)
+        missing = [movie_id for movie_id in movie_ids if movie_id not in posters]
+        self.cache_hits += len(movie_ids) - len(missing)
+        self.cache_misses += len(missing)
+        if missing:
+            results = list(self._executor.map(self._fetch_one, missing))
+            self._cache_put(results)
+            posters.update((movie_id, url) for movie_id, url, _ in results)
+        return {movie_id: posters[movie_id] or PLACEHOLDER_POSTER for movie_id in movie_ids}
+
+    def fetch(self, movie_id):
+        """Lấy poster cho một phim"""
+        return self.fetch_many([movie_id])[int(movie_id)]
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+        self._db.close()
@@ -0,0 +1,187 @@
+"""
+Độ chính xác lưu trữ cho các ma trận similarity / điểm số
+- float64 / float32 / float16: ép kiểu trực tiếp
+- int8: lượng tử hóa theo dòng, mỗi dòng một scale (giá trị = int8 × scale của dòng)
+
+Chỉ thứ tự điểm trong từng dòng quyết định kết quả gợi ý, nên float32 (mặc định)
+hoặc thấp hơn đủ dùng và giảm 2-8 lần dung lượng / bộ nhớ so với float64.
+Ma trận sparse (TF-IDF, neighbor index) tối thiểu là float32 vì scipy không nhân được float16 / int8.
+
+Kiểm tra chất lượng ranking so với float64 trên model đã train:
+    python precision.py --queries 500 --top-n 10
+"""
+
+import argparse
+
+import numpy as np
+from scipy import sparse
+
+PRECISIONS = ['float64', 'float32', 'float16', 'int8']
+DEFAULT_PRECISION = 'float32'
+QUANTIZE_BLOCK_ROWS = 2048
+
+
+class QuantizedRows:
+    """
+    Ma trận int8 lượng tử hóa theo dòng; đọc theo dòng (index, slice, danh sách vị trí)
+    trả về float32 nên dùng thay được cho ndarray ở các chỗ chỉ đọc theo dòng như cosine_sim
+    """
+
+    dtype = np.dtype(np.float32)
+
+    def __init__(self, values, scales):
+        self.values = values
+        self.scales = scales
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.scales.nbytes
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __getitem__(self, rows):
+        values = np.asarray(self.values[rows], dtype=np.float32)
+        scales = np.asarray(self.scales[rows], dtype=np.float32)
+        return values * scales[..., None] if values.ndim > scales.ndim else values * scales
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self[:]
+        return dense if dtype is None else dense.astype(dtype, copy=False)
+
+
+def quantize_rows(matrix, self_columns=None, block_rows=QUANTIZE_BLOCK_ROWS):
+    """
+    Lượng tử hóa int8 theo dòng: scale = max |giá trị| của dòng / 127
+    Args:
+        self_columns: cột của chính phim đó trong từng dòng (đường chéo của cosine_sim);
+            ô này luôn bị loại khi ranking nên không tính vào scale, chỉ bị cắt về ±127,
+            nếu không similarity = 1 với chính nó làm mất gần hết độ phân giải của dòng
+    """
+    n_rows = matrix.shape[0]
+    values = np.empty(matrix.shape, dtype=np.int8)
+    scales = np.empty(n_rows, dtype=np.float32)
+    for start in range(0, n_rows, block_rows):
+        block = np.array(matrix[start:start + block_rows], dtype=np.float32)
+        magnitude = np.abs(block)
+        if self_columns is not None:
+            magnitude[np.arange(block.shape[0]), self_columns[start:start + block_rows]] = 0
+        block_scales = magnitude.max(axis=1) / 127
+        block_scales[block_scales == 0] = 1
+        values[start:start + block_rows] = np.clip(np.rint(block / block_scales[:, None]), -127, 127)
+        scales[start:start + block_rows] = block_scales
+    return QuantizedRows(values, scales)
+
+
+def with_precision(matrix, precision=DEFAULT_PRECISION, self_columns=None):
+    """
+    Chuyển một ma trận similarity / điểm số sang độ chính xác lưu trữ
+    Args:
+        matrix: ndarray dày hoặc ma trận sparse
+        precision: một trong PRECISIONS
+        self_columns: xem quantize_rows (mặc định: đường chéo nếu ma trận vuông)
+    Returns:
+        ndarray / QuantizedRows (int8) cho ma trận dày, CSR float32 / float64 cho ma trận sparse
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision phải là một trong {PRECISIONS}")
+    if sparse.issparse(matrix):
+        dtype = np.float64 if precision == 'float64' else np.float32
+        return sparse.csr_matrix(matrix, dtype=dtype)
+    if precision == 'int8':
+        if self_columns is None and matrix.shape[0] == matrix.shape[1]:
+            self_columns = np.arange(matrix.shape[0])
+        return quantize_rows(matrix, self_columns)
+    return np.asarray(matrix, dtype=precision)
+
+
+def _recall(reference, candidate):
+    return len(np.intersect1d(reference, candidate)) / max(len(reference), 1)
+
+
+def ranking_quality(reference_scores, scores, top_n=10, exclude=None):
+    """
+    So sánh top N của scores với top N của reference_scores (float64)
+    Returns:
+        dict recall (tỉ lệ phim trùng), same_order (cùng thứ tự hoàn toàn),
+        max_abs_error (trên các phim được xếp hạng)
+    """
+    from recommender import rank_top_n
+
+    reference_top, _ = rank_top_n(reference_scores, top_n, exclude=exclude)
+    top, _ = rank_top_n(scores, top_n, exclude=exclude)
+    error = np.abs(np.asarray(scores, dtype=np.float64) - reference_scores)
+    if exclude is not None:
+        error[np.asarray(exclude)] = 0  # Các ô bị loại khỏi ranking (int8 cắt ô của chính phim đó)
+    return {
+        'recall': _recall(reference_top, top),
+        'same_order': float(np.array_equal(reference_top, top)),
+        'max_abs_error': float(error.max()),
+    }
+
+
+def evaluate_precisions(tfidf_matrix, n_queries=500, top_n=10, seeds_per_query=3, seed=0):
+    """
+    Đo chất lượng ranking của từng precision so với similarity float64
+    trên các dòng ngẫu nhiên (Content-Based) và các hồ sơ nhiều phim (Personalized)
+    Returns:
+        dict precision -> trung bình các chỉ số của ranking_quality cho từng mode
+    """
+    rng = np.random.default_rng(seed)
+    X64 = sparse.csr_matrix(tfidf_matrix, dtype=np.float64)
+    n = X64.shape[0]
+    rows = rng.choice(n, size=min(n_queries, n), replace=False)
+    reference = (X64[rows] @ X64.T).toarray()
+    seed_sets = [rng.choice(len(rows), size=min(seeds_per_query, len(rows)), replace=False)
+                 for _ in range(len(rows))]
+
+    results = {}
+    for precision in PRECISIONS:
+        stored = with_precision(reference, precision, self_columns=rows)
+        content, personalized = [], []
+        for i, seeds in enumerate(seed_sets):
+            content.append(ranking_quality(reference[i], stored[i], top_n, exclude=[rows[i]]))
+            profile = np.asarray(stored[seeds]).mean(axis=0, dtype=np.result_type(stored.dtype, np.float32))
+            personalized.append(ranking_quality(reference[seeds].mean(axis=0), profile, top_n,
+                                                exclude=rows[seeds]))
+        itemsize = np.dtype(np.int8 if precision == 'int8' else precision).itemsize
+        results[precision] = {
+            # int8 cần thêm một scale float32 cho mỗi dòng
+            'bytes_per_value': itemsize + (4 / n if precision == 'int8' else 0),
+            'content': {key: float(np.mean([q[key] for q in content])) for key in content[0]},
+            'personalized': {key: float(np.mean([q[key] for q in personalized])) for key in personalized[0]},
+        }
+    return results
+
+
+def main():
+    from model_store import MODEL_DIR, open_model
+
+    parser = argparse.ArgumentParser(description="Đo ảnh hưởng của precision lưu trữ lên ranking so với float64")
+    parser.add_argument('--model-dir', default=MODEL_DIR, help="Thư mục model (lấy tfidf_matrix)")
+    parser.add_argument('--queries', type=int, default=500, help="Số phim truy vấn ngẫu nhiên")
+    parser.add_argument('--top-n', type=int, default=10)
+    parser.add_argument('--seeds-per-query', type=int, default=3,
+                        help="Số phim seed mỗi hồ sơ Personalized")
+    args = parser.parse_args()
+
+    model = open_model(args.model_dir)
+    results = evaluate_precisions(model['tfidf_matrix'], args.queries, args.top_n, args.seeds_per_query)
+
+    print(f"\n📊 Chất lượng top-{args.top_n} so với float64 ({args.queries} truy vấn, "
+          f"{model['tfidf_matrix'].shape[0]} phim)")
+    print(f"{'precision':<10}{'bytes/ô':>9}{'content recall':>16}{'same order':>12}"
+          f"{'personal recall':>17}{'same order':>12}{'max |err|':>12}")
+    for precision, result in results.items():
+        content, personalized = result['content'], result['personalized']
+        print(f"{precision:<10}{result['bytes_per_value']:>9.2f}{content['recall']:>16.4f}{content['same_order']:>12.4f}"
+              f"{personalized['recall']:>17.4f}{personalized['same_order']:>12.4f}"
+              f"{max(content['max_abs_error'], personalized['max_abs_error']):>12.2e}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,716 @@
+"""
+Các hàm dùng chung cho train_model.py, app.py và batch_recommend.py
+- Top-K neighbor index: chỉ lưu K phim gần nhất cho mỗi phim thay vì ma trận N×N
+- Ranking engine: chọn top N trên mảng NumPy (partial sort + mask loại phim seed)
+- User profile: vector trung bình (có trọng số) của các phim seed = một tích sparse, truy vấn
+  chính xác hoặc qua ANN index
+- Lọc theo độ tuổi: bitset thể loại tính sẵn khi train, áp dụng ngay trong bước ranking
+- Hàm gợi ý Content-Based / Personalized / Hybrid, chấm điểm theo từng truy vấn hoặc theo block truy vấn
+- Hybrid 2 bước: lấy tập ứng viên nhỏ (hàng xóm của phim seed + phim phổ biến) rồi mới chấm điểm
+"""
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from ann_index import DEFAULT_N_PROBE, MAX_BLOCK_ELEMENTS, ann_search
+
+# Hybrid 2 bước (chỉ bật khi được yêu cầu, recall@10 so với bản đầy đủ giảm dần theo kích thước
+# catalog - xem benchmark.py): số phim phổ biến nhất luôn được đưa vào tập ứng viên
+POPULARITY_HEAD_SIZE = 200
+
+# Phân loại độ tuổi -> các thể loại được phép (TMDB không có nhãn kiểm duyệt, dùng genre làm proxy)
+# P (mọi lứa tuổi) không lọc
+AGE_CONTEXT_GENRES = {
+    'K': ['Animation', 'Family'],
+    'T13': ['Action', 'Adventure', 'Comedy', 'Science Fiction', 'Fantasy', 'Romance'],
+    'T16': ['Action', 'Adventure', 'Comedy', 'Science Fiction', 'Fantasy', 'Romance',
+            'Drama', 'Crime', 'Thriller', 'War', 'History'],
+    'T18': ['Drama', 'Crime', 'Thriller', 'Romance', 'War', 'Horror', 'History'],
+}
+
+
+def _topk_rows(scores, row_ids, k):
+    """
+    Lấy top-K cột có điểm cao nhất cho từng dòng của một block điểm
+    Args:
+        scores: ma trận điểm (block_size × N), float32
+        row_ids: vị trí trong catalog của các dòng trong block
+        k: số hàng xóm cần giữ
+    Returns:
+        (top_idx, top_scores): mỗi dòng sắp xếp theo điểm giảm dần
+    """
+    # Loại chính phim đó ra khỏi danh sách hàng xóm
+    scores[np.arange(scores.shape[0]), row_ids] = -np.inf
+
+    top_idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top_scores = np.take_along_axis(scores, top_idx, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind='stable')
+    top_idx = np.take_along_axis(top_idx, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+    return top_idx, top_scores
+
+
+def _to_csr(top_idx, top_scores, n):
+    """
+    Đóng gói kết quả top-K thành CSR (indices int32, data float32)
+    Các ô có điểm -inf (không đủ K hàng xóm) bị bỏ qua
+    """
+    valid = np.isfinite(top_scores)
+    indptr = np.concatenate([[0], np.cumsum(valid.sum(axis=1))]).astype(np.int64)
+    return sparse.csr_matrix(
+        (top_scores[valid].astype(np.float32), top_idx[valid].astype(np.int32), indptr),
+        shape=(n, n)
+    )
+
+
+def _padded_rows(neighbors):
+    """Chuyển neighbor index CSR thành 2 mảng (N × K) đệm -1 / -inf cho các dòng ngắn hơn K"""
+    lengths = np.diff(neighbors.indptr)
+    k = int(lengths.max()) if lengths.shape[0] else 0
+    mask = np.arange(k)[None, :] < lengths[:, None]
+    padded_idx = np.full(mask.shape, -1, dtype=np.int32)
+    padded_scores = np.full(mask.shape, -np.inf, dtype=np.float32)
+    padded_idx[mask] = neighbors.indices
+    padded_scores[mask] = neighbors.data
+    return padded_idx, padded_scores
+
+
+def build_topk_neighbors(tfidf_matrix, top_k=50, block_size=None):
+    """
+    Tính top-K hàng xóm (cosine similarity) cho mỗi phim theo từng block dòng,
+    không bao giờ giữ toàn bộ ma trận N×N trong bộ nhớ
+    Args:
+        tfidf_matrix: ma trận TF-IDF (N × V)
+        top_k: số hàng xóm giữ lại cho mỗi phim
+        block_size: số dòng mỗi block (mặc định tự chọn theo MAX_BLOCK_ELEMENTS)
+    Returns:
+        scipy.sparse.csr_matrix (N × N): mỗi dòng chứa K hàng xóm,
+        thứ tự lưu trong dòng là điểm giảm dần
+    """
+    X = normalize(sparse.csr_matrix(tfidf_matrix, dtype=np.float32))
+    n = X.shape[0]
+    k = max(1, min(top_k, n - 1))
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // max(n, 1))
+
+    XT = X.T.tocsc()
+    all_idx = np.empty((n, k), dtype=np.int32)
+    all_scores = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = (X[start:end] @ XT).toarray().astype(np.float32, copy=False)
+        all_idx[start:end], all_scores[start:end] = _topk_rows(block, np.arange(start, end), k)
+
+    return _to_csr(all_idx, all_scores, n)
+
+
+def neighbors_from_dense(cosine_sim, top_k=50):
+    """Chuyển ma trận cosine_sim dày (model cũ) sang top-K neighbor index"""
+    n = cosine_sim.shape[0]
+    k = max(1, min(top_k, n - 1))
+    block_size = max(1, MAX_BLOCK_ELEMENTS // max(n, 1))
+    all_idx = np.empty((n, k), dtype=np.int32)
+    all_scores = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = np.array(cosine_sim[start:end], dtype=np.float32)
+        all_idx[start:end], all_scores[start:end] = _topk_rows(block, np.arange(start, end), k)
+    return _to_csr(all_idx, all_scores, n)
+
+
+def update_neighbors(neighbors, tfidf_matrix, changed, top_k=50):
+    """
+    Vá top-K neighbor index sau khi thêm mới / thay đổi một số phim (incremental update)
+    - Các phim thay đổi: tính lại chính xác top-K với toàn bộ catalog
+    - Các phim còn lại: gộp danh sách hàng xóm cũ (bỏ các phim đã thay đổi) với điểm
+      mới so với các phim thay đổi, rồi giữ lại top-K
+    Args:
+        neighbors: neighbor index cũ (n_old × n_old)
+        tfidf_matrix: TF-IDF của catalog mới (N × V), phim mới nằm ở cuối
+        changed: vị trí các phim mới hoặc đã thay đổi trong catalog mới
+    Returns:
+        scipy.sparse.csr_matrix (N × N)
+    """
+    X = normalize(sparse.csr_matrix(tfidf_matrix, dtype=np.float32))
+    n, n_old = X.shape[0], neighbors.shape[0]
+    k = max(1, min(top_k, n - 1))
+    changed = np.unique(np.asarray(changed, dtype=np.int64))
+    block_size = max(1, MAX_BLOCK_ELEMENTS // max(changed.shape[0] + k, 1))
+
+    old_idx, old_scores = _padded_rows(neighbors)
+    # Hàng xóm cũ là phim đã thay đổi thì điểm cũ không còn đúng: bỏ đi, điểm mới được tính lại bên dưới
+    old_scores[np.isin(old_idx, changed)] = -np.inf
+    pad = max(0, k - old_idx.shape[1])
+    old_idx = np.pad(old_idx, ((0, n - n_old), (0, pad)), constant_values=-1)
+    old_scores = np.pad(old_scores, ((0, n - n_old), (0, pad)), constant_values=-np.inf)
+
+    XT_changed = X[changed].T.tocsc()
+    all_idx = np.empty((n, k), dtype=np.int32)
+    all_scores = np.empty((n, k), dtype=np.float32)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        rows = np.arange(start, end)
+        new_scores = (X[start:end] @ XT_changed).toarray().astype(np.float32, copy=False)
+        new_scores[rows[:, None] == changed[None, :]] = -np.inf
+
+        cand_idx = np.hstack([old_idx[start:end], np.broadcast_to(changed, new_scores.shape)])
+        cand_scores = np.hstack([old_scores[start:end], new_scores])
+        top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(cand_scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        all_idx[start:end] = np.take_along_axis(np.take_along_axis(cand_idx, top, axis=1), order, axis=1)
+        all_scores[start:end] = np.take_along_axis(top_scores, order, axis=1)
+
+    # Các phim thay đổi: tính lại chính xác
+    XT = X.T.tocsc()
+    block_size = max(1, MAX_BLOCK_ELEMENTS // max(n, 1))
+    for start in range(0, changed.shape[0], block_size):
+        rows = changed[start:start + block_size]
+        block = (X[rows] @ XT).toarray().astype(np.float32, copy=False)
+        all_idx[rows], all_scores[rows] = _topk_rows(block, rows, k)
+
+    return _to_csr(all_idx, all_scores, n)
+
+
+def get_neighbors(neighbors, idx, top_n=10, eligible=None, tfidf_matrix=None):
+    """
+    Lấy top N hàng xóm của một phim từ neighbor index
+    Args:
+        eligible: mask các phim được phép; nếu trong K hàng xóm không đủ N phim hợp lệ
+            và có tfidf_matrix thì tính điểm chính xác trên toàn catalog
+    Returns:
+        (movie_indices, scores): đã sắp xếp theo điểm giảm dần
+    """
+    start, end = neighbors.indptr[idx], neighbors.indptr[idx + 1]
+    movie_indices, scores = neighbors.indices[start:end], neighbors.data[start:end]
+    if eligible is not None:
+        keep = np.asarray(eligible)[movie_indices]
+        if keep.sum() < top_n and tfidf_matrix is not None:
+            query = tfidf_matrix[idx]
+            query = query.T.toarray() if sparse.issparse(query) else query
+            row_scores = np.asarray(tfidf_matrix @ query).ravel()
+            return rank_top_n(row_scores, top_n, exclude=[idx], eligible=eligible)
+        movie_indices, scores = movie_indices[keep], scores[keep]
+    return movie_indices[:top_n], scores[:top_n]
+
+
+def profile_scores(movie_indices, cosine_sim=None, tfidf_matrix=None, ann_index=None,
+                   n_probe=DEFAULT_N_PROBE, seed_weights=None):
+    """
+    Điểm tương đồng trung bình (có trọng số) giữa các phim đã chọn và toàn bộ catalog
+    - Model dense: tổ hợp các dòng seed của cosine_sim theo trọng số
+    - Model top-K: vector hồ sơ là một tích sparse (trọng số seed 1 × N) @ tfidf_matrix, chấm điểm
+      bằng tích với tfidf_matrix; tương đương trung bình cosine vì các dòng TF-IDF đã chuẩn hóa L2
+    - tfidf_matrix cũng có thể là embedding dày (N × d, embedding.py): cùng công thức, chỉ là GEMV N × d
+    - Có ANN index (centroids, lists): chỉ chấm điểm các phim trong n_probe cụm gần
+      vector hồ sơ nhất, các phim còn lại nhận điểm -inf (rank_top_n không bao giờ chọn)
+    Args:
+        seed_weights: trọng số của từng phim trong movie_indices (ví dụ theo độ mới / điểm đánh giá),
+            None = các phim seed bằng nhau
+    """
+    n = (cosine_sim if cosine_sim is not None else tfidf_matrix).shape[0]
+    return weighted_profile_scores(seed_weight_row(movie_indices, n, seed_weights), cosine_sim, tfidf_matrix,
+                                   ann_index, n_probe)
+
+
+def weighted_profile_scores(weights, cosine_sim=None, tfidf_matrix=None, ann_index=None, n_probe=DEFAULT_N_PROBE):
+    """profile_scores với trọng số seed CSR (1 × N) đã dựng sẵn bằng seed_weight_row"""
+    if cosine_sim is not None or ann_index is None:
+        return profile_scores_block(weights, cosine_sim, tfidf_matrix)[0]
+    profile = seed_profiles(weights, tfidf_matrix)[0]
+    centroids, lists = ann_index
+    candidates, candidate_scores = ann_search(profile, tfidf_matrix, centroids, lists, n_probe)
+    scores = np.full(tfidf_matrix.shape[0], -np.inf, dtype=np.float32)
+    scores[candidates] = candidate_scores
+    return scores
+
+
+def genre_key(name):
+    """Khóa so khớp thể loại: bỏ khoảng trắng như cột genres_clean ('Science Fiction' -> 'ScienceFiction')"""
+    return name.replace(' ', '')
+
+
+def build_genre_bits(genre_lists, genre_names=None):
+    """
+    Mã hóa thể loại của mỗi phim thành bitset uint64
+    Args:
+        genre_lists: danh sách thể loại của từng phim (genres_list hoặc token của genres_clean)
+        genre_names: thứ tự bit đã có (khi cập nhật model), thể loại mới được thêm vào cuối
+    Returns:
+        (genre_bits, genre_names): mảng uint64 (N,) và danh sách khóa thể loại theo vị trí bit
+    """
+    genre_names = list(genre_names or [])
+    bit_of = {name: i for i, name in enumerate(genre_names)}
+    genre_bits = np.zeros(len(genre_lists), dtype=np.uint64)
+    for row, genres in enumerate(genre_lists):
+        bits = 0
+        for genre in genres:
+            key = genre_key(genre)
+            if key not in bit_of:
+                bit_of[key] = len(genre_names)
+                genre_names.append(key)
+            bits |= 1 << bit_of[key]
+        genre_bits[row] = bits
+    if len(genre_names) > 64:
+        raise ValueError("Bitset thể loại chỉ hỗ trợ tối đa 64 thể loại")
+    return genre_bits, genre_names
+
+
+def age_context_mask(genre_bits, genre_names, age_key):
+    """
+    Mask các phim được phép với phân loại độ tuổi (None nếu không cần lọc)
+    Phim hợp lệ khi có ít nhất một thể loại nằm trong danh sách cho phép
+    """
+    if age_key not in AGE_CONTEXT_GENRES:
+        return None
+    allowed = {genre_key(g) for g in AGE_CONTEXT_GENRES[age_key]}
+    allowed_bits = sum(1 << i for i, name in enumerate(genre_names) if name in allowed)
+    return (np.asarray(genre_bits) & np.uint64(allowed_bits)) != 0
+
+
+def rank_top_n(scores, top_n=10, exclude=None, eligible=None):
+    """
+    Ranking engine dùng chung: chọn top N phim có điểm cao nhất bằng partial sort
+    Args:
+        scores: mảng điểm (N,) cho toàn bộ catalog
+        top_n: số phim cần lấy
+        exclude: danh sách vị trí phim cần loại (ví dụ các phim seed)
+        eligible: mask (N,) các phim được phép xuất hiện (ví dụ lọc theo độ tuổi)
+    Returns:
+        (top_indices, top_scores): sắp xếp theo điểm giảm dần,
+        cùng điểm thì vị trí nhỏ hơn đứng trước; phim có điểm -inf (không được chấm điểm, ví dụ
+        ngoài các cụm ANN được dò) bị bỏ qua nên có thể ít hơn top_n phim
+    """
+    scores = np.asarray(scores)
+    keep = scores > -np.inf
+    if eligible is not None:
+        keep &= np.asarray(eligible, dtype=bool)
+    if exclude is not None and len(exclude) > 0:
+        keep[np.asarray(exclude, dtype=np.int64)] = False
+    candidates = np.flatnonzero(keep)
+    candidate_scores = scores[candidates]
+
+    top_n = min(top_n, candidates.shape[0])
+    if top_n <= 0:
+        return candidates[:0], candidate_scores[:0]
+    if top_n < candidates.shape[0]:
+        part = np.argpartition(-candidate_scores, top_n - 1)[:top_n]
+        # Ở ranh giới có thể có nhiều phim cùng điểm: giữ các phim có vị trí nhỏ nhất
+        threshold = candidate_scores[part].min()
+        above = part[candidate_scores[part] > threshold]
+        ties = np.flatnonzero(candidate_scores == threshold)[:top_n - above.shape[0]]
+        part = np.concatenate([above, ties])
+        candidates, candidate_scores = candidates[part], candidate_scores[part]
+
+    order = np.lexsort((candidates, -candidate_scores))
+    return candidates[order], candidate_scores[order]
+
+
+def profile_scores_block(seed_weights, cosine_sim=None, tfidf_matrix=None):
+    """
+    Điểm hồ sơ cho cả một block truy vấn bằng tích ma trận (cùng công thức với profile_scores)
+    Args:
+        seed_weights: CSR (B × N) từ build_seed_weights, dòng b là trọng số trung bình các phim seed
+    Returns:
+        mảng (B × N)
+    """
+    if cosine_sim is not None:
+        # Chỉ đọc các dòng seed của cosine_sim (memory-map hoặc lượng tử hóa int8)
+        rows = np.unique(seed_weights.indices)
+        block = np.asarray(cosine_sim[rows]).astype(np.result_type(cosine_sim.dtype, np.float32), copy=False)
+        return np.asarray(seed_weights[:, rows] @ block)
+    return np.asarray(tfidf_matrix @ seed_profiles(seed_weights, tfidf_matrix).T).T
+
+
+def seed_profiles(seed_weights, tfidf_matrix):
+    """
+    Vector hồ sơ (B × V) của cả block truy vấn: một tích sparse trọng số seed @ tfidf_matrix
+    (tfidf_matrix có thể là TF-IDF sparse hoặc embedding dày của backend 'embedding')
+    """
+    # Trọng số cùng dtype với ma trận để tích không phải ép cả ma trận float32 lên float64
+    dtype = np.result_type(tfidf_matrix.dtype, np.float32)
+    if seed_weights.shape[0] == 1 and not sparse.issparse(tfidf_matrix):
+        # Một truy vấn trên embedding dày: gom các dòng seed rồi nhân (rẻ hơn tích sparse × dense)
+        return (seed_weights.data.astype(dtype) @ tfidf_matrix[seed_weights.indices])[None, :]
+    profiles = seed_weights.astype(dtype, copy=False) @ tfidf_matrix
+    return profiles.toarray() if sparse.issparse(profiles) else np.asarray(profiles)
+
+
+def build_seed_weights(seed_lists, n, weight_lists=None):
+    """
+    Ma trận CSR (B × N): dòng b là trọng số các phim seed của truy vấn b, chuẩn hóa về tổng = 1
+    Phim seed lặp lại trong một truy vấn: không có trọng số thì chỉ tính một lần,
+    có trọng số thì cộng dồn trọng số (cùng một quy tắc cho truy vấn đơn và batch)
+    Args:
+        weight_lists: trọng số riêng của từng phim seed (cùng độ dài với seed_lists[b], ví dụ theo
+            độ mới / điểm đánh giá); None (cả danh sách hoặc của một truy vấn) = các phim seed bằng nhau
+    Raises:
+        ValueError: số trọng số khác số phim seed, trọng số âm hoặc tổng bằng 0
+    """
+    if weight_lists is None:
+        weight_lists = [None] * len(seed_lists)
+    if any(seed_weights is not None and len(seed_weights) != len(seeds)
+           for seeds, seed_weights in zip(seed_lists, weight_lists)):
+        raise ValueError("Số trọng số phải bằng số phim seed của truy vấn")
+    seed_lists = [np.asarray(seeds, dtype=np.int64) if seed_weights is not None
+                  else np.unique(np.asarray(seeds, dtype=np.int64))
+                  for seeds, seed_weights in zip(seed_lists, weight_lists)]
+    lengths = np.array([len(seeds) for seeds in seed_lists], dtype=np.int64)
+    if lengths.sum():
+        columns = np.concatenate(seed_lists)
+        weights = np.concatenate([np.ones(len(seeds)) if seed_weights is None
+                                  else np.asarray(seed_weights, dtype=np.float64)
+                                  for seeds, seed_weights in zip(seed_lists, weight_lists)])
+    else:
+        columns, weights = np.zeros(0, dtype=np.int64), np.zeros(0)
+    rows = np.repeat(np.arange(len(seed_lists)), lengths)
+    totals = np.bincount(rows, weights=weights, minlength=len(seed_lists))
+    if not np.isfinite(weights).all() or (weights < 0).any() or (totals[lengths > 0] <= 0).any():
+        raise ValueError("Trọng số phim seed phải không âm và có tổng > 0")
+    indptr = np.concatenate([[0], np.cumsum(lengths)])
+    matrix = sparse.csr_matrix((weights / totals[rows], columns, indptr), shape=(len(seed_lists), n))
+    matrix.sum_duplicates()
+    return matrix
+
+
+def seed_weight_row(movie_indices, n, seed_weights=None):
+    """Trọng số hồ sơ CSR (1 × N) của một truy vấn (quy tắc phim trùng như build_seed_weights)"""
+    return build_seed_weights([movie_indices], n, [seed_weights])
+
+
+def title_positions(selected_titles, indices):
+    """Vị trí trong catalog của từng title, tra một lần cho cả danh sách (-1 nếu không có trong model)"""
+    if not indices.index.is_unique:
+        indices = indices[~indices.index.duplicated()]
+    # Cùng dtype với index của catalog (str khi đọc từ parquet), nếu không get_indexer ép cả catalog mỗi lần tra
+    found = indices.index.get_indexer(pd.Index(list(selected_titles), dtype=indices.index.dtype))
+    return np.where(found >= 0, np.asarray(indices.values)[found], -1).astype(np.int64)
+
+
+def resolve_titles(selected_titles, indices):
+    """Vị trí trong catalog của các title có trong model (bỏ qua title không tồn tại)"""
+    positions = title_positions(selected_titles, indices)
+    return positions[positions >= 0].tolist()
+
+
+def resolve_seeds(selected_titles, indices, seed_weights=None):
+    """
+    Như resolve_titles, kèm trọng số của các title tìm thấy
+    Returns:
+        (movie_indices, weights): weights là None nếu không có seed_weights
+    Raises:
+        ValueError: số trọng số khác số title
+    """
+    positions = title_positions(selected_titles, indices)
+    found = positions >= 0
+    if seed_weights is None:
+        return positions[found].tolist(), None
+    seed_weights = np.asarray(seed_weights, dtype=np.float64)
+    if seed_weights.shape != positions.shape:
+        raise ValueError("Số trọng số phải bằng số phim seed của truy vấn")
+    return positions[found].tolist(), seed_weights[found]
+
+
+def normalize_weights(content_weight, personalized_weight, popularity_weight):
+    """Chuẩn hóa trọng số Hybrid về tổng = 1"""
+    total_weight = content_weight + personalized_weight + popularity_weight
+    if not np.isclose(total_weight, 1.0):
+        content_weight /= total_weight
+        personalized_weight /= total_weight
+        popularity_weight /= total_weight
+    return content_weight, personalized_weight, popularity_weight
+
+
+def popularity_prior(movies_data):
+    """
+    Popularity prior (từ dữ liệu đã chuẩn hóa), tính một lần khi train và lưu trong model
+    Returns:
+        mảng float32 liên tục (N,)
+    """
+    return np.ascontiguousarray(movies_data['vote_avg_scaled'].values * 0.7 +
+                                movies_data['popularity_scaled'].values * 0.3, dtype=np.float32)
+
+
+def model_popularity_prior(data):
+    """Popularity prior của model (model cũ chưa lưu thì tính từ movies_data)"""
+    if 'popularity_prior' in data:
+        return data['popularity_prior']
+    return popularity_prior(data['movies_data'])
+
+
+def popularity_head(popularity, size=POPULARITY_HEAD_SIZE):
+    """Vị trí các phim có popularity prior cao nhất (int32, giảm dần), tính sẵn khi train"""
+    top, _ = rank_top_n(popularity, size)
+    return top.astype(np.int32)
+
+
+def model_popularity_head(data):
+    """Popularity head của model (model cũ chưa lưu thì tính từ popularity prior)"""
+    if 'popularity_head' in data:
+        return data['popularity_head']
+    return popularity_head(model_popularity_prior(data))
+
+
+def hybrid_candidates(movie_indices, neighbors, head=None, eligible=None):
+    """
+    Bước 1 của Hybrid 2 bước: hợp các dòng top-K của phim seed trong neighbor index
+    với popularity head, bỏ phim seed và phim không hợp lệ
+    Returns:
+        mảng vị trí ứng viên đã sắp xếp tăng dần
+    """
+    parts = [neighbors.indices[neighbors.indptr[idx]:neighbors.indptr[idx + 1]] for idx in movie_indices]
+    if head is not None:
+        parts.append(head)
+    candidates = np.unique(np.concatenate(parts).astype(np.int64))
+    candidates = candidates[~np.isin(candidates, movie_indices)]
+    if eligible is not None:
+        candidates = candidates[np.asarray(eligible)[candidates]]
+    return candidates
+
+
+def candidate_profile_scores(movie_indices, candidates, cosine_sim=None, tfidf_matrix=None, seed_weights=None):
+    """Điểm hồ sơ (như profile_scores) nhưng chỉ tính cho các phim ứng viên"""
+    n = (cosine_sim if cosine_sim is not None else tfidf_matrix).shape[0]
+    weights = seed_weight_row(movie_indices, n, seed_weights)
+    if cosine_sim is not None:
+        rows = np.asarray(cosine_sim[weights.indices])[:, candidates]
+        return weights.data @ rows.astype(np.result_type(cosine_sim.dtype, np.float32), copy=False)
+    return np.asarray(tfidf_matrix[candidates] @ seed_profiles(weights, tfidf_matrix)[0]).ravel()
+
+
+def score_range(scores):
+    """
+    (min, max) theo trục cuối, dùng để chuẩn hóa về [0, 1] (một truy vấn hoặc từng dòng của block)
+    Phim không được chấm điểm (-inf, ngoài các cụm ANN được dò) không tính vào min
+    """
+    low = scores.min(axis=-1, keepdims=True)
+    if np.isneginf(low).any():
+        low = np.where(np.isneginf(scores), np.inf, scores).min(axis=-1, keepdims=True)
+    return low, scores.max(axis=-1, keepdims=True)
+
+
+def normalized(scores, low, high):
+    """Chuẩn hóa min-max về [0, 1] với (low, high) từ score_range"""
+    return (scores - low) / (high - low + 1e-8)
+
+
+def hybrid_scores(personalized_scores, popularity, content_weight, personalized_weight, popularity_weight,
+                  low=None, high=None):
+    """
+    HYBRID SCORE = Content + Personalized + Popularity
+    Content và Personalized là cùng một điểm hồ sơ đã chuẩn hóa min-max, nên cả công thức
+    là một phép affine trên điểm hồ sơ cộng popularity prior, tính trong một lượt
+    Dùng cho một truy vấn (N,) hoặc một block (B × N); trọng số là số hoặc cột (B × 1)
+    Args:
+        low, high: min / max của personalized_scores nếu đã có sẵn (ví dụ từ ProfileScoreCache)
+    Returns:
+        (hybrid, low, high): component của từng phim là normalized(personalized_scores[top], low, high)
+    """
+    if low is None:
+        low, high = score_range(personalized_scores)
+    scale = (content_weight + personalized_weight) / (high - low + 1e-8)
+    hybrid = personalized_scores * scale
+    hybrid += popularity_weight * popularity
+    hybrid -= scale * low
+    return hybrid, low, high
+
+
+class ProfileScoreCache:
+    """
+    LRU nhỏ giữ điểm hồ sơ (và min / max) theo tập phim seed cho một model,
+    để đổi trọng số Hybrid hay chuyển Personalized <-> Hybrid không phải tính lại tích ma trận
+    """
+
+    def __init__(self, max_entries=32):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, key):
+        """Giá trị đã tính của key (None nếu chưa có), không tính mới"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def get(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+
+def profile_components(movie_indices, cosine_sim=None, tfidf_matrix=None, ann_index=None,
+                       n_probe=DEFAULT_N_PROBE, score_cache=None, seed_weights=None):
+    """
+    Điểm hồ sơ của các phim seed cùng (min, max), lấy từ score_cache nếu đã tính
+    Returns:
+        (scores, low, high)
+    """
+    n = (cosine_sim if cosine_sim is not None else tfidf_matrix).shape[0]
+    weights = seed_weight_row(movie_indices, n, seed_weights)
+
+    def compute():
+        scores = weighted_profile_scores(weights, cosine_sim, tfidf_matrix, ann_index, n_probe)
+        return (scores, *score_range(scores))
+
+    if score_cache is None:
+        return compute()
+    return score_cache.get(profile_key(weights, cosine_sim, tfidf_matrix, ann_index, n_probe), compute)
+
+
+def profile_key(weights, cosine_sim=None, tfidf_matrix=None, ann_index=None, n_probe=DEFAULT_N_PROBE):
+    """Khóa ProfileScoreCache của một hồ sơ (trọng số seed CSR 1 × N từ seed_weight_row)"""
+    # Backend embedding (tfidf_matrix dày) cho điểm khác TF-IDF nên không dùng chung entry
+    dense_vectors = tfidf_matrix is not None and not sparse.issparse(tfidf_matrix)
+    # n_probe=None (dò một nửa số cụm) vẫn là điểm xấp xỉ: không dùng chung entry với chấm điểm chính xác
+    return (tuple(weights.indices.tolist()), tuple(np.round(weights.data, 6).tolist()), cosine_sim is not None,
+            dense_vectors, ('ann', n_probe) if ann_index is not None else None)
+
+
+# ===== HÀM GỢI Ý PHIM =====
+
+# 1. Content-Based (1 phim)
+def get_recommendations(title, neighbors, indices, movies_data, top_n=10, eligible=None, tfidf_matrix=None):
+    """Content-Based Filtering: Gợi ý dựa trên 1 phim (đọc từ top-K neighbor index)"""
+    try:
+        idx = indices[title]
+    except KeyError:
+        return None
+    movie_indices, scores = get_neighbors(neighbors, idx, top_n, eligible, tfidf_matrix)
+
+    result = movies_data.iloc[movie_indices].copy()
+    result['similarity_score'] = scores
+    return result
+
+# 2. Personalized (nhiều phim - User Profile)
+def get_personalized_recommendations(selected_titles, cosine_sim, indices, movies_data, top_n=10,
+                                     tfidf_matrix=None, ann_index=None, n_probe=DEFAULT_N_PROBE,
+                                     eligible=None, score_cache=None, seed_weights=None):
+    """
+    Personalized: Tạo User Profile từ nhiều phim yêu thích (None nếu không có phim nào hợp lệ)
+    Args:
+        seed_weights: trọng số của từng title trong selected_titles (ví dụ theo độ mới / điểm đánh giá),
+            None = các phim bằng nhau
+    """
+    movie_indices, weights = resolve_seeds(selected_titles, indices, seed_weights)
+    if len(movie_indices) == 0:
+        return None
+
+    # Tạo User Profile: trung bình (có trọng số) similarity với các phim đã chọn, một tích sparse
+    total_scores, _, _ = profile_components(movie_indices, cosine_sim, tfidf_matrix, ann_index, n_probe,
+                                            score_cache, weights)
+
+    # Sắp xếp và lọc (loại các phim đã chọn, chỉ giữ phim hợp lệ)
+    top_indices, top_scores = rank_top_n(total_scores, top_n, exclude=movie_indices, eligible=eligible)
+
+    result = movies_data.iloc[top_indices].copy()
+    result['personalization_score'] = top_scores
+    return result
+
+# 3. HYBRID (Content + Personalized + Popularity)
+def get_hybrid_recommendations(selected_titles, cosine_sim, indices, movies_data, top_n=10,
+                               content_weight=0.4, personalized_weight=0.4, popularity_weight=0.2,
+                               tfidf_matrix=None, ann_index=None, n_probe=DEFAULT_N_PROBE,
+                               eligible=None, popularity=None, score_cache=None, neighbors=None, head=None,
+                               seed_weights=None):
+    """
+    HYBRID System: Kết hợp Content + Personalized + Popularity như Netflix
+    Args:
+        popularity: popularity prior đã tính khi train (mặc định tính từ movies_data)
+        score_cache: ProfileScoreCache của model; đổi trọng số thì dùng lại điểm hồ sơ đã tính
+        neighbors: truyền neighbor index để chạy Hybrid 2 bước (chỉ chấm điểm tập ứng viên,
+            độ trễ theo K thay vì theo kích thước catalog); head là popularity head của model.
+            Kết quả xấp xỉ: có thể bỏ sót phim ngoài tập ứng viên, và min / max để chuẩn hóa chỉ
+            chính xác khi score_cache đã có điểm toàn catalog của cùng tập phim seed
+        seed_weights: trọng số của từng title trong selected_titles, None = các phim bằng nhau
+    """
+    movie_indices, seed_weights = resolve_seeds(selected_titles, indices, seed_weights)
+    if len(movie_indices) == 0:
+        return None
+
+    weights = normalize_weights(content_weight, personalized_weight, popularity_weight)
+    if popularity is None:
+        popularity = popularity_prior(movies_data)
+    if neighbors is not None:
+        result = _two_stage_hybrid(movie_indices, neighbors, movies_data, top_n, weights, cosine_sim,
+                                   tfidf_matrix, eligible, popularity, head, seed_weights, score_cache)
+        if result is not None:
+            return result
+
+    personalized_scores, low, high = profile_components(movie_indices, cosine_sim, tfidf_matrix, ann_index,
+                                                        n_probe, score_cache, seed_weights)
+    hybrid, low, high = hybrid_scores(personalized_scores, popularity, *weights, low=low, high=high)
+    if ann_index is not None:
+        # Phim ngoài các cụm ANN được dò không có điểm hồ sơ: không được gợi ý chỉ nhờ popularity
+        hybrid[np.isneginf(personalized_scores)] = -np.inf
+
+    # Sắp xếp (loại các phim đã chọn, chỉ giữ phim hợp lệ)
+    top_indices, top_scores = rank_top_n(hybrid, top_n, exclude=movie_indices, eligible=eligible)
+
+    component = normalized(personalized_scores[top_indices], low, high)
+    result = movies_data.iloc[top_indices].copy()
+    result['hybrid_score'] = top_scores
+    result['content_component'] = component
+    result['personalized_component'] = component
+    result['popularity_component'] = popularity[top_indices]
+    return result
+
+
+def _two_stage_hybrid(movie_indices, neighbors, movies_data, top_n, weights, cosine_sim, tfidf_matrix,
+                      eligible, popularity, head, seed_weights=None, score_cache=None):
+    """
+    Hybrid 2 bước: lấy ứng viên rồi chỉ chấm điểm Hybrid trên các ứng viên đó
+    Chuẩn hóa min-max cần min / max điểm hồ sơ của toàn catalog:
+    - score_cache đã có điểm toàn catalog của cùng tập phim seed (ví dụ vừa chạy Personalized / Hybrid
+      đầy đủ): dùng đúng min / max đó, kết quả trên ứng viên giống hệt bản đầy đủ
+    - Không có: xấp xỉ. min coi như 0 (điểm TF-IDF / cosine không âm, thường có phim không chung từ nào),
+      max lấy trên ứng viên + phim seed; chỉ dùng với điểm TF-IDF / cosine_sim vì cosine của embedding
+      SVD có thể âm
+    Returns:
+        DataFrame kết quả, hoặc None nếu không đủ top_n ứng viên hợp lệ (gọi lại bản đầy đủ)
+    """
+    candidates = hybrid_candidates(movie_indices, neighbors, head, eligible)
+    if candidates.shape[0] < top_n:
+        return None
+
+    # Bước 2: re-rank ứng viên bằng công thức Hybrid
+    cached = None
+    if score_cache is not None:
+        n = (cosine_sim if cosine_sim is not None else tfidf_matrix).shape[0]
+        cached = score_cache.peek(profile_key(seed_weight_row(movie_indices, n, seed_weights), cosine_sim,
+                                              tfidf_matrix))
+    if cached is not None:
+        full_scores, low, high = cached
+        personalized_scores = full_scores[candidates]
+    else:
+        # Phim seed được chấm cùng lượt với ứng viên (vector hồ sơ / các dòng seed của cosine_sim chỉ đọc một lần)
+        scores = candidate_profile_scores(movie_indices, np.concatenate([candidates, movie_indices]), cosine_sim,
+                                          tfidf_matrix, seed_weights)
+        personalized_scores, seed_scores = scores[:candidates.shape[0]], scores[candidates.shape[0]:]
+        low = min(float(personalized_scores.min()), 0.0)
+        high = max(float(personalized_scores.max()), float(seed_scores.max()))
+    candidate_popularity = popularity[candidates]
+    hybrid, low, high = hybrid_scores(personalized_scores, candidate_popularity, *weights, low=low, high=high)
+    order, top_scores = rank_top_n(hybrid, top_n)
+
+    top_indices = candidates[order]
+    component = normalized(personalized_scores[order], low, high)
+    result = movies_data.iloc[top_indices].copy()
+    result['hybrid_score'] = top_scores
+    result['content_component'] = component
+    result['personalized_component'] = component
+    result['popularity_component'] = candidate_popularity[order]
+    return result
@@ -0,0 +1,84 @@
+"""
+Cache kết quả gợi ý dùng chung cho mọi session trong một process
+- Khóa đã chuẩn hóa: (mode, ID phim seed đã sắp xếp, top_n, trọng số làm tròn theo bước slider,
+  phân loại độ tuổi, version model) nên nhiều người chọn cùng các phim phổ biến dùng chung kết quả
+- LRU giới hạn số kết quả + TTL, đếm hit / miss để theo dõi hit rate
+- Đổi version model thì toàn bộ kết quả cũ bị bỏ
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 3600  # giây
+WEIGHT_STEP = 0.05  # Bước của slider trọng số trong app (5%)
+
+
+def make_key(mode, seed_ids, top_n, weights=None, age_context=None, model_version=None, **options):
+    """
+    Khóa cache đã chuẩn hóa cho một truy vấn
+    Args:
+        seed_ids: vị trí / ID các phim seed (thứ tự không quan trọng)
+        weights: (content, personalized, popularity) hoặc None với mode không dùng trọng số
+        options: các tham số khác làm đổi kết quả (n_probe, two_stage...)
+    """
+    seeds = tuple(sorted({int(seed) for seed in seed_ids}))
+    if weights is not None:
+        weights = tuple(int(round(weight / WEIGHT_STEP)) for weight in weights)
+    return (mode, seeds, int(top_n), weights, age_context, model_version, tuple(sorted(options.items())))
+
+
+class ResultCache:
+    """LRU + TTL cho kết quả gợi ý, an toàn khi nhiều session (thread) dùng chung"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Kết quả đã cache (None nếu chưa có hoặc đã hết hạn)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self._clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def sync_version(self, model_version):
+        """Bỏ toàn bộ kết quả khi version model đổi"""
+        with self._lock:
+            if model_version != self._version:
+                self._entries.clear()
+                self._version = model_version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                    'size': len(self._entries), 'max_entries': self.max_entries}
@@ -0,0 +1,389 @@
+"""
+HTTP service gợi ý phim, tách khỏi Streamlit (asyncio, chỉ dùng thư viện chuẩn)
+- Nhiều worker process (fork) cùng accept trên một socket; mỗi worker mở model bằng memory-map
+  nên các mảng lớn nằm chung trong page cache của hệ điều hành
+- Mỗi worker: event loop nhận request, chấm điểm chạy trên thread pool
+- Mỗi request được đo thời gian (instrumentation.RequestTrace) và ghi vào trace log JSON
+- Model mới train / update được load ở thread nền rồi chuyển sang (model_reload.py), không cần khởi động lại
+
+Endpoints (JSON):
+    GET  /health
+    GET  /metrics
+    GET  /titles/search?q=drak+knight&limit=10
+    GET  /recommend/content?title=Avatar&top_n=10&age=T13
+    POST /recommend/content        {"title": "Avatar", "top_n": 10, "age": "T13"}
+    POST /recommend/personalized   {"titles": ["Avatar", "Titanic"], "top_n": 10, "age": "P",
+                                    "seed_weights": [2.0, 1.0]}
+    POST /recommend/hybrid         {"titles": [...], "weights": {"content": 0.4, "personalized": 0.4,
+                                    "popularity": 0.2}, "two_stage": true, "n_probe": 16,
+                                    "backend": "tfidf"}
+    POST /recommend/batch          {"queries": [{"query_id": "u1", "mode": "hybrid", "titles": [...]}],
+                                    "mode": "hybrid", "top_n": 10}
+
+two_stage (Hybrid, chỉ với backend tfidf) là xấp xỉ: chỉ chấm điểm hàng xóm của các phim seed và các phim
+phổ biến nhất, chuẩn hóa bằng min / max ước lượng; recall@10 so với chấm điểm đầy đủ giảm theo kích thước
+catalog (xem benchmark.py)
+
+Ví dụ:
+    python server.py --port 8000 --workers 4
+    curl -X POST localhost:8000/recommend/hybrid -d '{"titles": ["Avatar", "Titanic"]}'
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+
+from ann_index import DEFAULT_N_PROBE
+from batch_recommend import DEFAULT_WEIGHTS
+from embedding import BACKENDS, DEFAULT_BACKEND
+from history_store import DEFAULT_HISTORY_PATH, HistoryStore, warm_result_cache
+from instrumentation import Metrics, RequestTrace, setup_trace_log
+from model_reload import RELOAD_CHECK_SECONDS, ModelReloader
+from model_store import MODEL_DIR
+from service import SCORE_COLUMNS
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+MAX_TOP_N = 100
+# Các cột metadata trả về cho mỗi phim gợi ý
+RESPONSE_COLUMNS = ['id', 'title', 'genres_clean', 'vote_average', 'vote_count', 'popularity', 'release_date']
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def _records(result, mode):
+    """DataFrame kết quả -> danh sách dict (metadata + điểm số của mode)"""
+    if result is None:
+        return []
+    columns = [col for col in RESPONSE_COLUMNS + SCORE_COLUMNS[mode] if col in result.columns]
+    frame = result[columns].astype(object).where(result[columns].notna(), None)
+    return frame.to_dict('records')
+
+
+def _int_param(params, name, default, low=1, high=None):
+    value = params.get(name, default)
+    if value is None:
+        # Không truyền và không có giá trị mặc định (ví dụ n_probe: service tự chọn theo index)
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, f"{name} phải là số nguyên")
+    if value < low or (high is not None and value > high):
+        raise HTTPError(400, f"{name} phải nằm trong [{low}, {high}]")
+    return value
+
+
+def _bool_param(params, name, default=None):
+    """Cờ true / false từ JSON (bool) hoặc query string ('1', 'true', 'yes')"""
+    value = params.get(name, default)
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes')
+    return value if value is None else bool(value)
+
+
+def _titles_param(params, mode):
+    titles = params.get('titles')
+    if titles is None and params.get('title') is not None:
+        titles = [params['title']]
+    if isinstance(titles, str):
+        titles = [title.strip() for title in titles.split('|') if title.strip()]
+    if not titles or not isinstance(titles, list):
+        raise HTTPError(400, "cần 'titles' (danh sách tên phim)" if mode != 'content' else "cần 'title'")
+    return [str(title) for title in titles]
+
+
+def _weights_param(params):
+    weights = params.get('weights') or {}
+    if not isinstance(weights, dict):
+        raise HTTPError(400, "weights phải là object {content, personalized, popularity}")
+    try:
+        return tuple(float(weights.get(name.replace('_weight', ''), default))
+                     for name, default in DEFAULT_WEIGHTS.items())
+    except (TypeError, ValueError):
+        raise HTTPError(400, "weights phải là số")
+
+
+def _seed_weights_param(params, titles):
+    seed_weights = params.get('seed_weights')
+    if seed_weights is None:
+        return None
+    if isinstance(seed_weights, str):
+        seed_weights = seed_weights.split('|')
+    if not isinstance(seed_weights, list) or len(seed_weights) != len(titles):
+        raise HTTPError(400, "seed_weights phải là danh sách cùng độ dài với titles")
+    try:
+        return [float(weight) for weight in seed_weights]
+    except (TypeError, ValueError):
+        raise HTTPError(400, "seed_weights phải là số")
+
+
+class RecommendationServer:
+    """Một worker: định tuyến request tới RecommenderService, chấm điểm trên thread pool"""
+
+    def __init__(self, model_dir=MODEL_DIR, threads=4, reload_interval=RELOAD_CHECK_SECONDS, on_reload=None,
+                 metrics=None):
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Mỗi request lấy service một lần (self.reloader.current()) nên chạy trọn trên một version model
+        self.reloader = ModelReloader(model_dir, interval=reload_interval, on_reload=on_reload,
+                                      metrics=self.metrics).start()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='score')
+        self.routes = {
+            ('GET', '/health'): self.health,
+            ('GET', '/metrics'): self.metrics_snapshot,
+            ('GET', '/titles/search'): self.search_titles,
+            ('GET', '/recommend/content'): lambda params: self.recommend('content', params),
+            ('POST', '/recommend/content'): lambda params: self.recommend('content', params),
+            ('POST', '/recommend/personalized'): lambda params: self.recommend('personalized', params),
+            ('POST', '/recommend/hybrid'): lambda params: self.recommend('hybrid', params),
+            ('POST', '/recommend/batch'): self.batch,
+        }
+
+    def health(self, params):
+        service = self.reloader.current()
+        backends = BACKENDS if service.has_embedding else [DEFAULT_BACKEND]
+        return {'status': 'ok', 'version': service.version, 'movies': len(service.movies_data),
+                'backends': backends, 'reloads': self.reloader.reloads, 'pid': os.getpid()}
+
+    def metrics_snapshot(self, params):
+        return {**self.metrics.snapshot(), 'result_cache': self.reloader.current().result_cache.stats(),
+                'model_reload': self.reloader.stats(), 'pid': os.getpid()}
+
+    def search_titles(self, params):
+        query = str(params.get('q', '')).strip()
+        if not query:
+            raise HTTPError(400, "cần tham số q")
+        limit = _int_param(params, 'limit', 10, high=MAX_TOP_N)
+        return {'query': query, 'titles': self.reloader.current().title_index.search(query, limit=limit)}
+
+    def recommend(self, mode, params):
+        titles = _titles_param(params, mode)
+        top_n = _int_param(params, 'top_n', 10, high=MAX_TOP_N)
+        weights = _weights_param(params) if mode == 'hybrid' else None
+        seed_weights = _seed_weights_param(params, titles) if mode != 'content' else None
+        n_probe = _int_param(params, 'n_probe', DEFAULT_N_PROBE)
+        # Hybrid 2 bước là xấp xỉ: chỉ chấm điểm hàng xóm của phim seed + phim phổ biến nhất, và chuẩn hóa
+        # bằng min / max ước lượng (min = 0, max trên ứng viên) trừ khi điểm toàn catalog đã có trong cache
+        two_stage = _bool_param(params, 'two_stage', False)
+        fuzzy = _bool_param(params, 'fuzzy', False)
+        backend = str(params.get('backend', DEFAULT_BACKEND)).lower()
+
+        service = self.reloader.current()
+        trace = RequestTrace(mode, n_seeds=len(titles), top_n=top_n, age=params.get('age'), backend=backend)
+        # Tra title một lần: vị trí dùng để chấm điểm, các title không tìm thấy trả về cho client
+        located, missing = service.resolve(titles, fuzzy)
+        result, cache_hit = service.recommend(mode, titles, top_n=top_n, weights=weights, age=params.get('age'),
+                                              n_probe=n_probe, two_stage=two_stage, trace=trace, backend=backend,
+                                              seed_weights=seed_weights, located=located)
+        self.metrics.incr('result_cache.hit' if cache_hit else 'result_cache.miss')
+        trace.finish(self.metrics, cache_hit=cache_hit, n_results=0 if result is None else len(result))
+        return {'mode': mode, 'version': service.version, 'cache_hit': cache_hit,
+                'missing_titles': missing, 'results': _records(result, mode)}
+
+    def batch(self, params):
+        queries = params.get('queries')
+        if not isinstance(queries, list) or not queries:
+            raise HTTPError(400, "cần 'queries' (danh sách truy vấn)")
+        frame = pd.DataFrame(queries)
+        if 'titles' not in frame.columns:
+            raise HTTPError(400, "mỗi truy vấn cần 'titles'")
+        default_ids = pd.Series(np.arange(len(frame)).astype(str), index=frame.index)
+        frame['query_id'] = frame['query_id'].fillna(default_ids) if 'query_id' in frame.columns else default_ids
+        top_n = _int_param(params, 'top_n', 10, high=MAX_TOP_N)
+        fuzzy = _bool_param(params, 'fuzzy', False)
+        backend = str(params.get('backend', DEFAULT_BACKEND)).lower()
+        n_probe = _int_param(params, 'n_probe', DEFAULT_N_PROBE)
+
+        service = self.reloader.current()
+        trace = RequestTrace('batch', n_queries=len(frame), backend=backend)
+        with trace.span('scoring'):
+            results, n_missing = service.batch(frame, mode=params.get('mode', 'hybrid'), top_n=top_n,
+                                               fuzzy=fuzzy, backend=backend, n_probe=n_probe)
+        trace.finish(self.metrics, n_results=len(results))
+        return {'version': service.version, 'n_queries': len(frame), 'n_missing': n_missing,
+                'results': results.astype(object).where(results.notna(), None).to_dict('records')}
+
+    def dispatch(self, method, target, body):
+        """Xử lý một request (chạy trên thread pool). Returns: (status, payload)"""
+        url = urlsplit(target)
+        handler = self.routes.get((method, url.path))
+        try:
+            if handler is None:
+                if any(path == url.path for _, path in self.routes):
+                    raise HTTPError(405, f"{method} không được hỗ trợ cho {url.path}")
+                raise HTTPError(404, f"Không có endpoint {url.path}")
+            params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            if body:
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    raise HTTPError(400, "body phải là JSON")
+                if not isinstance(payload, dict):
+                    raise HTTPError(400, "body phải là JSON object")
+                params.update(payload)
+            self.metrics.incr(f"requests.{url.path}")
+            return 200, handler(params)
+        except HTTPError as e:
+            self.metrics.incr(f"errors.{e.status}")
+            return e.status, {'error': str(e)}
+        except ValueError as e:
+            self.metrics.incr('errors.400')
+            return 400, {'error': str(e)}
+        except Exception as e:
+            self.metrics.incr('errors.500')
+            return 500, {'error': f"{type(e).__name__}: {e}"}
+
+    async def handle_connection(self, reader, writer):
+        """HTTP/1.1 tối giản: keep-alive, body theo Content-Length"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    status, payload = 413, {'error': f"body lớn hơn {MAX_BODY_BYTES} bytes"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await loop.run_in_executor(self.executor, self.dispatch,
+                                                                 method.upper(), target, body)
+                    keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                data = json.dumps(payload, ensure_ascii=False, default=_json_default).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                    f"Content-Type: application/json; charset=utf-8\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, sock):
+        server = await asyncio.start_server(self.handle_connection, sock=sock)
+        async with server:
+            await server.serve_forever()
+
+
+def _run_worker(sock, args):
+    setup_trace_log(args.trace_log)
+    metrics = Metrics()
+    on_reload = None
+    if args.warm_up > 0 and os.path.exists(args.history):
+        history = HistoryStore(args.history)
+
+        def on_reload(service):
+            # Cache kết quả của mỗi version model được làm nóng bằng các truy vấn hay gặp nhất trong lịch sử
+            warmed = warm_result_cache(service, history, limit=args.warm_up)
+            metrics.incr('result_cache.warmed', warmed)
+            print(f"✓ Worker {os.getpid()}: đã làm nóng cache model {service.version} với {warmed} truy vấn")
+
+    app = RecommendationServer(args.model_dir, threads=args.threads, reload_interval=args.reload_interval,
+                               on_reload=on_reload, metrics=metrics)
+    service = app.reloader.current()
+    print(f"✓ Worker {os.getpid()}: model {service.version} ({len(service.movies_data):,} phim)")
+    try:
+        asyncio.run(app.serve(sock))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP service gợi ý phim (JSON)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Số worker process (fork), dùng chung model memory-map qua page cache")
+    parser.add_argument('--threads', type=int, default=4, help="Số thread chấm điểm mỗi worker")
+    parser.add_argument('--model-dir', default=MODEL_DIR, help="Thư mục model")
+    parser.add_argument('--trace-log', default=None,
+                        help="File JSON lines ghi từng request (mặc định RECOMMENDER_TRACE_LOG / "
+                             "recommender_trace.jsonl, rỗng = tắt)")
+    parser.add_argument('--warm-up', type=int, default=0,
+                        help="Làm nóng cache kết quả bằng N truy vấn hay gặp nhất trong lịch sử tìm kiếm")
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH, help="File lịch sử tìm kiếm (SQLite) của app")
+    parser.add_argument('--reload-interval', type=float, default=RELOAD_CHECK_SECONDS,
+                        help="Số giây giữa hai lần kiểm tra version model mới trên đĩa (0 = tắt hot-reload)")
+    args = parser.parse_args()
+
+    sock = socket.create_server((args.host, args.port), backlog=1024)
+    sock.setblocking(False)
+    print("=" * 60)
+    print(f"🎬 TMDB MOVIE RECOMMENDER - HTTP SERVICE http://{args.host}:{args.port}")
+    print("=" * 60)
+
+    workers = args.workers if hasattr(os, 'fork') else 1
+    if workers <= 1:
+        _run_worker(sock, args)
+        return
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                _run_worker(sock, args)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+    print("\n✅ Đã dừng service")
+
+
+if __name__ == '__main__':
+    main()
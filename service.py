@@ -0,0 +1,209 @@
+"""
+Lớp phục vụ gợi ý dùng chung cho Streamlit app (app.py) và HTTP service (server.py)
+- Mở model (memory-map) và giữ các thành phần dựng từ model: mask độ tuổi, popularity prior / head,
+  title index, cache điểm hồ sơ và cache kết quả
+- recommend(): một truy vấn Content-Based / Personalized / Hybrid, có cache theo truy vấn đã chuẩn hóa
+- batch(): nhiều truy vấn một lần (dùng recommend_batch của batch_recommend.py)
+
+Ví dụ:
+    service = RecommenderService()
+    result, cache_hit = service.recommend('hybrid', ['Avatar', 'Titanic'], top_n=10, age='T13')
+"""
+
+import time
+from contextlib import nullcontext
+from functools import cached_property
+
+import numpy as np
+
+from ann_index import DEFAULT_N_PROBE, default_n_probe
+from batch_recommend import DEFAULT_WEIGHTS, MODES, EligibleMasks, recommend_batch
+from embedding import DEFAULT_BACKEND, model_vectors
+from model_store import LEGACY_MODEL_FILE, MODEL_DIR, model_version, open_model, stored_model_version
+from recommender import (ProfileScoreCache, get_hybrid_recommendations, get_personalized_recommendations,
+                         get_recommendations, model_popularity_head, model_popularity_prior)
+from result_cache import ResultCache, make_key
+from title_index import TitleIndex
+
+# Cột điểm số trả về theo mode
+SCORE_COLUMNS = {
+    'content': ['similarity_score'],
+    'personalized': ['personalization_score'],
+    'hybrid': ['hybrid_score', 'content_component', 'personalized_component', 'popularity_component'],
+}
+
+
+class RecommenderService:
+    """Model đã mở + các thành phần dựng từ model; an toàn khi nhiều thread gọi cùng lúc"""
+
+    def __init__(self, model_dir=MODEL_DIR, legacy_file=LEGACY_MODEL_FILE, result_cache=None):
+        self.model_dir = model_dir
+        self.legacy_file = legacy_file
+        start = time.perf_counter()
+        # Các mảng được memory-map và chỉ load khi mode đầu tiên cần đến (hoặc khi warm())
+        self.model = open_model(model_dir, legacy_file)
+        self.load_ms = (time.perf_counter() - start) * 1000
+        self.version = model_version(self.model)
+        self.movies_data = self.model['movies_data']
+        self.indices = self.model['indices']
+        self.has_ann_index = 'ann_centroids' in self.model
+        self.has_embedding = 'embedding' in self.model
+        self.score_cache = ProfileScoreCache()
+        self.result_cache = result_cache if result_cache is not None else ResultCache()
+        self.result_cache.sync_version(self.version)
+
+    def is_stale(self):
+        """Model trên đĩa đã được train / update sang version khác"""
+        return stored_model_version(self.model_dir, self.legacy_file) not in (None, self.version)
+
+    def warm(self):
+        """
+        Mở trước mọi thành phần của model (memory-map) và dựng các thành phần lazy (title index,
+        mask độ tuổi, popularity) để truy vấn đầu tiên sau khi load không phải chờ
+        Thư mục version có thể bị save_model xóa khi đã có đủ version mới hơn: file đã map vẫn đọc được,
+        nên mọi thành phần (kể cả cosine_sim) phải được mở trước khi điều đó xảy ra
+        """
+        for name in self.model:
+            self.model[name]
+        self.title_index, self.masks, self.popularity, self.popularity_head
+
+    @cached_property
+    def masks(self):
+        """Mask độ tuổi theo age key (bitset thể loại của model, model cũ thì dựng từ genres_clean)"""
+        return EligibleMasks(self.model)
+
+    @cached_property
+    def popularity(self):
+        """Popularity prior tính sẵn khi train (model cũ chưa có thì tính một lần từ movies_data)"""
+        return model_popularity_prior(self.model)
+
+    @cached_property
+    def popularity_head(self):
+        """Các phim phổ biến nhất, luôn nằm trong tập ứng viên của Hybrid 2 bước"""
+        return model_popularity_head(self.model)
+
+    @cached_property
+    def title_index(self):
+        """Title index lưu cùng model: tên đã sắp xếp sẵn + tìm kiếm gần đúng"""
+        return TitleIndex.from_model(self.model)
+
+    @property
+    def ann_index(self):
+        return (self.model['ann_centroids'], self.model['ann_lists']) if self.has_ann_index else None
+
+    def resolve(self, titles, fuzzy=False):
+        """
+        Vị trí trong catalog của các title (không phân biệt hoa thường / dấu)
+        Returns:
+            (located, missing): mảng vị trí theo thứ tự titles (-1 = không tìm thấy, truyền lại cho
+            recommend để không phải tra lần nữa) và các title không tìm thấy
+        """
+        located = self.title_index.locate(titles, fuzzy=fuzzy)
+        missing = [title for title, position in zip(titles, located) if position < 0]
+        return located, missing
+
+    def recommend(self, mode, titles, top_n=10, weights=None, age=None, n_probe=DEFAULT_N_PROBE,
+                  two_stage=False, fuzzy=False, trace=None, backend=DEFAULT_BACKEND, seed_weights=None,
+                  located=None):
+        """
+        Một truy vấn gợi ý
+        Args:
+            mode: 'content' (dùng title đầu tiên) | 'personalized' | 'hybrid'
+            weights: (content, personalized, popularity) cho Hybrid (mặc định 0.4 / 0.4 / 0.2)
+            age: age key (P/K/T13/T16/T18) hoặc None
+            n_probe: số cụm ANN được dò (None = một nửa số cụm của index)
+            two_stage: Hybrid 2 bước (nhanh hơn nhưng có thể bỏ sót phim so với chấm điểm toàn catalog),
+                chỉ áp dụng với backend 'tfidf'
+            trace: RequestTrace để đo các span cache_lookup / filtering / scoring
+            backend: 'tfidf' | 'embedding' - ma trận dùng để chấm điểm Personalized / Hybrid
+                (Content-Based luôn đọc neighbor index)
+            seed_weights: trọng số của từng title cho Personalized / Hybrid (ví dụ theo độ mới / điểm
+                đánh giá), None = các phim bằng nhau
+            located: vị trí đã tra sẵn của titles (từ resolve), None = tra trong title index
+        Returns:
+            (result, cache_hit): DataFrame kết quả (None nếu không có title nào hợp lệ)
+        Raises:
+            ValueError: mode / backend không hợp lệ, model chưa có embedding, hoặc seed_weights
+                không khớp titles
+        """
+        if mode not in MODES:
+            raise ValueError(f"Mode không hợp lệ: {mode} (chọn trong {MODES})")
+        if mode == 'content':
+            backend = DEFAULT_BACKEND
+        cosine_sim, vectors, use_ann = model_vectors(self.model, backend)
+        ann_index = self.ann_index if use_ann else None
+        if ann_index is not None and n_probe is None:
+            n_probe = default_n_probe(ann_index[1].shape[0])
+        span = trace.span if trace is not None else (lambda name: nullcontext())
+        if located is None:
+            located = self.title_index.locate(titles, fuzzy=fuzzy)
+        if seed_weights is not None:
+            seed_weights = np.asarray(seed_weights, dtype=np.float64)
+            if seed_weights.shape != located.shape:
+                raise ValueError("Số trọng số phải bằng số title")
+            seed_weights = seed_weights[located >= 0]
+        positions = located[located >= 0].tolist()
+        if mode == 'content':
+            positions, seed_weights = positions[:1], None
+        if not positions:
+            return None, False
+        if mode != 'hybrid':
+            weights, two_stage = None, False
+        else:
+            weights = tuple(weights) if weights is not None else tuple(DEFAULT_WEIGHTS.values())
+            # Hybrid 2 bước coi min điểm hồ sơ của catalog là 0 (điểm TF-IDF không âm); cosine của
+            # embedding có thể âm nên backend 'embedding' luôn chấm điểm toàn catalog
+            two_stage = bool(two_stage) and backend == DEFAULT_BACKEND
+        age = str(age).split()[0] if age else None
+
+        # Truy vấn giống nhau (cùng tập phim, trọng số, độ tuổi, version model) dùng lại kết quả đã tính
+        seed_key = None if seed_weights is None else tuple(sorted(zip(positions, np.round(seed_weights, 4).tolist())))
+        cache_key = make_key(mode, positions, top_n, weights=weights, age_context=age, model_version=self.version,
+                             n_probe=n_probe if ann_index is not None else None, two_stage=two_stage,
+                             backend=backend, seed_weights=seed_key)
+        with span('cache_lookup'):
+            result = self.result_cache.get(cache_key)
+        if result is not None:
+            return result, True
+
+        # Context-Aware: mask phim hợp lệ theo độ tuổi, áp dụng ngay trong bước ranking
+        # Lưu ý: Dataset TMDB không có nhãn kiểm duyệt chính thức, nên dùng genre làm proxy để lọc an toàn nội dung.
+        with span('filtering'):
+            eligible = self.masks.get(age)
+
+        selected = self.movies_data['title'].values[positions].tolist()
+        with span('scoring'):
+            if mode == 'content':
+                result = get_recommendations(
+                    selected[0], self.model['neighbors'], self.indices, self.movies_data, top_n=top_n,
+                    eligible=eligible, tfidf_matrix=self.model.get('tfidf_matrix'))
+            elif mode == 'personalized':
+                result = get_personalized_recommendations(
+                    selected, cosine_sim, self.indices, self.movies_data, top_n=top_n,
+                    tfidf_matrix=vectors, ann_index=ann_index, n_probe=n_probe,
+                    eligible=eligible, score_cache=self.score_cache, seed_weights=seed_weights)
+            else:
+                content_w, personalized_w, popularity_w = weights
+                result = get_hybrid_recommendations(
+                    selected, cosine_sim, self.indices, self.movies_data, top_n=top_n,
+                    content_weight=content_w, personalized_weight=personalized_w,
+                    popularity_weight=popularity_w, tfidf_matrix=vectors,
+                    ann_index=ann_index, n_probe=n_probe, eligible=eligible, popularity=self.popularity,
+                    score_cache=self.score_cache,
+                    neighbors=self.model['neighbors'] if two_stage else None,
+                    head=self.popularity_head if two_stage else None, seed_weights=seed_weights)
+
+        if result is not None:
+            self.result_cache.put(cache_key, result)
+        return result, False
+
+    def batch(self, queries, mode='hybrid', top_n=10, block_size=None, fuzzy=False, backend=DEFAULT_BACKEND,
+              n_probe=DEFAULT_N_PROBE):
+        """
+        Nhiều truy vấn một lần (định dạng như file truy vấn của batch_recommend.py), cùng ANN index và
+        n_probe như recommend nên cho cùng kết quả
+        Returns:
+            (results, n_missing): DataFrame kết quả dạng dài và số truy vấn không có title hợp lệ
+        """
+        return recommend_batch(queries, self.model, self.masks, mode=mode, top_n=top_n, block_size=block_size,
+                               title_index=self.title_index, fuzzy=fuzzy, backend=backend, n_probe=n_probe)
@@ -0,0 +1,206 @@
+"""
+Tính similarity khi train: song song theo block dòng, ghi kết quả ra đĩa ngay khi mỗi block xong
+- Ma trận TF-IDF (đã chuẩn hóa) được chia thành các block dòng, mỗi block chạy trên một worker process
+  (fork: worker dùng chung ma trận với process cha, không phải copy / pickle)
+- Mỗi block chỉ giữ top-K hàng xóm của từng dòng; process cha ghi ngay vào các mảng .npy memory-map
+- Chế độ dense: block cosine (đã ép precision hoặc lượng tử hóa int8 theo dòng) được worker ghi thẳng
+  vào file .npy, ma trận N×N không bao giờ nằm trọn trong bộ nhớ
+- patch_similarity (update_model.py): vá dòng / cột của các phim thay đổi trong ma trận dense cũ,
+  cũng ghi theo block dòng vào file .npy
+
+Bộ nhớ đỉnh ~ n_jobs × block_size × N × 4 byte (block điểm của các worker) + top-K của mọi phim;
+thời gian tính giảm gần tuyến tính theo số core.
+"""
+
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from numpy.lib.format import open_memmap
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from features import _resolve_jobs
+from precision import DEFAULT_PRECISION, QuantizedRows, quantize_rows
+from recommender import MAX_BLOCK_ELEMENTS, _to_csr, _topk_rows
+
+# Catalog từ kích thước này mặc định chạy song song trên mọi CPU
+PARALLEL_MIN_MOVIES = 20000
+
+# Trạng thái của worker: ma trận TF-IDF, số hàng xóm và các file dense (đặt bởi _init_worker)
+_worker = {}
+
+
+def _init_worker(X, XT, k, dense_paths):
+    _worker['X'] = X
+    _worker['XT'] = XT
+    _worker['k'] = k
+    # Mỗi worker tự mở file dense (r+) để ghi block của mình, không gửi block N cột về process cha
+    _worker['dense'] = {name: np.load(path, mmap_mode='r+') for name, path in dense_paths.items()}
+
+
+def _score_block(start, end):
+    """
+    Tính một block dòng [start, end): ghi block cosine dày (nếu có) và trả về top-K của từng dòng
+    Returns:
+        (start, top_idx, top_scores)
+    """
+    rows = np.arange(start, end)
+    block = (_worker['X'][start:end] @ _worker['XT']).toarray()
+    dense = _worker['dense']
+    if 'values' in dense:
+        quantized = quantize_rows(block, self_columns=rows)
+        dense['values'][start:end] = quantized.values
+        dense['scales'][start:end] = quantized.scales
+    elif 'cosine_sim' in dense:
+        dense['cosine_sim'][start:end] = block
+    top_idx, top_scores = _topk_rows(block, rows, _worker['k'])
+    return start, top_idx, top_scores
+
+
+def _pool(n_jobs, initargs):
+    # fork khi hệ điều hành hỗ trợ: worker kế thừa ma trận TF-IDF thay vì nhận bản pickle
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    return ProcessPoolExecutor(max_workers=n_jobs, mp_context=context, initializer=_init_worker,
+                               initargs=initargs)
+
+
+def build_similarity(tfidf_matrix, top_k=50, n_jobs=None, block_size=None, work_dir=None, dense_precision=None):
+    """
+    Top-K neighbor index (và ma trận cosine dày nếu cần) tính song song theo block dòng
+    Args:
+        tfidf_matrix: ma trận TF-IDF (N × V)
+        top_k: số hàng xóm giữ lại cho mỗi phim
+        n_jobs: số worker process (None: mọi CPU khi N >= PARALLEL_MIN_MOVIES, 1 = tuần tự)
+        block_size: số dòng mỗi block (mặc định tự chọn theo MAX_BLOCK_ELEMENTS)
+        work_dir: thư mục chứa các mảng kết quả memory-map (mặc định thư mục tạm của hệ thống);
+            cosine_sim trả về đọc trực tiếp từ đây nên thư mục phải còn đến khi lưu model xong
+        dense_precision: None = chỉ dựng neighbor index; một trong PRECISIONS = ghi thêm cosine_sim N×N
+    Returns:
+        (neighbors, cosine_sim): CSR (N × N) giống build_topk_neighbors, và ndarray / QuantizedRows
+        memory-mapped (None nếu không có dense_precision)
+    """
+    # float64 chỉ khi cần lưu cosine_sim float64, còn lại tính bằng float32 như build_topk_neighbors
+    dtype = np.float64 if dense_precision == 'float64' else np.float32
+    X = normalize(sparse.csr_matrix(tfidf_matrix, dtype=dtype))
+    XT = X.T.tocsc()
+    n = X.shape[0]
+    k = max(1, min(top_k, n - 1))
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // max(n, 1))
+    n_jobs = _resolve_jobs(n_jobs, n >= PARALLEL_MIN_MOVIES)
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix='tmdb_similarity_')
+
+    def memmap(name, shape, dtype):
+        path = os.path.join(work_dir, f'{name}.npy')
+        open_memmap(path, mode='w+', dtype=dtype, shape=shape).flush()
+        return path
+
+    dense_paths = {}
+    if dense_precision == 'int8':
+        dense_paths['values'] = memmap('cosine_sim.values', (n, n), np.int8)
+        dense_paths['scales'] = memmap('cosine_sim.scales', (n,), np.float32)
+    elif dense_precision is not None:
+        dense_paths['cosine_sim'] = memmap('cosine_sim', (n, n), dense_precision)
+
+    # Top-K của mọi phim được ghi vào file ngay khi block tương ứng xong
+    all_idx = open_memmap(memmap('neighbors_idx', (n, k), np.int32), mode='r+')
+    all_scores = open_memmap(memmap('neighbors_scores', (n, k), np.float32), mode='r+')
+
+    def store(result):
+        start, top_idx, top_scores = result
+        all_idx[start:start + top_idx.shape[0]] = top_idx
+        all_scores[start:start + top_idx.shape[0]] = top_scores
+
+    blocks = [(start, min(start + block_size, n)) for start in range(0, n, block_size)]
+    if n_jobs <= 1:
+        _init_worker(X, XT, k, dense_paths)
+        try:
+            for start, end in blocks:
+                store(_score_block(start, end))
+        finally:
+            _worker.clear()
+    else:
+        with _pool(n_jobs, (X, XT, k, dense_paths)) as pool:
+            pending = []
+            for start, end in blocks:
+                pending.append(pool.submit(_score_block, start, end))
+                # Giới hạn số block đang chờ để kết quả chưa ghi không chiếm bộ nhớ
+                if len(pending) > 2 * n_jobs:
+                    store(pending.pop(0).result())
+            for future in pending:
+                store(future.result())
+
+    neighbors = _to_csr(all_idx, all_scores, n)
+    del all_idx, all_scores
+
+    cosine_sim = None
+    if dense_precision == 'int8':
+        cosine_sim = QuantizedRows(np.load(dense_paths['values'], mmap_mode='r'),
+                                   np.load(dense_paths['scales'], mmap_mode='r'))
+    elif dense_precision is not None:
+        cosine_sim = np.load(dense_paths['cosine_sim'], mmap_mode='r')
+    return neighbors, cosine_sim
+
+
+def patch_similarity(cosine_sim, tfidf_matrix, affected, work_dir, precision=DEFAULT_PRECISION, block_size=None):
+    """
+    Ma trận cosine dày của catalog sau khi cập nhật tăng dần: dòng / cột của các phim bị ảnh hưởng
+    tính lại từ tfidf_matrix, phần còn lại chép từ ma trận cũ; ghi theo block dòng vào file memory-map
+    nên không có bản N×N nào nằm trong bộ nhớ
+    Args:
+        cosine_sim: ma trận cũ (n_old × n_old, ndarray / QuantizedRows, thường là memory-map của model)
+        tfidf_matrix: TF-IDF của catalog mới (N × V, N >= n_old, dòng i < n_old vẫn là phim i cũ)
+        affected: vị trí các phim thay đổi / mới (phải gồm mọi phim mới)
+        work_dir: thư mục chứa file kết quả, phải còn đến khi lưu model xong
+        precision: một trong PRECISIONS (int8 được lượng tử hóa lại theo dòng)
+    Returns:
+        ndarray / QuantizedRows memory-mapped (N × N)
+    """
+    X = normalize(sparse.csr_matrix(tfidf_matrix, dtype=np.float32))
+    n, n_old = X.shape[0], cosine_sim.shape[0]
+    affected = np.unique(np.asarray(affected, dtype=np.int64))
+    is_affected = np.zeros(n, dtype=bool)
+    is_affected[affected] = True
+    XT = X.T.tocsc()
+    affected_T = X[affected].T.tocsc()
+    if block_size is None:
+        block_size = max(1, MAX_BLOCK_ELEMENTS // max(n, 1))
+
+    paths = {}
+    if precision == 'int8':
+        paths['values'] = os.path.join(work_dir, 'cosine_sim.values.npy')
+        paths['scales'] = os.path.join(work_dir, 'cosine_sim.scales.npy')
+        values = open_memmap(paths['values'], mode='w+', dtype=np.int8, shape=(n, n))
+        scales = open_memmap(paths['scales'], mode='w+', dtype=np.float32, shape=(n,))
+    else:
+        paths['cosine_sim'] = os.path.join(work_dir, 'cosine_sim.npy')
+        dense = open_memmap(paths['cosine_sim'], mode='w+', dtype=precision, shape=(n, n))
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = np.zeros((end - start, n), dtype=np.float32)
+        if start < n_old:
+            block[:min(end, n_old) - start, :n_old] = cosine_sim[start:min(end, n_old)]
+        block[:, affected] = (X[start:end] @ affected_T).toarray()
+        rows = np.flatnonzero(is_affected[start:end])
+        if rows.shape[0]:
+            block[rows] = (X[start + rows] @ XT).toarray()
+        if precision == 'int8':
+            quantized = quantize_rows(block, self_columns=np.arange(start, end))
+            values[start:end] = quantized.values
+            scales[start:end] = quantized.scales
+        else:
+            dense[start:end] = block
+
+    if precision == 'int8':
+        values.flush()
+        scales.flush()
+        del values, scales
+        return QuantizedRows(np.load(paths['values'], mmap_mode='r'), np.load(paths['scales'], mmap_mode='r'))
+    dense.flush()
+    del dense
+    return np.load(paths['cosine_sim'], mmap_mode='r')
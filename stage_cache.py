@@ -0,0 +1,99 @@
+"""
+Cache kết quả từng bước train trên đĩa, khóa theo hash nội dung của đầu vào + tham số
+- Khóa của một bước gồm: hash nội dung các file dữ liệu, khóa của các bước trước nó,
+  tham số của bước và hash mã nguồn các module bước đó dùng
+- Kết quả lưu thành thư mục .parquet / .npy cùng định dạng với model (model_store.write_components),
+  đọc lại bằng LazyModel (memory-map)
+- Chỉ các bước có đầu vào thay đổi mới chạy lại: đổi max_features / ngram_range chỉ chạy lại TF-IDF
+  và similarity, phần đọc CSV + trích xuất JSON lấy từ cache
+
+.train_cache/
+    credits-3f2a9c0d1e.../      -> manifest.json + credit_features.parquet
+    movies-91bd07aa42.../       -> movies_data.parquet, genre_bits.npy, combined_features.parquet...
+    tfidf-.../  similarity-.../
+"""
+
+import hashlib
+import importlib
+import json
+import os
+import shutil
+
+from model_store import LazyModel, write_components
+
+DEFAULT_CACHE_DIR = '.train_cache'
+HASH_BLOCK_BYTES = 1 << 20
+# Số kết quả gần nhất giữ lại cho mỗi bước (quay lại tham số cũ vẫn trúng cache)
+KEEP_PER_STAGE = 3
+
+
+def file_digest(path):
+    """SHA-256 nội dung file (đọc theo block, không load cả file vào bộ nhớ)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_digest(*module_names):
+    """Hash mã nguồn các module: sửa code của một bước cũng làm cache của bước đó hết hạn"""
+    return {name: file_digest(importlib.import_module(name).__file__) for name in module_names}
+
+
+class StageCache:
+    """
+    Ví dụ:
+        cache = StageCache()
+        credits, credits_key, hit = cache.run('credits', lambda stage_dir: {'credit_features': ...},
+                                              data=file_digest('tmdb_5000_credits.csv'))
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, rebuild=False, keep=KEEP_PER_STAGE):
+        self.cache_dir = cache_dir
+        self.rebuild = rebuild
+        self.keep = keep
+
+    def key(self, name, **inputs):
+        """Khóa của bước name: hash các đầu vào (giá trị JSON được: str, số, list, dict)"""
+        payload = json.dumps({'stage': name, **inputs}, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:24]
+
+    def run(self, name, compute, **inputs):
+        """
+        Lấy kết quả của bước name từ cache, hoặc chạy compute rồi ghi vào cache
+        Args:
+            compute: hàm compute(stage_dir) -> dict thành phần (DataFrame, sparse, ndarray, str/số);
+                file compute tự ghi vào stage_dir (ví dụ Parquet tạm) cũng thuộc về kết quả
+            inputs: đầu vào của bước (hash file, khóa bước trước, tham số, source_digest...)
+        Returns:
+            (outputs, key, hit): LazyModel của kết quả (outputs.version_dir = thư mục kết quả),
+            khóa để đưa vào bước sau, và bước có được lấy từ cache không
+        """
+        key = self.key(name, **inputs)
+        stage_dir = os.path.join(self.cache_dir, f'{name}-{key}')
+        if os.path.exists(os.path.join(stage_dir, 'manifest.json')) and not self.rebuild:
+            os.utime(stage_dir)  # Đánh dấu vừa dùng để không bị xóa khi dọn cache
+            return LazyModel(stage_dir), key, True
+
+        tmp_dir = f'{stage_dir}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            outputs = compute(tmp_dir)
+            write_components(tmp_dir, outputs, key, stage=name, inputs=inputs)
+            shutil.rmtree(stage_dir, ignore_errors=True)
+            os.replace(tmp_dir, stage_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        self._prune(name)
+        return LazyModel(stage_dir), key, False
+
+    def _prune(self, name):
+        """Chỉ giữ keep kết quả dùng gần nhất của bước name"""
+        stage_dirs = [os.path.join(self.cache_dir, d) for d in os.listdir(self.cache_dir)
+                      if d.startswith(f'{name}-') and '.tmp-' not in d]
+        stage_dirs.sort(key=os.path.getmtime, reverse=True)
+        for old in stage_dirs[self.keep:]:
+            shutil.rmtree(old, ignore_errors=True)
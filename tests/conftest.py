@@ -0,0 +1,52 @@
+"""
+Fixture dùng chung: catalog giả lập nhỏ (benchmark.synthetic_catalog) và model dựng từ catalog đó
+Chạy: python -m pytest -q tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import synthetic_catalog  # noqa: E402
+from features import add_features, fill_missing, make_vectorizer, scale_numeric  # noqa: E402
+from recommender import build_genre_bits, build_topk_neighbors, popularity_head, popularity_prior  # noqa: E402
+from title_index import build_title_index  # noqa: E402
+
+N_MOVIES = 300
+
+
+@pytest.fixture(scope='session')
+def catalog():
+    """Catalog giả lập đã tạo features (in-memory, như add_features của notebook)"""
+    return add_features(scale_numeric(fill_missing(synthetic_catalog(N_MOVIES, seed=7)))).reset_index(drop=True)
+
+
+@pytest.fixture(scope='session')
+def tfidf_matrix(catalog):
+    return make_vectorizer().fit_transform(catalog['combined_features']).astype(np.float32)
+
+
+@pytest.fixture(scope='session')
+def model_data(catalog, tfidf_matrix):
+    """Các thành phần model như train_model.py lưu (chế độ topk)"""
+    genre_bits, genre_names = build_genre_bits(catalog['genres_list'])
+    prior = popularity_prior(catalog)
+    data = {
+        'movies_data': catalog[['id', 'title', 'genres_clean', 'vote_average', 'vote_count', 'popularity',
+                                'vote_avg_scaled', 'popularity_scaled', 'vote_count_scaled']],
+        'neighbors': build_topk_neighbors(tfidf_matrix, top_k=20),
+        'tfidf_matrix': tfidf_matrix,
+        'genre_bits': genre_bits,
+        'genre_names': genre_names,
+        'popularity_prior': prior,
+        'popularity_head': popularity_head(prior, size=50),
+        'model_type': 'hybrid',
+        'similarity_mode': 'topk',
+        'precision': 'float32',
+    }
+    data.update(build_title_index(catalog['title']))
+    return data
@@ -0,0 +1,56 @@
+"""Đọc movies.csv theo chunk và TF-IDF hai lượt (ingest.py) so với bản trong bộ nhớ (TfidfVectorizer)"""
+
+import numpy as np
+import pytest
+
+from benchmark import synthetic_catalog, write_catalog_csv
+from features import TFIDF_PARAMS, add_features, fill_missing, make_vectorizer, read_credit_features
+from ingest import fit_tfidf_chunks, ingest_movies, iter_text_chunks
+
+
+def _chunks(texts, sizes):
+    """Chia texts thành các chunk có kích thước lần lượt theo sizes (lặp lại)"""
+    def generate():
+        start, i = 0, 0
+        while start < len(texts):
+            size = sizes[i % len(sizes)]
+            yield texts[start:start + size]
+            start, i = start + size, i + 1
+    return generate
+
+
+def _assert_same_tfidf(result, texts, params):
+    tfidf_matrix, vocabulary, idf, _ = result
+    reference = make_vectorizer(params)
+    expected = reference.fit_transform(texts)
+    assert vocabulary.tolist() == reference.get_feature_names_out().tolist()
+    np.testing.assert_allclose(idf, reference.idf_, rtol=1e-12)
+    assert tfidf_matrix.shape == expected.shape
+    np.testing.assert_allclose(tfidf_matrix.toarray(), expected.toarray(), atol=1e-12)
+
+
+@pytest.mark.parametrize('params', [
+    TFIDF_PARAMS,
+    # Ít term hơn số term của corpus: chọn max_features term có tf lớn nhất, hòa thì như CountVectorizer
+    {**TFIDF_PARAMS, 'max_features': 300},
+    {**TFIDF_PARAMS, 'max_features': None, 'ngram_range': (1, 1)},
+])
+def test_two_pass_tfidf_matches_one_shot_vectorizer(catalog, params):
+    texts = catalog['combined_features'].tolist()
+    _assert_same_tfidf(fit_tfidf_chunks(_chunks(texts, [7, 120, 1, 64]), params), texts, params)
+
+
+def test_streaming_ingest_matches_in_memory_features(tmp_path):
+    movies = synthetic_catalog(400, seed=3)
+    movies_path, credits_path = write_catalog_csv(movies, str(tmp_path))
+    spill_path = str(tmp_path / 'combined_features.parquet')
+
+    ingested = ingest_movies(movies_path, read_credit_features(credits_path, chunk_rows=90), spill_path,
+                             chunk_rows=150)
+    in_memory = add_features(fill_missing(movies)).reset_index(drop=True)
+    assert ingested['id'].tolist() == in_memory['id'].tolist()
+    texts = [text for chunk in iter_text_chunks(spill_path, chunk_rows=150) for text in chunk]
+    assert texts == in_memory['combined_features'].tolist()
+
+    result = fit_tfidf_chunks(lambda: iter_text_chunks(spill_path, chunk_rows=150))
+    _assert_same_tfidf(result, in_memory['combined_features'].tolist(), TFIDF_PARAMS)
@@ -0,0 +1,111 @@
+"""Lưu / mở model theo thư mục version (model_store.py) và phục vụ model đã bị xóa khỏi đĩa (service.py)"""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from model_store import CURRENT_FILE, LazyModel, open_model, save_model, stored_model_version
+from precision import QuantizedRows, quantize_rows
+from recommender import build_topk_neighbors, neighbors_from_dense
+from service import RecommenderService
+
+
+def _assert_same(name, expected, actual):
+    if isinstance(expected, pd.DataFrame):
+        pd.testing.assert_frame_equal(expected.reset_index(drop=True), actual, check_dtype=False)
+    elif sparse.issparse(expected):
+        assert sparse.issparse(actual) and actual.shape == expected.shape, name
+        assert actual.dtype == expected.dtype, name
+        np.testing.assert_array_equal(actual.indptr, expected.indptr)
+        np.testing.assert_array_equal(actual.indices, expected.indices)
+        np.testing.assert_array_equal(actual.data, expected.data)
+    elif isinstance(expected, QuantizedRows):
+        assert isinstance(actual, QuantizedRows), name
+        np.testing.assert_array_equal(actual.values, expected.values)
+        np.testing.assert_array_equal(actual.scales, expected.scales)
+    elif isinstance(expected, np.ndarray):
+        assert actual.dtype == expected.dtype, name
+        np.testing.assert_array_equal(actual, expected)
+    else:
+        assert actual == expected, name
+
+
+def _dense_cosine(tfidf_matrix):
+    return np.asarray((tfidf_matrix @ tfidf_matrix.T).todense(), dtype=np.float32)
+
+
+def _is_mapped(array):
+    """Mảng (hoặc view của mảng) đọc từ file .npy bằng memory-map"""
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = getattr(array, 'base', None)
+    return False
+
+
+def test_round_trip_every_component(tmp_path, model_data, tfidf_matrix):
+    dense = _dense_cosine(tfidf_matrix)
+    data = {**model_data, 'cosine_sim': quantize_rows(dense, self_columns=np.arange(dense.shape[0]))}
+    version_dir = save_model(data, model_dir=str(tmp_path))
+
+    model = open_model(str(tmp_path), legacy_file=str(tmp_path / 'missing.pkl'))
+    assert isinstance(model, LazyModel)
+    assert model.version == os.path.basename(version_dir) == stored_model_version(str(tmp_path))
+    assert model.loaded_components == []
+    assert set(model) == set(data) | {'indices'}
+    for name, expected in data.items():
+        _assert_same(name, expected, model[name])
+
+    # Các mảng được memory-map, không đọc hết vào bộ nhớ
+    assert _is_mapped(model['popularity_prior'])
+    assert _is_mapped(model['neighbors'].data) and _is_mapped(model['tfidf_matrix'].indices)
+    assert _is_mapped(model['cosine_sim'].values)
+    titles = data['movies_data']['title']
+    assert model['indices'][titles.iloc[5]] == 5
+    assert len(model['indices']) == len(titles)
+
+
+def test_prune_keeps_open_service_serving(tmp_path, model_data, tfidf_matrix):
+    model_dir, legacy_file = str(tmp_path), str(tmp_path / 'missing.pkl')
+    # Model dense: Personalized / Hybrid đọc cosine_sim, thành phần chỉ được mở khi có mode cần đến
+    data = {**model_data, 'cosine_sim': _dense_cosine(tfidf_matrix)}
+    first_dir = save_model(data, model_dir=model_dir)
+    titles = model_data['movies_data']['title'].iloc[[3, 8, 21]].tolist()
+    reference = RecommenderService(model_dir, legacy_file)
+    expected = {mode: reference.recommend(mode, titles, age='T13')[0]
+                for mode in ('content', 'personalized', 'hybrid')}
+    del reference
+
+    # Service chỉ được làm nóng (như ModelReloader), chưa chạy truy vấn nào trước khi version bị xóa
+    service = RecommenderService(model_dir, legacy_file)
+    service.warm()
+    for _ in range(2):
+        save_model(data, model_dir=model_dir, keep=2)
+    assert not os.path.exists(first_dir)
+    assert len([d for d in os.listdir(model_dir) if d != CURRENT_FILE]) == 2
+    assert service.is_stale()
+
+    # Thư mục version đã bị xóa nhưng các file đã được mở (warm) nên vẫn đọc được
+    for mode, result in expected.items():
+        pd.testing.assert_frame_equal(service.recommend(mode, titles, age='T13')[0], result)
+
+
+def test_legacy_pickle_builds_neighbors_from_dense(tmp_path, model_data, tfidf_matrix):
+    dense = _dense_cosine(tfidf_matrix)
+    legacy = {'movies_data': model_data['movies_data'], 'cosine_sim': dense, 'tfidf_matrix': tfidf_matrix}
+    legacy_file = tmp_path / 'movie_recommender_model.pkl'
+    with open(legacy_file, 'wb') as f:
+        pickle.dump(legacy, f)
+
+    model = open_model(str(tmp_path / 'no_model_dir'), legacy_file=str(legacy_file))
+    assert model['version'] == stored_model_version(str(tmp_path / 'no_model_dir'), str(legacy_file))
+    assert model['version'].startswith('legacy-')
+    expected = neighbors_from_dense(dense)
+    _assert_same('neighbors', expected, model['neighbors'])
+    # Cùng hàng xóm với neighbor index tính thẳng từ TF-IDF
+    direct = build_topk_neighbors(tfidf_matrix)
+    np.testing.assert_array_equal(model['neighbors'].indptr, direct.indptr)
+    np.testing.assert_allclose(model['neighbors'].data, direct.data, atol=1e-5)
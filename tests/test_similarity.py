@@ -0,0 +1,57 @@
+"""Vá ma trận cosine dày sau khi cập nhật tăng dần (similarity.patch_similarity, update_model.py)"""
+
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from precision import QuantizedRows, quantize_rows
+from similarity import patch_similarity
+
+
+def _cosine(tfidf_matrix):
+    X = normalize(sparse.csr_matrix(tfidf_matrix, dtype=np.float32))
+    return np.asarray((X @ X.T).todense(), dtype=np.float32)
+
+
+@pytest.fixture(scope='module')
+def update(tfidf_matrix):
+    """Catalog cũ 250 phim; bản mới thay nội dung 3 phim cũ và thêm 50 phim (dòng 250-299)"""
+    n_old = 250
+    old = tfidf_matrix[:n_old]
+    changed = np.array([0, 17, 249])
+    new = sparse.lil_matrix(tfidf_matrix)
+    new[changed] = tfidf_matrix[[260, 270, 280]]
+    new = new.tocsr()
+    affected = np.concatenate([changed, np.arange(n_old, tfidf_matrix.shape[0])])
+    return old, new, affected
+
+
+@pytest.mark.parametrize('block_size', [None, 7])
+def test_patch_float32_matches_full_recompute(tmp_path, update, block_size):
+    old, new, affected = update
+    patched = patch_similarity(_cosine(old), new, affected, str(tmp_path), precision='float32', block_size=block_size)
+    assert isinstance(patched, np.memmap) and patched.dtype == np.float32
+    np.testing.assert_allclose(patched, _cosine(new), atol=1e-6)
+
+
+@pytest.mark.parametrize('block_size', [None, 7])
+def test_patch_int8_requantizes_copied_and_recomputed_cells(tmp_path, update, block_size):
+    old, new, affected = update
+    n_old, full = old.shape[0], _cosine(new)
+    old_quantized = quantize_rows(_cosine(old), self_columns=np.arange(n_old))
+    patched = patch_similarity(old_quantized, new, affected, str(tmp_path), precision='int8', block_size=block_size)
+    assert isinstance(patched, QuantizedRows) and patched.shape == full.shape
+
+    # Ô của hai phim không đổi: chép từ ma trận int8 cũ; dòng / cột của phim thay đổi: tính lại
+    expected = full.copy()
+    kept = np.setdiff1d(np.arange(n_old), affected)
+    expected[np.ix_(kept, kept)] = old_quantized[kept][:, kept]
+    expected = quantize_rows(expected, self_columns=np.arange(full.shape[0]))
+    np.testing.assert_array_equal(patched.values, expected.values)
+    np.testing.assert_allclose(patched.scales, expected.scales, rtol=1e-6)
+
+    # Sai số so với tính lại toàn bộ chỉ là sai số lượng tử hóa (ngoài đường chéo)
+    off_diagonal = ~np.eye(full.shape[0], dtype=bool)
+    error = np.abs(patched[:] - full)[off_diagonal].reshape(full.shape[0], -1)
+    assert (error <= 2 * np.asarray(patched.scales)[:, None] + 1e-6).all()
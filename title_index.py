@@ -0,0 +1,197 @@
+"""
+Index tên phim dựng sẵn khi train, lưu cùng model
+
+- title_order: vị trí phim theo thứ tự tên đã sắp xếp (app không phải sort lại catalog mỗi lần rerun)
+- title_keys: tên đã chuẩn hóa (chữ thường, bỏ dấu / ký tự đặc biệt) đã sắp xếp + vị trí phim
+  -> tra cứu chính xác và tìm theo tiền tố bằng tìm kiếm nhị phân
+- title_trigrams: inverted index trigram (hash vào N_BUCKETS, lưu dạng CSR N_BUCKETS × N giống IVF lists)
+  + số trigram mỗi tên -> tìm gần đúng (gõ sai chính tả) theo độ tương đồng Jaccard
+
+Truy vấn chỉ đọc danh sách phim của các trigram trong câu truy vấn nên không phụ thuộc kích thước catalog.
+"""
+
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+N_BUCKETS = 1 << 18
+MIN_FUZZY_SCORE = 0.3
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_title(title):
+    """Khóa chuẩn hóa: bỏ dấu, chữ thường, mọi ký tự không phải chữ / số thành một khoảng trắng"""
+    text = unicodedata.normalize('NFKD', str(title))
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+    return _NON_ALNUM.sub(' ', text).strip()
+
+
+def title_trigrams(key):
+    """Bucket của các trigram trong khóa (đệm 2 khoảng trắng đầu để ưu tiên khớp phần đầu tên)"""
+    padded = f"  {key} "
+    return np.unique(np.array([zlib.crc32(padded[i:i + 3].encode()) % N_BUCKETS
+                               for i in range(len(padded) - 2)], dtype=np.int64))
+
+
+def build_title_index(titles):
+    """
+    Dựng các thành phần của title index để lưu cùng model
+    Args:
+        titles: tên phim theo vị trí trong movies_data
+    Returns:
+        dict title_order, title_keys, title_trigrams, title_trigram_counts
+    """
+    titles = np.asarray(titles, dtype=object)
+    n = len(titles)
+    keys = np.array([normalize_title(title) for title in titles], dtype=object)
+
+    key_order = np.argsort(keys, kind='stable')
+    buckets = [title_trigrams(key) for key in keys]
+    counts = np.array([len(b) for b in buckets], dtype=np.int32)
+    # Ma trận phim × bucket rồi chuyển vị thành danh sách phim của từng bucket
+    by_title = sparse.csr_matrix(
+        (np.ones(counts.sum(), dtype=np.float32),
+         np.concatenate(buckets) if n else np.empty(0, dtype=np.int64),
+         np.concatenate([[0], np.cumsum(counts)])),
+        shape=(n, N_BUCKETS))
+    postings = by_title.T.tocsr()
+    postings.indices = postings.indices.astype(np.int32)
+    postings.indptr = postings.indptr.astype(np.int32)
+
+    return {
+        'title_order': np.argsort(titles, kind='stable').astype(np.int32),
+        'title_keys': pd.DataFrame({'key': keys[key_order], 'position': key_order.astype(np.int32)}),
+        'title_trigrams': postings,
+        'title_trigram_counts': counts,
+    }
+
+
+class TitleIndex:
+    """Tra cứu tên phim: chính xác, theo tiền tố và gần đúng"""
+
+    def __init__(self, titles, title_order, title_keys, title_trigrams, title_trigram_counts):
+        self.titles = np.asarray(titles, dtype=object)
+        self.order = np.asarray(title_order)
+        self.keys = np.asarray(title_keys['key'].values, dtype=object)
+        self.key_positions = np.asarray(title_keys['position'].values)
+        self.trigrams = title_trigrams
+        self.trigram_counts = np.asarray(title_trigram_counts)
+        self._sorted_titles = None
+
+    @classmethod
+    def from_model(cls, data):
+        """Title index của model (model cũ chưa lưu index thì dựng một lần từ movies_data)"""
+        titles = data['movies_data']['title'].values
+        if 'title_keys' in data:
+            parts = {name: data[name] for name in
+                     ('title_order', 'title_keys', 'title_trigrams', 'title_trigram_counts')}
+        else:
+            parts = build_title_index(titles)
+        return cls(titles, **parts)
+
+    @property
+    def sorted_titles(self):
+        """Danh sách tên phim đã sắp xếp (tạo một lần, dùng chung cho mọi lần rerun)"""
+        if self._sorted_titles is None:
+            self._sorted_titles = self.titles[self.order].tolist()
+        return self._sorted_titles
+
+    def _key_range(self, key, prefix=False):
+        start = np.searchsorted(self.keys, key, side='left')
+        end = np.searchsorted(self.keys, key + '\U0010ffff' if prefix else key, side='right')
+        return start, end
+
+    def lookup(self, title):
+        """
+        Vị trí phim theo tên, không phân biệt hoa thường / dấu / ký tự đặc biệt
+        Returns:
+            int, hoặc None nếu không có
+        """
+        start, end = self._key_range(normalize_title(title))
+        if start == end:
+            return None
+        positions = self.key_positions[start:end]
+        # Nhiều phim cùng khóa chuẩn hóa: ưu tiên phim trùng tên gốc
+        exact = positions[self.titles[positions] == title]
+        return int(exact[0] if len(exact) else positions[0])
+
+    def prefix_search(self, query, limit=20):
+        """Vị trí các phim có tên (đã chuẩn hóa) bắt đầu bằng query, theo thứ tự tên"""
+        key = normalize_title(query)
+        if not key:
+            return np.empty(0, dtype=np.int64)
+        start, end = self._key_range(key, prefix=True)
+        return self.key_positions[start:min(end, start + limit)]
+
+    def fuzzy_search(self, query, limit=20, min_score=MIN_FUZZY_SCORE):
+        """
+        Tìm gần đúng theo trigram (chịu được gõ sai / thiếu chữ)
+        Returns:
+            (positions, scores): sắp xếp theo độ tương đồng Jaccard giảm dần
+        """
+        key = normalize_title(query)
+        if not key:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        buckets = title_trigrams(key)
+        indptr, indices = self.trigrams.indptr, self.trigrams.indices
+        postings = np.concatenate([indices[indptr[b]:indptr[b + 1]] for b in buckets])
+        if len(postings) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if len(postings) * 8 > len(self.titles):
+            # Trigram rất phổ biến (ví dụ "the"): đếm trên cả catalog nhanh hơn sort
+            overlap = np.bincount(postings, minlength=len(self.titles))
+            positions = np.flatnonzero(overlap)
+            overlap = overlap[positions]
+        else:
+            positions, overlap = np.unique(postings, return_counts=True)
+        scores = (overlap / (len(buckets) + self.trigram_counts[positions] - overlap)).astype(np.float32)
+        keep = scores >= min_score
+        positions, scores = positions[keep], scores[keep]
+        top = np.lexsort((positions, -scores))[:limit]
+        return positions[top], scores[top]
+
+    def search(self, query, limit=20, min_score=MIN_FUZZY_SCORE):
+        """Tên phim khớp query: khớp tiền tố trước, sau đó đến các kết quả gần đúng"""
+        prefix = self.prefix_search(query, limit)
+        if len(prefix) >= limit:
+            return self.titles[prefix].tolist()
+        fuzzy, _ = self.fuzzy_search(query, limit, min_score)
+        positions = list(dict.fromkeys([*prefix.tolist(), *fuzzy.tolist()]))[:limit]
+        return self.titles[positions].tolist()
+
+    def locate(self, titles, fuzzy=False, min_score=MIN_FUZZY_SCORE):
+        """
+        Vị trí của từng title: khớp chính xác cả danh sách bằng một lần searchsorted
+        Args:
+            fuzzy: title không khớp chính xác thì lấy phim gần đúng nhất (nếu đủ min_score)
+        Returns:
+            mảng int64 cùng độ dài với titles, -1 với title không tìm thấy
+        """
+        titles = list(titles)
+        keys = np.array([normalize_title(title) for title in titles], dtype=object)
+        start = np.searchsorted(self.keys, keys, side='left')
+        end = np.searchsorted(self.keys, keys, side='right')
+        positions = np.where(start < end, self.key_positions[np.minimum(start, len(self.keys) - 1)], -1) \
+            if len(self.keys) else np.full(len(titles), -1)
+        positions = positions.astype(np.int64)
+        # Hiếm: nhiều phim cùng khóa chuẩn hóa (ưu tiên trùng tên gốc) hoặc cần tìm gần đúng
+        for i in np.flatnonzero((end - start > 1) | ((start == end) & fuzzy)):
+            position = self.lookup(titles[i])
+            if position is None:
+                matches, _ = self.fuzzy_search(titles[i], 1, min_score)
+                position = int(matches[0]) if len(matches) else -1
+            positions[i] = position
+        return positions
+
+    def resolve(self, titles, fuzzy=False, min_score=MIN_FUZZY_SCORE):
+        """
+        Vị trí của các title (bỏ qua title không tìm thấy)
+        Args:
+            fuzzy: title không khớp chính xác thì lấy phim gần đúng nhất (nếu đủ min_score)
+        """
+        positions = self.locate(titles, fuzzy, min_score)
+        return positions[positions >= 0].tolist()
@@ -1,146 +1,237 @@
 """
 Script tự động train model từ dữ liệu TMDB
 Chạy file này trước khi chạy Streamlit app
+
+Kết quả từng bước được cache trong .train_cache (khóa theo hash dữ liệu + tham số + code),
+chạy lại chỉ tính các bước có đầu vào thay đổi, ví dụ:
+    python train_model.py --max-features 10000   # chỉ chạy lại TF-IDF và similarity
+    python train_model.py --embedding-dim 128    # chỉ chạy thêm bước embedding
 """
 
 import pandas as pd
-import numpy as np
-import json
-import pickle
 import os
-from collections import Counter
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
+import argparse
+import tempfile
+
+from features import MODEL_COLUMNS, TFIDF_PARAMS, fill_missing, read_credit_features, scale_numeric
+from ingest import INGEST_CHUNK_ROWS, fit_tfidf_chunks, ingest_movies, iter_text_chunks
+from recommender import build_genre_bits, popularity_head, popularity_prior
+from ann_index import NEIGHBOR_N_PROBE, build_ann_neighbors, build_ivf_index
+from embedding import DEFAULT_EMBEDDING_DIM, build_embedding
+from model_store import MODEL_DIR, save_model
+from precision import DEFAULT_PRECISION, PRECISIONS, with_precision
+from similarity import build_similarity
+from stage_cache import DEFAULT_CACHE_DIR, StageCache, file_digest, source_digest
+from title_index import build_title_index
+
+# Tham số dòng lệnh
+parser = argparse.ArgumentParser(description="Train model gợi ý phim TMDB")
+parser.add_argument('--similarity', choices=['topk', 'dense', 'ann'], default='topk',
+                    help="topk: chỉ lưu K hàng xóm gần nhất mỗi phim (tuyến tính theo N); "
+                         "dense: lưu toàn bộ ma trận cosine N×N như bản cũ; "
+                         "ann: top-K xấp xỉ qua IVF index, không tính mọi cặp phim (catalog lớn)")
+parser.add_argument('--top-k', type=int, default=50,
+                    help="Số hàng xóm giữ lại cho mỗi phim ở chế độ topk")
+parser.add_argument('--ann', action='store_true',
+                    help="Tạo IVF index để Personalized/Hybrid truy vấn xấp xỉ (bật sẵn khi --similarity ann)")
+parser.add_argument('--ann-lists', type=int, default=0,
+                    help="Số cụm của IVF index (0 = tự chọn ~ sqrt(N))")
+parser.add_argument('--ann-probe', type=int, default=NEIGHBOR_N_PROBE,
+                    help="Số cụm được dò khi dựng neighbor index ở chế độ ann")
+parser.add_argument('--jobs', type=int, default=None,
+                    help="Số process trích xuất JSON / tính similarity song song "
+                         "(mặc định: tự chọn theo kích thước dữ liệu)")
+parser.add_argument('--chunk-rows', type=int, default=INGEST_CHUNK_ROWS,
+                    help="Số dòng movies.csv đọc / trích xuất / vector hóa mỗi lần (giới hạn bộ nhớ đỉnh)")
+parser.add_argument('--precision', choices=PRECISIONS, default=DEFAULT_PRECISION,
+                    help="Độ chính xác lưu cosine_sim / TF-IDF (int8: lượng tử hóa theo dòng, "
+                         "ma trận sparse tối thiểu float32); kiểm tra ảnh hưởng bằng precision.py")
+parser.add_argument('--embedding-dim', type=int, default=0,
+                    help=f"Tạo thêm embedding TruncatedSVD d chiều (64-256, gợi ý {DEFAULT_EMBEDDING_DIM}) làm backend "
+                         "chấm điểm Personalized/Hybrid nhanh khi phục vụ (0 = không tạo)")
+parser.add_argument('--output', default=MODEL_DIR,
+                    help="Thư mục lưu model (mỗi lần train tạo một version mới)")
+parser.add_argument('--max-features', type=int, default=TFIDF_PARAMS['max_features'],
+                    help="Số term tối đa của TF-IDF")
+parser.add_argument('--ngram-range', type=int, nargs=2, default=list(TFIDF_PARAMS['ngram_range']),
+                    metavar=('MIN_N', 'MAX_N'), help="n-gram của TF-IDF, ví dụ: --ngram-range 1 2")
+parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                    help="Thư mục cache kết quả từng bước train (khóa theo hash dữ liệu + tham số)")
+parser.add_argument('--rebuild', action='store_true',
+                    help="Bỏ qua cache, chạy lại mọi bước (kết quả mới vẫn được ghi vào cache)")
+args = parser.parse_args()
 
 print("=" * 60)
 print("🎬 TMDB MOVIE RECOMMENDER - TRAINING MODEL")
 print("=" * 60)
 
+# Mỗi bước chỉ chạy lại khi dữ liệu, tham số hoặc code của nó (hay của bước trước) thay đổi
+cache = StageCache(args.cache_dir, rebuild=args.rebuild)
+tfidf_params = {**TFIDF_PARAMS, 'max_features': args.max_features, 'ngram_range': args.ngram_range}
+# File tạm của bước similarity (ma trận dense memory-map), xóa sau khi lưu model
+work_dir = tempfile.TemporaryDirectory(prefix='tmdb_train_')
+
+
+def report_cache(stage, hit):
+    if hit:
+        print(f"✓ Dùng kết quả đã cache ({os.path.join(args.cache_dir, stage)})")
+
+
 # 1. Load dữ liệu
+def build_credits(stage_dir):
+    # Credits được đọc theo chunk, chỉ giữ lại cast/director đã trích xuất thay vì chuỗi JSON gốc
+    credit_features = read_credit_features('tmdb_5000_credits.csv', n_jobs=args.jobs)
+    print(f"✓ Đã load {len(credit_features)} records từ credits.csv")
+    return {'credit_features': credit_features}
+
+
 print("\n[1/6] Đang load dữ liệu...")
-movies = pd.read_csv('tmdb_5000_movies.csv')
-credits = pd.read_csv('tmdb_5000_credits.csv')
-print(f"✓ Đã load {len(movies)} phim từ movies.csv")
-print(f"✓ Đã load {len(credits)} records từ credits.csv")
-
-# 2. Merge và làm sạch dữ liệu
-print("\n[2/6] Đang xử lý và làm sạch dữ liệu...")
-credits_renamed = credits.rename(columns={'movie_id': 'id'})
-movies_merged = movies.merge(credits_renamed[['id', 'cast', 'crew']], on='id', how='left')
-
-# Loại bỏ duplicate
-before_dups = movies_merged.shape[0]
-movies_merged = movies_merged.drop_duplicates(subset=['title'])
-print(f"✓ Đã loại bỏ {before_dups - len(movies_merged)} phim trùng lặp")
-
-# Xử lý missing values
-text_cols = ['overview', 'tagline', 'cast', 'crew', 'keywords', 'genres']
-for col in text_cols:
-    if col in movies_merged.columns:
-        movies_merged[col] = movies_merged[col].fillna('')
-
-num_cols = ['vote_average', 'vote_count', 'popularity', 'runtime']
-for col in num_cols:
-    if col in movies_merged.columns:
-        movies_merged[col] = movies_merged[col].fillna(movies_merged[col].median())
-
-# Xử lý outliers
-low, high = movies_merged['vote_count'].quantile([0.01, 0.99])
-movies_merged['vote_count_clipped'] = movies_merged['vote_count'].clip(lower=low, upper=high)
-
-# Chuẩn hóa
-scaler = MinMaxScaler()
-movies_merged[['vote_avg_scaled', 'popularity_scaled', 'vote_count_scaled']] = scaler.fit_transform(
-    movies_merged[['vote_average', 'popularity', 'vote_count_clipped']]
-)
-print("✓ Đã xử lý missing values, outliers và chuẩn hóa dữ liệu")
-
-# 3. Feature Engineering
-print("\n[3/6] Đang tạo features...")
-
-def extract_genres(genres_str):
-    try:
-        genres_list = json.loads(genres_str)
-        return [g['name'] for g in genres_list]
-    except:
-        return []
-
-def extract_keywords(keywords_str):
-    try:
-        keywords_list = json.loads(keywords_str)
-        return ' '.join([k['name'] for k in keywords_list])
-    except:
-        return ''
-
-def extract_cast(cast_str):
-    try:
-        cast_list = json.loads(cast_str)
-        return ' '.join([c['name'].replace(' ', '') for c in cast_list[:5]])
-    except:
-        return ''
-
-def extract_director(crew_str):
-    try:
-        crew_list = json.loads(crew_str)
-        for person in crew_list:
-            if person.get('job') == 'Director':
-                return person['name'].replace(' ', '')
-        return ''
-    except:
-        return ''
-
-movies_merged['genres_list'] = movies_merged['genres'].apply(extract_genres)
-movies_merged['keywords_clean'] = movies_merged['keywords'].apply(extract_keywords)
-movies_merged['cast_clean'] = movies_merged['cast'].apply(extract_cast)
-movies_merged['director_clean'] = movies_merged['crew'].apply(extract_director)
-movies_merged['genres_clean'] = movies_merged['genres_list'].apply(lambda x: ' '.join([g.replace(' ', '') for g in x]))
-
-# Kết hợp features
-movies_merged['combined_features'] = (
-    movies_merged['overview'].fillna('') + ' ' +
-    movies_merged['genres_clean'] + ' ' +
-    movies_merged['keywords_clean'] + ' ' +
-    movies_merged['cast_clean'] + ' ' +
-    movies_merged['director_clean']
-)
-print("✓ Đã tạo combined features từ overview, genres, keywords, cast, director")
+credits, credits_key, hit = cache.run('credits', build_credits, data=file_digest('tmdb_5000_credits.csv'),
+                                      code=source_digest('features'))
+report_cache(f"credits-{credits_key}", hit)
+
+
+# 2 + 3. Đọc movies.csv theo chunk: join credits theo id, loại trùng, tạo features cho từng chunk
+def build_movies(stage_dir):
+    # combined_features được ghi ra Parquet trong thư mục cache, chỉ metadata của phim nằm trong bộ nhớ
+    movies_merged = ingest_movies('tmdb_5000_movies.csv', credits['credit_features'],
+                                  os.path.join(stage_dir, 'combined_features.parquet'),
+                                  chunk_rows=args.chunk_rows, n_jobs=args.jobs)
+    print(f"✓ Đã load {len(movies_merged)} phim (không trùng title) từ movies.csv")
+
+    # Xử lý missing values (median trên toàn bộ catalog), outliers và chuẩn hóa
+    movies_merged = fill_missing(movies_merged)
+    movies_merged = scale_numeric(movies_merged)
+    print("✓ Đã xử lý missing values, outliers và chuẩn hóa dữ liệu")
+
+    print("\n[3/6] Đang tạo features...")
+    # Bitset thể loại cho lọc độ tuổi ngay trong bước ranking (không cần regex lúc gợi ý)
+    genre_bits, genre_names = build_genre_bits(movies_merged['genres_list'])
+    print("✓ Đã tạo combined features từ overview, genres, keywords, cast, director")
+    return {
+        'movies_data': movies_merged[MODEL_COLUMNS],
+        'genre_bits': genre_bits,  # Bitset thể loại (uint64) + tên thể loại theo vị trí bit
+        'genre_names': genre_names,
+        'popularity_prior': popularity_prior(movies_merged),  # Điểm popularity của Hybrid (float32), tính sẵn
+        'popularity_head': popularity_head(popularity_prior(movies_merged)),  # Ứng viên phổ biến cho Hybrid 2 bước
+        # Title index: tên đã sắp xếp, khóa chuẩn hóa, trigram cho tìm kiếm gần đúng
+        **build_title_index(movies_merged['title']),
+    }
+
+
+print("\n[2/6] Đang xử lý dữ liệu và tạo features theo chunk...")
+movies, movies_key, hit = cache.run(
+    'movies', build_movies, data=file_digest('tmdb_5000_movies.csv'), credits=credits_key,
+    code=source_digest('features', 'ingest', 'recommender', 'title_index'))
+report_cache(f"movies-{movies_key}", hit)
+movies_data = movies['movies_data']
+if hit:
+    print(f"✓ {len(movies_data)} phim (không trùng title), features đã tạo sẵn")
+
 
 # 4. Vector hóa với TF-IDF
+def build_tfidf(stage_dir):
+    # Fit hai lượt trên file tạm: đếm term để chọn vocabulary + idf, rồi transform từng chunk
+    spill_path = os.path.join(movies.version_dir, 'combined_features.parquet')
+    tfidf_matrix, tfidf_vocabulary, tfidf_idf, params = fit_tfidf_chunks(
+        lambda: iter_text_chunks(spill_path, args.chunk_rows), tfidf_params)
+    return {
+        'tfidf_matrix': with_precision(tfidf_matrix, args.precision),
+        'tfidf_vocabulary': tfidf_vocabulary,  # Vocabulary + idf cho incremental update
+        'tfidf_idf': tfidf_idf,
+        'tfidf_params': params,
+    }
+
+
 print("\n[4/6] Đang vector hóa với TF-IDF...")
-tfidf = TfidfVectorizer(
-    max_features=5000,
-    stop_words='english',
-    ngram_range=(1, 2)
-)
-tfidf_matrix = tfidf.fit_transform(movies_merged['combined_features'])
+tfidf, tfidf_key, hit = cache.run(
+    'tfidf', build_tfidf, movies=movies_key, params=tfidf_params,
+    precision=args.precision, code=source_digest('features', 'ingest', 'precision'))
+report_cache(f"tfidf-{tfidf_key}", hit)
+tfidf_matrix = tfidf['tfidf_matrix']
 print(f"✓ TF-IDF matrix shape: {tfidf_matrix.shape}")
 
 # 5. Tính Cosine Similarity
 print("\n[5/6] Đang tính Cosine Similarity...")
-cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-print(f"✓ Cosine similarity matrix shape: {cosine_sim.shape}")
+ann, ann_key = {}, None
+if args.ann or args.similarity == 'ann':
+    ann, ann_key, hit = cache.run(
+        'ann', lambda stage_dir: dict(zip(('ann_centroids', 'ann_lists'),
+                                          build_ivf_index(tfidf_matrix, n_lists=args.ann_lists))),
+        tfidf=tfidf_key, n_lists=args.ann_lists, code=source_digest('ann_index'))
+    report_cache(f"ann-{ann_key}", hit)
+    print(f"✓ IVF index: {ann['ann_lists'].shape[0]} cụm")
+
+
+def build_neighbors(stage_dir):
+    if args.similarity == 'dense':
+        # Tính song song theo block dòng, ma trận N×N được ghi thẳng ra file tạm (memory-map)
+        neighbors, cosine_sim = build_similarity(tfidf_matrix, top_k=args.top_k, n_jobs=args.jobs,
+                                                 work_dir=work_dir.name, dense_precision=args.precision)
+        return {'neighbors': neighbors, 'cosine_sim': cosine_sim}
+    if args.similarity == 'ann':
+        # Top-K xấp xỉ: mỗi cụm chỉ so với n_probe cụm gần nhất
+        return {'neighbors': build_ann_neighbors(tfidf_matrix, ann['ann_centroids'], ann['ann_lists'],
+                                                 top_k=args.top_k, n_probe=args.ann_probe)}
+    # Chỉ giữ top-K hàng xóm mỗi phim (CSR int32 + float32), các block dòng tính song song
+    neighbors, _ = build_similarity(tfidf_matrix, top_k=args.top_k, n_jobs=args.jobs, work_dir=work_dir.name)
+    return {'neighbors': neighbors}
+
+
+similarity, similarity_key, hit = cache.run(
+    'similarity', build_neighbors, tfidf=tfidf_key, mode=args.similarity, top_k=args.top_k,
+    precision=args.precision if args.similarity == 'dense' else None,
+    ann=ann_key if args.similarity == 'ann' else None,
+    ann_probe=args.ann_probe if args.similarity == 'ann' else None,
+    code=source_digest('similarity', 'recommender', 'ann_index', 'precision'))
+report_cache(f"similarity-{similarity_key}", hit)
+neighbors, cosine_sim = similarity['neighbors'], similarity.get('cosine_sim')
+if cosine_sim is not None:
+    print(f"✓ Cosine similarity matrix shape: {cosine_sim.shape} ({args.precision}, {cosine_sim.nbytes / 1024**2:.1f} MB)")
+elif args.similarity == 'ann':
+    print(f"✓ ANN top-{args.top_k} neighbor index: {neighbors.nnz:,} cặp phim")
+else:
+    print(f"✓ Top-{neighbors.indptr[1]} neighbor index: {neighbors.nnz:,} cặp phim")
+
+embedding = {}
+if args.embedding_dim > 0:
+    # Embedding dày (N × d, chuẩn hóa L2): backend 'embedding' chấm điểm hồ sơ bằng một GEMV N × d
+    embedding, embedding_key, hit = cache.run(
+        'embedding', lambda stage_dir: dict(zip(('embedding', 'embedding_components'),
+                                                build_embedding(tfidf_matrix, args.embedding_dim))),
+        tfidf=tfidf_key, dim=args.embedding_dim, code=source_digest('embedding'))
+    report_cache(f"embedding-{embedding_key}", hit)
+    print(f"✓ Embedding SVD: {embedding['embedding'].shape} float32")
 
 # Tạo mapping
-indices = pd.Series(movies_merged.index, index=movies_merged['title']).drop_duplicates()
+indices = pd.Series(movies_data.index, index=movies_data['title']).drop_duplicates()
 
 # 6. Lưu model (BẢN NÂNG CẤP: Hỗ trợ HYBRID SYSTEM)
 print("\n[6/6] Đang lưu model với Hybrid System support...")
 data_to_save = {
-    'movies_data': movies_merged[['id', 'title', 'vote_average', 'vote_count', 'popularity', 
-                                   'genres_clean', 'overview', 'release_date', 'runtime',
-                                   'vote_avg_scaled', 'popularity_scaled', 'vote_count_scaled']],
-    'cosine_sim': cosine_sim,
+    'movies_data': movies_data,
+    'cosine_sim': cosine_sim,  # None ở chế độ topk
+    'neighbors': neighbors,  # Top-K neighbor index (CSR int32 + float32)
     'indices': indices,
     'model_type': 'hybrid',  # Đánh dấu model hỗ trợ Hybrid
-    'tfidf_matrix': tfidf_matrix  # Lưu TF-IDF matrix để tính toán advanced features
+    'similarity_mode': args.similarity,
+    'precision': args.precision,
+    'tfidf_matrix': tfidf_matrix,  # Lưu TF-IDF matrix để tính toán advanced features
+    'ann_centroids': ann.get('ann_centroids'),  # IVF index (None nếu không bật --ann)
+    'ann_lists': ann.get('ann_lists'),
+    'embedding': embedding.get('embedding'),  # Embedding SVD + ma trận chiếu (None nếu không bật --embedding-dim)
+    'embedding_components': embedding.get('embedding_components'),
+    **{name: tfidf[name] for name in ('tfidf_vocabulary', 'tfidf_idf', 'tfidf_params')},
+    # Genre bitset, popularity prior / head và title index tính ở bước features
+    **{name: movies[name] for name in movies if name not in ('movies_data', 'indices')},
 }
 
-with open('movie_recommender_model.pkl', 'wb') as f:
-    pickle.dump(data_to_save, f)
-
-file_size = os.path.getsize('movie_recommender_model.pkl') / (1024*1024)
-print(f"✓ Đã lưu model vào 'movie_recommender_model.pkl' ({file_size:.2f} MB)")
+# Ghi ra thư mục version mới (.npy/.parquet, không pickle) rồi chuyển CURRENT sang version đó
+version_dir = save_model(data_to_save, model_dir=args.output)
+dir_size = sum(os.path.getsize(os.path.join(version_dir, f)) for f in os.listdir(version_dir)) / (1024*1024)
+print(f"✓ Đã lưu model vào '{version_dir}' ({dir_size:.2f} MB)")
+del data_to_save, cosine_sim, neighbors, similarity
+work_dir.cleanup()
 
 print("\n" + "=" * 60)
 print("✅ HOÀN THÀNH! HYBRID MODEL đã sẵn sàng.")
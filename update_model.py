@@ -0,0 +1,149 @@
+"""
+Cập nhật model tăng dần (incremental) từ một file CSV delta, không train lại từ đầu
+- Dùng lại vocabulary + idf đã fit, chỉ transform các phim mới / thay đổi
+- Vá neighbor index (và cosine_sim / IVF index / embedding nếu có) cho các phim bị ảnh hưởng
+- Cập nhật indices, title index và các cột đã chuẩn hóa
+
+Ví dụ:
+    python update_model.py delta_movies.csv
+    python update_model.py delta_movies.csv --credits delta_credits.csv
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from features import (MODEL_COLUMNS, NUM_COLS, add_features, fill_missing, merge_credit_features,
+                      read_credit_features, restore_vectorizer, scale_numeric)
+from recommender import build_genre_bits, popularity_head, popularity_prior, update_neighbors
+from ann_index import update_ivf_lists
+from embedding import project
+from model_store import MODEL_DIR, LazyModel, open_model, save_model
+from similarity import patch_similarity
+from title_index import build_title_index
+
+parser = argparse.ArgumentParser(description="Cập nhật model gợi ý phim với các phim mới / thay đổi")
+parser.add_argument('delta', help="File CSV cùng định dạng tmdb_5000_movies.csv, chỉ chứa phim mới / thay đổi")
+parser.add_argument('--credits', default='tmdb_5000_credits.csv',
+                    help="File credits chứa cast/crew của các phim trong delta (bỏ qua nếu delta đã có cột cast/crew)")
+parser.add_argument('--model-dir', default=MODEL_DIR, help="Thư mục model cần cập nhật")
+args = parser.parse_args()
+
+start_time = time.perf_counter()
+# File tạm của ma trận dense đã vá (memory-map), xóa sau khi lưu model
+work_dir = tempfile.TemporaryDirectory(prefix='tmdb_update_')
+print("=" * 60)
+print("🎬 TMDB MOVIE RECOMMENDER - INCREMENTAL UPDATE")
+print("=" * 60)
+
+# 1. Load model hiện tại
+print("\n[1/5] Đang load model hiện tại...")
+model = open_model(args.model_dir)
+if not isinstance(model, LazyModel) or 'tfidf_vocabulary' not in model:
+    raise SystemExit("❌ Model chưa lưu vocabulary TF-IDF, hãy chạy train_model.py trước.")
+movies_data = model['movies_data'].copy()
+n_old = len(movies_data)
+print(f"✓ Model {model.version}: {n_old} phim")
+
+# 2. Đọc và xử lý delta
+print("\n[2/5] Đang xử lý file delta...")
+delta = pd.read_csv(args.delta).drop_duplicates(subset=['id'], keep='last')
+if not {'cast', 'crew'}.issubset(delta.columns):
+    delta = merge_credit_features(delta, read_credit_features(args.credits, ids=delta['id']))
+delta = fill_missing(delta, medians=movies_data[NUM_COLS].median())
+delta = add_features(delta).drop_duplicates(subset=['title'], keep='last').reset_index(drop=True)
+
+# Ghép theo id: phim đã có -> thay đổi, phim chưa có -> thêm mới
+position_by_id = pd.Series(np.arange(n_old), index=movies_data['id'].values)
+id_by_title = pd.Series(movies_data['id'].values, index=movies_data['title'].values)
+is_existing = delta['id'].isin(position_by_id.index)
+title_owner = delta['title'].map(id_by_title)
+# Giữ title là duy nhất như khi train: bỏ phim mới trùng title với phim khác trong catalog
+conflict = title_owner.notna() & (title_owner != delta['id'])
+if conflict.any():
+    print(f"⚠️ Bỏ qua {int(conflict.sum())} phim trùng title với phim khác trong catalog")
+delta = delta[~conflict].reset_index(drop=True)
+is_existing = is_existing[~conflict].reset_index(drop=True)
+
+changed_rows = delta[is_existing]
+new_rows = delta[~is_existing]
+changed_positions = position_by_id[changed_rows['id']].values
+new_positions = np.arange(n_old, n_old + len(new_rows))
+print(f"✓ {len(changed_rows)} phim thay đổi, {len(new_rows)} phim mới")
+if len(delta) == 0:
+    raise SystemExit("Không có gì để cập nhật.")
+
+# 3. Cập nhật movies_data, indices và các cột đã chuẩn hóa
+print("\n[3/5] Đang cập nhật metadata và chuẩn hóa...")
+base_columns = [col for col in MODEL_COLUMNS if not col.endswith('_scaled')]
+movies_data.loc[changed_positions, base_columns] = changed_rows[base_columns].values
+movies_data = pd.concat([movies_data, new_rows[base_columns]], ignore_index=True)
+movies_data = scale_numeric(movies_data)[MODEL_COLUMNS]
+if 'genre_bits' in model:
+    old_genre_bits, old_genre_names = model['genre_bits'], model['genre_names']
+else:
+    old_genre_bits, old_genre_names = build_genre_bits(model['movies_data']['genres_clean'].str.split())
+delta_genre_bits, genre_names = build_genre_bits(
+    pd.concat([changed_rows, new_rows])['genres_list'], old_genre_names
+)
+genre_bits = np.concatenate([old_genre_bits, delta_genre_bits[len(changed_rows):]])
+genre_bits[changed_positions] = delta_genre_bits[:len(changed_rows)]
+print(f"✓ Catalog mới: {len(movies_data)} phim")
+
+# 4. TF-IDF cho các phim mới / thay đổi bằng vocabulary đã fit
+print("\n[4/5] Đang vector hóa các phim thay đổi...")
+tfidf = restore_vectorizer(model['tfidf_vocabulary'], model['tfidf_idf'], model['tfidf_params'])
+old_matrix = model['tfidf_matrix']
+delta_matrix = tfidf.transform(pd.concat([changed_rows, new_rows])['combined_features']).astype(old_matrix.dtype)
+# Dòng i của catalog mới lấy từ dòng take[i] của ma trận xếp chồng [cũ; thay đổi; mới]
+take = np.arange(n_old + len(new_rows))
+take[changed_positions] = n_old + np.arange(len(changed_rows))
+take[n_old:] = n_old + len(changed_rows) + np.arange(len(new_rows))
+tfidf_matrix = sparse.vstack([old_matrix, delta_matrix], format='csr')[take]
+print(f"✓ TF-IDF matrix shape: {tfidf_matrix.shape}")
+
+# 5. Vá similarity / neighbor index cho các phim bị ảnh hưởng
+print("\n[5/5] Đang cập nhật neighbor index...")
+affected = np.concatenate([changed_positions, new_positions])
+old_neighbors = model['neighbors']
+top_k = int(np.diff(old_neighbors.indptr).max())
+neighbors = update_neighbors(old_neighbors, tfidf_matrix, affected, top_k=top_k)
+
+data_to_save = {name: model[name] for name in model if name != 'indices'}
+data_to_save.update({
+    'movies_data': movies_data,
+    'tfidf_matrix': tfidf_matrix,
+    'neighbors': neighbors,
+    'genre_bits': genre_bits,
+    'genre_names': genre_names,
+    'popularity_prior': popularity_prior(movies_data),
+    'popularity_head': popularity_head(popularity_prior(movies_data)),
+    **build_title_index(movies_data['title']),
+})
+if 'cosine_sim' in model:
+    # Model dense: vá các dòng / cột của phim bị ảnh hưởng theo block dòng, ghi thẳng ra file tạm
+    # (memory-map) với precision của model thay vì dựng bản N×N trong bộ nhớ
+    precision = model.get('precision', str(model['cosine_sim'].dtype))
+    data_to_save['cosine_sim'] = patch_similarity(model['cosine_sim'], tfidf_matrix, affected, work_dir.name,
+                                                  precision=precision)
+if 'embedding' in model:
+    # Chiếu các phim thay đổi / mới bằng ma trận chiếu SVD đã fit, xếp dòng giống tfidf_matrix
+    delta_embedding = project(delta_matrix, model['embedding_components'])
+    data_to_save['embedding'] = np.concatenate([model['embedding'], delta_embedding])[take]
+if 'ann_lists' in model:
+    data_to_save['ann_lists'] = update_ivf_lists(model['ann_lists'], model['ann_centroids'],
+                                                 tfidf_matrix, affected)
+print(f"✓ Đã cập nhật {len(affected)} phim bị ảnh hưởng")
+
+version_dir = save_model(data_to_save, model_dir=args.model_dir)
+print(f"✓ Đã lưu model vào '{version_dir}'")
+del data_to_save
+work_dir.cleanup()
+
+print("\n" + "=" * 60)
+print(f"✅ HOÀN THÀNH trong {time.perf_counter() - start_time:.2f}s")
+print("=" * 60)